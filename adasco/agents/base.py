@@ -3,9 +3,13 @@ from __future__ import division
 
 import multiprocessing
 import logging
+import pickle
+import os
 
 from adasco.cluster import ClusterSequence
 import adasco.preprocessor
+import adasco.turns
+import adasco.timing
 import adasco.messaging
 
 logger = logging.getLogger(__name__)
@@ -21,10 +25,12 @@ class BaseAgent(multiprocessing.Process):
         self.Y = kwargs.get('Y')
         self.Gmin = kwargs.get('Gmin')
         self.Gmax = kwargs.get('Gmax')
+        self.timing = adasco.timing.PhaseTiming.build(self.phases or [], self.Gmin or {}, self.Gmax or {}, self.Y or {})
         self.incoming_edges = kwargs.get('incoming_edges')
         self.outgoing_edges = kwargs.get('outgoing_edges')
         self.edge_lengths = kwargs.get('edge_lengths')
         self.turn_proportions = kwargs.get('turn_proportions')
+        self.turn_index = adasco.turns.TurnIndex(self.turn_proportions or [])
         self.upstream_agents = kwargs.get('upstream_agents')
         self.startup_lost_time = kwargs.get('startup_lost_time')
         self.free_flow_speed = kwargs.get('free_flow_speed')
@@ -36,9 +42,9 @@ class BaseAgent(multiprocessing.Process):
         self.horizon_extension = kwargs.get('horizon_extension')
         self.extension_threshold = kwargs.get('extension_threshold')
         self.minimum_extension = kwargs.get('minimum_extension')
-        self.shared_results_directory = kwargs.get('shared_results_directory')
-        self.shared_lock = kwargs.get('shared_lock')
-        self.publish_directory = kwargs.get('publish_directory')
+        self.outflow_board = kwargs.get('outflow_board')
+        # Directory in which planning problems are recorded (None to disable)
+        self.record_directory = kwargs.get('record_directory')
         self.request_queue = kwargs.get('request_queue')
         self.response_queue = kwargs.get('response_queue')
         self.min_cluster_size = 0.1
@@ -48,12 +54,11 @@ class BaseAgent(multiprocessing.Process):
                                                                   self.time_resolution,
                                                                   self.sampling_interval,
                                                                   self.min_cluster_size,
-                                                                  self.merging_threshold)
+                                                                  self.merging_threshold,
+                                                                  kwargs.get('vectorised_preprocessor', False))
 
     def get_next_phase(self, phase):
-        phase_index = self.phases.index(phase)
-        next_phase_index = (phase_index + 1) % len(self.phases)
-        return self.phases[next_phase_index]
+        return self.timing.next_phase(phase)
 
     def run(self):
         while True:
@@ -67,10 +72,15 @@ class BaseAgent(multiprocessing.Process):
                                                   request.curr_phase_duration,
                                                   request.curr_time)
 
-            response = adasco.messaging.Response(extension, decision_point)
+            response = adasco.messaging.Response(extension, decision_point, self.id)
             self.response_queue.put(response)
 
             self.request_queue.task_done()
 
     def plan(self, sensor_data, curr_phase, curr_phase_duration, curr_time):
         pass
+
+    def record(self, curr_time, decision):
+        path = os.path.join(self.record_directory, '{}_{}.pkl'.format(self.id, curr_time))
+        with open(path, 'wb') as fp:
+            pickle.dump(decision, fp, pickle.HIGHEST_PROTOCOL)
@@ -1,13 +1,15 @@
 from __future__ import print_function
 from __future__ import division
 
-from copy import deepcopy
 from math import ceil
 from collections import namedtuple
 from collections import Counter
 import logging
 import timeit
-import Queue
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 import pickle
 import pprint
 
@@ -33,7 +35,10 @@ class HindsightAgent(BaseAgent):
                                                  self.Y,
                                                  self.startup_lost_time,
                                                  self.timelimit,
-                                                 self.cycle_count)
+                                                 self.cycle_count,
+                                                 model_cache_size=kwargs.get('cp_model_cache', 0),
+                                                 threads=kwargs.get('cp_threads', 1),
+                                                 backend=kwargs.get('backend', 'cp'))
         self.actions = None
         self.max_extension = 5
 
@@ -52,12 +57,10 @@ class HindsightAgent(BaseAgent):
 
         start_sampling = timeit.default_timer()
 
-        per_edge_samples = []
-
         for index in range(self.sample_count):
             # logger.debug('{}: Generating sample # {}'.format(self.id, index))
 
-            tmp_sensor_data = deepcopy(sensor_data)
+            tmp_sensor_data = dict(sensor_data)
 
             if self.coordinate:
                 for edge, edge_samples in non_local_samples.items():
@@ -66,20 +69,19 @@ class HindsightAgent(BaseAgent):
                         # logger.debug('{}: Adding extension {} to sensor data'.format(self.id, non_local_arrivals))
                         
                         non_local_arrival_IDs = [arrival.ID for arrival in non_local_arrivals] 
-                        tmp_sensor_data[edge].arriving_vehicle_ids.extend(non_local_arrival_IDs)
 
                         non_local_arrival_times = [arrival.time for arrival in non_local_arrivals]
                         non_local_vehicle_positions = self.get_distance_from_junction(non_local_arrival_times)
-                        tmp_sensor_data[edge].arriving_vehicle_positions.extend(non_local_vehicle_positions)
+                        tmp_sensor_data[edge] = sensor_data[edge].with_arrivals(non_local_arrival_IDs,
+                                                                                non_local_vehicle_positions)
 
-            sample, per_edge_sample = self.preprocessor.pick_sample_for_sensor_data(tmp_sensor_data, self.samples, index, self.phases)
+            sample = self.preprocessor.pick_sample_for_sensor_data(tmp_sensor_data, self.samples, index, self.phases)
 
             cluster_count = sample.cluster_count
             if cluster_count == 0:
                 break
 
             samples.append(sample)
-            per_edge_samples.append(per_edge_sample)
 
         # with open('{}-{}.pkl'.format(self.id.replace('/', '-'), curr_time), 'w') as fp:
         #     pickle.dump(per_edge_samples, fp)
@@ -165,7 +167,6 @@ class HindsightAgent(BaseAgent):
             if self.coordinate:
                 vehicle_departures = self.calculate_vehicle_departures(cluster_departures, sample_groups)
                 self.publish_results(vehicle_departures, curr_time)
-                logger.debug('{}: Published results = {}'.format(self.id, self.shared_results_directory))
 
         else:
             # logger.debug('{}: No inflow, moving on to next phase'.format(self.id))
@@ -187,11 +188,10 @@ class HindsightAgent(BaseAgent):
 
             non_local_samples[incoming_edge] = Queue.Queue()
             
-            with self.shared_lock:
-                try:
-                    samples = self.shared_results_directory[agentID][incoming_edge]
-                except KeyError:
-                    continue
+            try:
+                samples = self.outflow_board.read_departures(agentID, incoming_edge)
+            except KeyError:
+                continue
             
             # logger.debug('{}: Outflow samples from agent {} = {}'.format(self.id, agentID, samples))
             # logger.debug('{}: Obtaining slice {} : {}'.format(self.id, step, step + self.horizon_extension))
@@ -223,12 +223,7 @@ class HindsightAgent(BaseAgent):
         # logger.debug('{}: departures after converting to absolute time = {}'.format(self.id, departures))
 
         # Ridiculous, circular assignments; simplify this!
-        with self.shared_lock:
-            self.publish_directory.clear()
-            # Why not self.publish_directory = departures?
-            for edge, samples in departures.items():
-                self.publish_directory[edge] = samples
-            self.shared_results_directory[self.id] = self.publish_directory
+        self.outflow_board.publish_departures(self.id, departures)
 
     # TODO: Simplify this function
     def calculate_vehicle_departures(self, departures, sample_groups):
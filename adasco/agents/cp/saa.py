@@ -1,13 +1,15 @@
 from __future__ import print_function
 from __future__ import division
 
-from copy import deepcopy
 from math import ceil
 from collections import namedtuple
 from collections import Counter
 import logging
 import timeit
-import Queue
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 import pickle
 
 from adasco.agents.base import BaseAgent
@@ -25,14 +27,38 @@ class SAAAgent(BaseAgent):
         self.sample_count = kwargs.get('sample_count')
         self.timelimit = kwargs.get('timelimit')
         [self.samples] = kwargs.get('samples')
-        self.cycle_count = 3
-        self.scheduler = adasco.schedulers.cp.CP(self.phases,
-                                                 self.Gmin,
-                                                 self.Gmax,
-                                                 self.Y,
-                                                 self.startup_lost_time,
-                                                 self.timelimit,
-                                                 self.cycle_count)
+        # Cycles of every plan, or the most cycles of a plan with adaptive
+        # cycles, see CP.adapt_cycle_count
+        self.cycle_count = kwargs.get('max_cycle_count', 3)
+        self.scheduler = self.get_scheduler(**kwargs)
+        # Whether each solve starts from the previous plan, shifted to the
+        # current time, and the time and phase of the previous plan
+        self.warm_start = kwargs.get('warm_start', False)
+        self.previous_decision = None
+        # Whether plans are computed for the representative_samples most
+        # frequent samples and evaluated on all, see
+        # CP.schedule_by_decomposition
+        self.decomposition = kwargs.get('decomposition', False)
+        self.representative_samples = kwargs.get('representative_samples', 2)
+
+    def get_scheduler(self, **kwargs):
+        return adasco.schedulers.cp.CP(self.phases,
+                                       self.Gmin,
+                                       self.Gmax,
+                                       self.Y,
+                                       self.startup_lost_time,
+                                       self.timelimit,
+                                       self.cycle_count,
+                                       model_cache_size=kwargs.get('cp_model_cache', 0),
+                                       threads=kwargs.get('cp_threads', 1),
+                                       workers=kwargs.get('cp_workers', 1),
+                                       adaptive_cycles=kwargs.get('adaptive_cycles', False),
+                                       backend=kwargs.get('backend', 'cp'))
+
+    def run(self):
+        super(SAAAgent, self).run()
+        # Stop the planning workers, if they were started
+        self.scheduler.close()
 
     def plan(self, sensor_data, curr_phase, curr_phase_duration, curr_time):
 
@@ -46,7 +72,7 @@ class SAAAgent(BaseAgent):
             non_local_samples = self.get_non_local_samples(curr_time)
 
         for index in range(self.sample_count):
-            extended_sensor_data = deepcopy(sensor_data)
+            extended_sensor_data = dict(sensor_data)
             
             if self.coordinate:
                 for edge, edge_samples in non_local_samples.items():
@@ -54,11 +80,11 @@ class SAAAgent(BaseAgent):
                         non_local_arrivals = edge_samples.get()
                         
                         non_local_arrival_IDs = [arrival.ID for arrival in non_local_arrivals] 
-                        extended_sensor_data[edge].arriving_vehicle_ids.extend(non_local_arrival_IDs)
 
                         non_local_arrival_times = [arrival.time for arrival in non_local_arrivals]
                         non_local_vehicle_positions = self.get_distance_from_junction(non_local_arrival_times)
-                        extended_sensor_data[edge].arriving_vehicle_positions.extend(non_local_vehicle_positions)
+                        extended_sensor_data[edge] = sensor_data[edge].with_arrivals(non_local_arrival_IDs,
+                                                                                     non_local_vehicle_positions)
 
             sample = self.preprocessor.pick_sample_for_sensor_data(extended_sensor_data, self.samples, index, self.phases)
 
@@ -82,11 +108,42 @@ class SAAAgent(BaseAgent):
                 distinct_samples.append(sample)
                 sample_groups.append([s for s in samples if s == sample])
 
-            extension, cluster_departures = self.scheduler.schedule_over_all_samples(inflows,
-                                                                                     weights,
-                                                                                     curr_phase,
-                                                                                     curr_phase_duration,
-                                                                                     status_file='{}-{}.json'.format(self.id.replace('/', ''), curr_time))
+            if self.record_directory is not None:
+                self.record(curr_time, {'phases': self.phases,
+                                        'Gmin': self.Gmin,
+                                        'Gmax': self.Gmax,
+                                        'Y': self.Y,
+                                        'startup_lost_time': self.startup_lost_time,
+                                        'inflows': inflows,
+                                        'weights': weights,
+                                        'curr_phase': curr_phase,
+                                        'curr_phase_duration': curr_phase_duration,
+                                        'curr_time': curr_time})
+
+            starting_plan = None
+            if self.warm_start and self.scheduler.last_plan is not None:
+                previous_time, previous_phase = self.previous_decision
+                starting_plan = self.scheduler.shift_plan(self.scheduler.last_plan,
+                                                          curr_time - previous_time,
+                                                          previous_phase,
+                                                          curr_phase)
+
+            if self.decomposition:
+                extension, cluster_departures = self.scheduler.schedule_by_decomposition(inflows,
+                                                                                         weights,
+                                                                                         curr_phase,
+                                                                                         curr_phase_duration,
+                                                                                         self.representative_samples,
+                                                                                         status_file='{}-{}.json'.format(self.id.replace('/', ''), curr_time),
+                                                                                         starting_plan=starting_plan)
+            else:
+                extension, cluster_departures = self.scheduler.schedule_over_all_samples(inflows,
+                                                                                         weights,
+                                                                                         curr_phase,
+                                                                                         curr_phase_duration,
+                                                                                         status_file='{}-{}.json'.format(self.id.replace('/', ''), curr_time),
+                                                                                         starting_plan=starting_plan)
+            self.previous_decision = (curr_time, curr_phase)
 
             time_plan = timeit.default_timer() - start_plan
             logger.debug('Time for planning = {}'.format(time_plan))
@@ -121,11 +178,10 @@ class SAAAgent(BaseAgent):
 
             non_local_samples[incoming_edge] = Queue.Queue()
             
-            with self.shared_lock:
-                try:
-                    samples = self.shared_results_directory[agentID][incoming_edge]
-                except KeyError:
-                    continue
+            try:
+                samples = self.outflow_board.read_departures(agentID, incoming_edge)
+            except KeyError:
+                continue
             
             for sample in samples:
                 departures = adasco.utils.slice(sample, curr_time, curr_time + self.horizon_extension)
@@ -191,12 +247,7 @@ class SAAAgent(BaseAgent):
                 for index, departure in enumerate(sample):
                     sample[index] = Departure(departure.ID, departure.time + curr_time)
 
-        # TODO: Simplify this
-        with self.shared_lock:
-            self.publish_directory.clear()
-            for edge, samples in departures.items():
-                self.publish_directory[edge] = samples
-            self.shared_results_directory[self.id] = self.publish_directory
+        self.outflow_board.publish_departures(self.id, departures)
 
 
 Departure = namedtuple('Departure', ['ID', 'time'])
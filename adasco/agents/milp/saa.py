@@ -0,0 +1,37 @@
+from __future__ import print_function
+from __future__ import division
+
+import logging
+
+import adasco.agents.cp.saa
+import adasco.schedulers.milp
+
+logger = logging.getLogger(__name__)
+
+
+class SAAAgent(adasco.agents.cp.saa.SAAAgent):
+    # The SAA agent of adasco.agents.cp.saa, planning with the time-indexed
+    # MILP scheduler instead of CP. The MILP scheduler has no warm start,
+    # decomposition or adaptive cycles, and asking for them is an error.
+    #
+    # The MILP lets the clusters of a phase be served out of order, so it
+    # solves a relaxation of the CP model. The extension is taken from the
+    # phase plan of that relaxation, and only the delay and departures of
+    # the plan are those of the CP model (see MILP).
+
+    UNSUPPORTED = ('warm_start', 'decomposition', 'adaptive_cycles')
+
+    def __init__(self, *args, **kwargs):
+        unsupported = [option for option in self.UNSUPPORTED if kwargs.get(option)]
+        if unsupported:
+            raise ValueError('The MILP scheduler does not support {}'.format(', '.join(unsupported)))
+        super(SAAAgent, self).__init__(*args, **kwargs)
+
+    def get_scheduler(self, **kwargs):
+        return adasco.schedulers.milp.MILP(self.phases,
+                                           self.Gmin,
+                                           self.Gmax,
+                                           self.Y,
+                                           self.startup_lost_time,
+                                           self.timelimit,
+                                           self.cycle_count)
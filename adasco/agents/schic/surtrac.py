@@ -11,19 +11,49 @@ import adasco.schedulers.schic
 
 logger = logging.getLogger(__name__)
 
+SCHIC_ENGINES = {'dict': adasco.schedulers.schic.SchIC,
+                 'dense': adasco.schedulers.schic.DenseSchIC,
+                 'incremental': adasco.schedulers.schic.IncrementalSchIC,
+                 'parallel': adasco.schedulers.schic.ParallelSchIC}
+
 
 class SURTRACAgent(BaseAgent):
     def __init__(self, *args, **kwargs):
         super(SURTRACAgent, self).__init__(*args, **kwargs)
-        self.scheduler = adasco.schedulers.schic.SchIC(self.phases,
-                                                         self.Gmin,
-                                                         self.Gmax,
-                                                         self.Y,
-                                                         self.startup_lost_time)
+        engine = kwargs.get('schic_engine', 'dict')
+        scheduler_kwargs = {}
+        if engine == 'parallel':
+            scheduler_kwargs = {'workers': kwargs.get('schic_workers'),
+                                'parallel_threshold': kwargs.get('parallel_threshold', 100000)}
+        self.scheduler = SCHIC_ENGINES[engine](self.phases,
+                                               self.Gmin,
+                                               self.Gmax,
+                                               self.Y,
+                                               self.startup_lost_time,
+                                               beam_width=kwargs.get('beam_width'),
+                                               prune_dominated=kwargs.get('prune_dominated', False),
+                                               timing=self.timing,
+                                               **scheduler_kwargs)
+        # Wall-clock budget per plan in seconds and maximum number of
+        # clusters scheduled per plan (None for no limit)
+        self.planning_budget = kwargs.get('planning_budget')
+        self.cluster_cap = kwargs.get('cluster_cap')
+        # How clusters that would exceed Gmax are rescheduled, see
+        # SchIC.schedule_within_gmax. The split dynamic program runs on the
+        # states of the dict engine whatever the engine, so the other engines
+        # only speed up resolve.
+        self.gmax_mode = kwargs.get('gmax_mode') or 'split'
+        if engine == 'incremental' and self.gmax_mode == 'split':
+            logger.warning('The incremental SchIC engine only reuses states with the resolve Gmax mode')
+
+    def run(self):
+        super(SURTRACAgent, self).run()
+        # Stop the worker pool of the parallel engine, if it was started
+        if isinstance(self.scheduler, adasco.schedulers.schic.ParallelSchIC):
+            self.scheduler.close()
 
     def switch_back(self, phase):
-        min_cycle = sum(self.Gmin.values()) + sum(self.Y.values())
-        return min_cycle - self.Gmin[phase]
+        return self.timing.switch_back(phase)
 
     def count_to_ratio(self, road_count):
         road_ratio = {}
@@ -44,10 +74,10 @@ class SURTRACAgent(BaseAgent):
             original_cluster = inflow[phase][curr_cluster[phase]]
             curr_cluster[phase] += 1
             for incoming_edge, split_ratio in road_ratio[phase][original_cluster.arrival].items():
-                turns_from_edge = self._get_normalized_turn_ratios(incoming_edge, phase)
+                turns_from_edge = self.turn_index.normalized_turns(incoming_edge, phase)
                 for turn in turns_from_edge:
-                    outgoing_edge = turn['outgoing_edge']
-                    turn_probability = turn['probability']
+                    outgoing_edge = turn.outgoing_edge
+                    turn_probability = turn.probability
                     outflow_to_edge = outgoing_cluster.expected_proportion(split_ratio*turn_probability, self.min_cluster_size)
                     if outflow_to_edge:
                         try:
@@ -57,27 +87,7 @@ class SURTRACAgent(BaseAgent):
                     else:
                         pass
         
-        with self.shared_lock:
-            self.publish_directory.clear()
-            for edge, outflow in outflow_by_edge.items():
-                self.publish_directory[edge] = outflow
-            self.shared_results_directory[self.id] = self.publish_directory
-
-    def _get_normalized_turn_ratios(self, incoming_edge, phase):
-        normalized_turns = []
-        turns_from_edge = [turn for turn in self.turn_proportions
-                           if turn['phase'] == phase
-                           and turn['incoming_edge'] == incoming_edge]
-        total_outflow = sum([turn['probability'] for turn in turns_from_edge])
-        # Normalize turn probabilities
-        for turn in turns_from_edge:
-            normalized_turn = {}
-            normalized_turn['incoming_edge'] = turn['incoming_edge']
-            normalized_turn['outgoing_edge'] = turn['outgoing_edge']
-            normalized_turn['phase'] = turn['phase']
-            normalized_turn['probability'] = turn['probability'] / total_outflow
-            normalized_turns.append(normalized_turn)
-        return normalized_turns
+        self.outflow_board.publish_clusters(self.id, outflow_by_edge)
 
     def plan(self, sensor_data, curr_phase, curr_phase_duration, curr_time):
 
@@ -87,6 +97,7 @@ class SURTRACAgent(BaseAgent):
         logger.debug('Queue length = {}'.format([data.queue_length for edge, data in sensor_data.items()]))
 
         start_plan = timeit.default_timer()
+        deadline = None if self.planning_budget is None else start_plan + self.planning_budget
 
         roadflow = self.preprocessor.get_roadflow(sensor_data)
         
@@ -98,7 +109,7 @@ class SURTRACAgent(BaseAgent):
         
         inflow, road_count = self.preprocessor.get_inflow_from_roadflow(roadflow,
                                                                         self.phases,
-                                                                        self.turn_proportions)
+                                                                        self.turn_index)
         
         # Aggregate by threshold
         for phase, sequence in inflow.items():
@@ -116,15 +127,42 @@ class SURTRACAgent(BaseAgent):
 
         cluster_count = sum([len(sequence) for sequence in inflow.values()])
 
+        if self.record_directory is not None and cluster_count > 0:
+            self.record(curr_time, {'phases': self.phases,
+                                    'Gmin': self.Gmin,
+                                    'Gmax': self.Gmax,
+                                    'Y': self.Y,
+                                    'startup_lost_time': self.startup_lost_time,
+                                    'inflow': inflow,
+                                    'road_ratio': road_ratio,
+                                    'curr_phase': curr_phase,
+                                    'curr_phase_duration': curr_phase_duration,
+                                    'curr_time': curr_time,
+                                    # Input of the preprocessor, see
+                                    # utils/benchmarks/preprocessor_equivalence.py
+                                    'sensor_data': sensor_data,
+                                    'turn_proportions': self.turn_proportions,
+                                    'preprocessor': {'saturation_flow_rate': self.preprocessor.saturation_flow_rate,
+                                                     'free_flow_speed': self.preprocessor.free_flow_speed,
+                                                     'time_resolution': self.preprocessor.time_resolution,
+                                                     'sampling_interval': self.preprocessor.sampling_interval,
+                                                     'min_cluster_size': self.preprocessor.min_cluster_size,
+                                                     'merging_threshold': self.preprocessor.merging_threshold}})
+
         if cluster_count > 0:
             outflow, phase_sequence, phase_duration, updated_inflow, updated_road_ratio = self.get_feasible_control_flow(inflow,
                                                                                                                          curr_phase,
                                                                                                                          curr_phase_duration,
                                                                                                                          curr_time,
-                                                                                                                         road_ratio)
+                                                                                                                         road_ratio,
+                                                                                                                         deadline)
 
             time_plan = timeit.default_timer() - start_plan
             logger.debug('Time for planning = {}'.format(time_plan))
+            if isinstance(self.scheduler, adasco.schedulers.schic.IncrementalSchIC):
+                logger.debug('{}: Scheduler reuse = {} (rate = {:.3f})'.format(self.id,
+                                                                              self.scheduler.reuse_counts,
+                                                                              self.scheduler.reuse_rate))
 
             if phase_sequence[0] != curr_phase or inflow[curr_phase][0].arrival >= (curr_time + self.switch_back(curr_phase)):
                 extension = 0
@@ -158,11 +196,10 @@ class SURTRACAgent(BaseAgent):
             incoming_edge = agent['connecting_edge']
             agent_id = agent['id']
             
-            with self.shared_lock:
-                try:
-                    outflow = self.shared_results_directory[agent_id][incoming_edge]
-                except KeyError:
-                    continue
+            try:
+                outflow = self.outflow_board.read_clusters(agent_id, incoming_edge)
+            except KeyError:
+                continue
                     
             extension = outflow.slice(curr_time, curr_time + self.horizon_extension, self.min_cluster_size)
             lane_traversal_time = self.edge_lengths[incoming_edge] / self.free_flow_speed
@@ -173,71 +210,42 @@ class SURTRACAgent(BaseAgent):
             except KeyError:
                 roadflow[incoming_edge] = extension
 
-    def get_feasible_control_flow(self, inflow, curr_phase, curr_phase_duration, curr_time, road_ratio):
- 
+    def get_feasible_control_flow(self, inflow, curr_phase, curr_phase_duration, curr_time, road_ratio, deadline=None):
+
         outflow = ClusterSequence()
         phase_sequence = []
         phase_duration = []
         updated_inflow = {phase: ClusterSequence() for phase in inflow}
         updated_road_ratio = {phase: {} for phase in inflow}
-        
-        violation_time = None
-        
-        tmp_curr_phase = curr_phase
-        tmp_curr_phase_duration = curr_phase_duration
-        tmp_curr_time = curr_time
-        tmp_inflow = {phase: sequence.copy() for phase, sequence in inflow.items()}
-
-        while violation_time != float('inf'):
-
-            violation_time = float('inf')
-            tmp_outflow, tmp_phase_sequence, tmp_phase_duration = self.scheduler.schedule(tmp_inflow,
-                                                                                          tmp_curr_phase,
-                                                                                          tmp_curr_phase_duration,
-                                                                                          tmp_curr_time)
-            
-            curr_index = 0
-
-            for cluster, phase, duration in zip(tmp_outflow, tmp_phase_sequence, tmp_phase_duration):
-                cluster_from_inflow = tmp_inflow[phase][0]
-                if duration > self.Gmax[phase]:
-                    violation_time = cluster.departure - (duration - self.Gmax[phase])
-                    if violation_time < cluster.arrival:
-                        if curr_index == 0:
-                            violation_time = tmp_curr_time
-                        else:
-                            previous_cluster = tmp_outflow[curr_index-1]
-                            violation_time = previous_cluster.departure
-
-                    unviolated_outflow, violated_outflow = cluster.split(violation_time, self.min_cluster_size)
-                    unviolated_ratio = 1 - (violated_outflow.count / cluster.count)
-                    unviolated_inflow, violated_inflow = cluster_from_inflow.split_by_ratio(unviolated_ratio, self.min_cluster_size)
-
-                    tmp_inflow[phase].set(0, violated_inflow)
-                    road_ratio[phase][violated_inflow.arrival] = road_ratio[phase][cluster_from_inflow.arrival]
-
-                    if unviolated_outflow:
-
-                        outflow.append(unviolated_outflow)
-                        phase_sequence.append(phase)
-                        phase_duration.append(self.Gmax[phase])
-                        updated_inflow[phase].append(unviolated_inflow)
-                        updated_road_ratio[phase][unviolated_inflow.arrival] = road_ratio[phase][cluster_from_inflow.arrival]
-
-                    tmp_curr_time = violation_time + self.Y[phase]
-                    tmp_curr_phase = self.get_next_phase(phase)
-                    tmp_curr_phase_duration = 0
-
-                    break
-                else:
-                    outflow.append(cluster)
-                    phase_sequence.append(phase)
-                    phase_duration.append(duration)
-                    scheduled_cluster = tmp_inflow[phase].pop(0)
-                    if scheduled_cluster:
-                        updated_inflow[phase].append(scheduled_cluster)
-                        updated_road_ratio[phase][scheduled_cluster.arrival] = deepcopy(road_ratio[phase][cluster_from_inflow.arrival])
-
-                curr_index += 1
+
+        segments, truncated = self.scheduler.schedule_within_gmax(inflow,
+                                                                  curr_phase,
+                                                                  curr_phase_duration,
+                                                                  curr_time,
+                                                                  self.min_cluster_size,
+                                                                  mode=self.gmax_mode,
+                                                                  deadline=deadline,
+                                                                  cluster_cap=self.cluster_cap)
+        if not segments:
+            # Nothing was scheduled within the budget or cap: plan only the
+            # earliest cluster, which takes a single layer of the DP
+            segments, truncated = self.scheduler.schedule_within_gmax(inflow,
+                                                                      curr_phase,
+                                                                      curr_phase_duration,
+                                                                      curr_time,
+                                                                      self.min_cluster_size,
+                                                                      mode=self.gmax_mode,
+                                                                      cluster_cap=1)
+        if truncated:
+            # Clusters left out of a truncated plan are not scheduled
+            logger.debug('{}: Truncated plan at time {}'.format(self.id, curr_time))
+
+        for segment in segments:
+            outflow.append(segment.cluster)
+            phase_sequence.append(segment.phase)
+            phase_duration.append(segment.duration)
+            updated_inflow[segment.phase].append(segment.inflow_cluster)
+            # Parts of a split cluster share the road ratio of the original cluster
+            updated_road_ratio[segment.phase][segment.inflow_cluster.arrival] = deepcopy(road_ratio[segment.phase][segment.source])
 
         return outflow, phase_sequence, phase_duration, updated_inflow, updated_road_ratio
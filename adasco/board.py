@@ -0,0 +1,200 @@
+'''
+Outflow boards through which coordinated agents share their planned outflows
+'''
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import multiprocessing
+import ctypes
+import logging
+
+import numpy as np
+
+from adasco.cluster import Cluster, ClusterSequence
+from adasco.transport import SlotOverflowError
+
+logger = logging.getLogger(__name__)
+
+Departure = namedtuple('Departure', ['ID', 'time'])
+
+
+class DirectoryBoard(object):
+    # Outflow board backed by the manager dictionary shared by all agents and
+    # guarded by one global lock; publish_directory is the publishing agent's
+    # own entry in that dictionary
+
+    def __init__(self, shared_results_directory, shared_lock, publish_directory):
+        self.shared_results_directory = shared_results_directory
+        self.shared_lock = shared_lock
+        self.publish_directory = publish_directory
+
+    def publish_clusters(self, agent_id, outflow_by_edge):
+        self._publish(agent_id, outflow_by_edge)
+
+    def publish_departures(self, agent_id, departures_by_edge):
+        self._publish(agent_id, departures_by_edge)
+
+    def read_clusters(self, agent_id, edge):
+        return self._read(agent_id, edge)
+
+    def read_departures(self, agent_id, edge):
+        return self._read(agent_id, edge)
+
+    def _publish(self, agent_id, results):
+        with self.shared_lock:
+            self.publish_directory.clear()
+            for edge, result in results.items():
+                self.publish_directory[edge] = result
+            self.shared_results_directory[agent_id] = self.publish_directory
+
+    def _read(self, agent_id, edge):
+        with self.shared_lock:
+            return self.shared_results_directory[agent_id][edge]
+
+
+class OutflowBoard(object):
+    # Outflow board in shared memory with one slot per (agent, outgoing edge).
+    # Each slot has a single writer (the agent that owns the edge) and is
+    # versioned like a seqlock: the writer makes the version odd while writing
+    # and even again when done, and readers retry until they have copied the
+    # slot between two reads of the same even version. Neither side takes a
+    # lock or talks to a manager process. This relies on stores to shared
+    # memory becoming visible in program order, as they do on x86.
+    #
+    # Each record has three values: (count, arrival, departure) for clusters
+    # and (sample, time, 0) for vehicle departures, whose IDs are stored
+    # NUL-separated next to the records
+
+    def __init__(self, edges, capacity=2048, id_width=32):
+        self.capacity = capacity
+        self.id_width = id_width
+        self._slots = {}
+        for agent_id, edge in edges:
+            if agent_id not in self._slots:
+                self._slots[agent_id] = {}
+            self._slots[agent_id][edge] = BoardSlot(capacity, id_width)
+
+    def publish_clusters(self, agent_id, outflow_by_edge):
+        self._publish(agent_id, outflow_by_edge, self._encode_clusters)
+
+    def publish_departures(self, agent_id, departures_by_edge):
+        self._publish(agent_id, departures_by_edge, self._encode_departures)
+
+    def read_clusters(self, agent_id, edge):
+        # Clusters are published in arrival order
+        records, _ = self._slots[agent_id][edge].read()
+        return ClusterSequence._from_sorted([Cluster(count=count, arrival=arrival, departure=departure)
+                                             for count, arrival, departure in records.tolist()])
+
+    def read_departures(self, agent_id, edge):
+        records, IDs = self._slots[agent_id][edge].read()
+        samples = []
+        previous_sample = None
+        for (sample, time, _), vehID in zip(records.tolist(), IDs):
+            if sample != previous_sample:
+                samples.append([])
+                previous_sample = sample
+            samples[-1].append(Departure(vehID, time))
+        return samples
+
+    def _publish(self, agent_id, results, encode):
+        slots = self._slots[agent_id]
+
+        for edge, slot in slots.items():
+            if edge in results:
+                records, IDs = encode(results[edge])
+                slot.write(records, IDs)
+            else:
+                slot.clear()
+
+        for edge in results:
+            if edge not in slots:
+                logger.debug('No board slot for edge {} of agent {}'.format(edge, agent_id))
+
+    def _encode_clusters(self, sequence):
+        records = np.array([(cluster.count, cluster.arrival, cluster.departure) for cluster in sequence],
+                           dtype=np.float64).reshape(-1, 3)
+        return records, []
+
+    def _encode_departures(self, samples):
+        records = []
+        IDs = []
+        for sample_index, sample in enumerate(samples):
+            for departure in sample:
+                records.append((sample_index, departure.time, 0))
+                IDs.append(departure.ID)
+        return np.array(records, dtype=np.float64).reshape(-1, 3), IDs
+
+
+class BoardSlot(object):
+
+    def __init__(self, capacity, id_width):
+        self.capacity = capacity
+        # version, present, record count, length of IDs
+        self._header = multiprocessing.RawArray(ctypes.c_longlong, 4)
+        self._records = multiprocessing.RawArray(ctypes.c_double, 3 * capacity)
+        self._ids = multiprocessing.RawArray(ctypes.c_char, capacity * id_width)
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def views(self):
+        if self._views is None:
+            self._views = (np.frombuffer(self._header, dtype=np.int64),
+                           np.frombuffer(self._records, dtype=np.float64).reshape(-1, 3))
+        return self._views
+
+    def write(self, records, IDs):
+        header, stored_records = self.views
+
+        encoded_ids = '\0'.join(IDs).encode('ascii')
+        if len(records) > self.capacity or len(encoded_ids) > len(self._ids):
+            raise SlotOverflowError(self.capacity, len(records))
+
+        version = header[0]
+        header[0] = version + 1
+        stored_records[:len(records)] = records
+        ctypes.memmove(self._ids, encoded_ids, len(encoded_ids))
+        header[1] = 1
+        header[2] = len(records)
+        header[3] = len(encoded_ids) if IDs else -1
+        header[0] = version + 2
+
+    def clear(self):
+        header, _ = self.views
+        version = header[0]
+        header[0] = version + 1
+        header[1] = 0
+        header[2] = 0
+        header[0] = version + 2
+
+    def read(self):
+        header, stored_records = self.views
+        while True:
+            version = header[0]
+            if version % 2:
+                continue
+            present = header[1]
+            record_count = int(header[2])
+            ids_length = int(header[3])
+            records = stored_records[:record_count].copy()
+            encoded_ids = ctypes.string_at(self._ids, max(ids_length, 0))
+            if header[0] == version:
+                break
+
+        if not present:
+            raise KeyError('Nothing published')
+
+        if ids_length < 0:
+            IDs = []
+        else:
+            if not isinstance(encoded_ids, str):
+                encoded_ids = encoded_ids.decode('ascii')
+            IDs = encoded_ids.split('\0')
+
+        return records, IDs
@@ -6,6 +6,7 @@ from __future__ import division
 
 from math import ceil
 import bisect
+import heapq
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,6 +14,8 @@ logger = logging.getLogger(__name__)
 
 class Cluster(object):
 
+    __slots__ = ('count', 'arrival', 'departure')
+
     def __init__(self, count, arrival, departure):
         assert count > 0, 'Cluster count must be greater than 0'
         assert (departure - arrival) > 0, 'Cluster duration must be greater than 0'
@@ -26,6 +29,13 @@ class Cluster(object):
                                                                self.arrival,
                                                                self.departure)
 
+    # Python 2 cannot pickle classes with __slots__ without these
+    def __getstate__(self):
+        return (self.count, self.arrival, self.departure)
+
+    def __setstate__(self, state):
+        self.count, self.arrival, self.departure = state
+
     def __hash__(self):
         return hash(tuple([self.count, self.arrival, self.departure]))
 
@@ -181,10 +191,70 @@ class ClusterSequence(object):
         else:
             self._clusters = sorted(sequence, key=self._key)
         self._keys = [self._key(cluster) for cluster in self._clusters]
+        self._build_horizon()
 
     def _key(self, cluster):
         return cluster.arrival
 
+    @classmethod
+    def _from_sorted(cls, clusters):
+        # Build a sequence from clusters that are already in key order
+        sequence = cls()
+        sequence._clusters = clusters
+        sequence._keys = [sequence._key(cluster) for cluster in clusters]
+        sequence._build_horizon()
+        return sequence
+
+    @staticmethod
+    def _combine_equal_keys(clusters, keys, merge):
+        # Clusters with equal keys are merged left to right when merge is
+        # set, and otherwise kept in reverse order, as repeated insorts would
+        combined = []
+        start = 0
+        while start < len(clusters):
+            end = start + 1
+            while end < len(clusters) and keys[end] == keys[start]:
+                end += 1
+            if merge:
+                cluster = clusters[start]
+                for index in range(start+1, end):
+                    cluster = cluster.merge(clusters[index])
+                combined.append(cluster)
+            else:
+                combined.extend(reversed(clusters[start:end]))
+            start = end
+        return combined
+
+    # The horizon at an index is the latest departure of any cluster up to
+    # and including that index. It never decreases, so the first cluster that
+    # departs after a given time can be found by bisecting it.
+    def _build_horizon(self):
+        self._horizon = []
+        latest_departure = -float('inf')
+        for cluster in self._clusters:
+            latest_departure = max(latest_departure, cluster.departure)
+            self._horizon.append(latest_departure)
+
+    def _update_horizon(self, index):
+        # Recompute the horizon from index onwards after a change at index,
+        # stopping as soon as it agrees with the stored value
+        if index > 0:
+            latest_departure = self._horizon[index-1]
+        else:
+            latest_departure = -float('inf')
+        for position in range(index, len(self._clusters)):
+            latest_departure = max(latest_departure, self._clusters[position].departure)
+            if position > index and self._horizon[position] == latest_departure:
+                break
+            self._horizon[position] = latest_departure
+
+    def _window(self, start, end):
+        # Index of the first cluster departing after start and of the last
+        # cluster arriving before end
+        start_index = bisect.bisect_right(self._horizon, start)
+        end_index = bisect.bisect_left(self._keys, end) - 1
+        return start_index, end_index
+
     def __len__(self):
         return len(self._keys)
 
@@ -219,7 +289,12 @@ class ClusterSequence(object):
 
     def pop(self, index):
         self._keys.pop(index)
-        return self._clusters.pop(index)
+        self._horizon.pop(index)
+        cluster = self._clusters.pop(index)
+        if index < 0:
+            index += len(self._clusters) + 1
+        self._update_horizon(index)
+        return cluster
 
     def set(self, index, cluster):
         key = self._key(cluster)
@@ -227,6 +302,9 @@ class ClusterSequence(object):
             raise InsertionError(cluster, index)
         self._keys[index] = key
         self._clusters[index] = cluster
+        if index < 0:
+            index += len(self._clusters)
+        self._update_horizon(index)
 
     # Also check this for built-in setters
     def setting_disrupts_order(self, index, key):
@@ -257,10 +335,13 @@ class ClusterSequence(object):
         else:
             self._keys.insert(index, key)
             self._clusters.insert(index, cluster)
+            self._horizon.insert(index, None)
+            self._update_horizon(index)
 
     def _merge_and_replace(self, key, cluster):
-        index = self._keys.index(key)
+        index = bisect.bisect_left(self._keys, key)
         self._clusters[index] = self._clusters[index].merge(cluster)
+        self._update_horizon(index)
 
     def _check_insertion(self, index, cluster):
         key = self._key(cluster)
@@ -292,12 +373,26 @@ class ClusterSequence(object):
         if sequence is None or len(sequence) == 0:
             return self
 
-        merged = ClusterSequence()
-        for cluster in self:
-            merged.insort(cluster, merge=merge)
-        for cluster in sequence:
-            merged.insort(cluster, merge=merge)
-        return merged
+        # Two-pointer merge; on equal keys clusters of self come first
+        clusters = []
+        keys = []
+        index = 0
+        other_index = 0
+        while index < len(self._keys) and other_index < len(sequence._keys):
+            if sequence._keys[other_index] < self._keys[index]:
+                clusters.append(sequence._clusters[other_index])
+                keys.append(sequence._keys[other_index])
+                other_index += 1
+            else:
+                clusters.append(self._clusters[index])
+                keys.append(self._keys[index])
+                index += 1
+        clusters.extend(self._clusters[index:])
+        keys.extend(self._keys[index:])
+        clusters.extend(sequence._clusters[other_index:])
+        keys.extend(sequence._keys[other_index:])
+
+        return ClusterSequence._from_sorted(self._combine_equal_keys(clusters, keys, merge))
 
     def merge_by_threshold(self, threshold, Gmax=float('inf'), startup_lost_time=0):
         # Return merged indices, modifies cluster sequence in-place
@@ -323,17 +418,39 @@ class ClusterSequence(object):
                 continue
             head_index += 1
             tail_index += 1
+        self._build_horizon()
         return merged_arrivals
 
     @staticmethod
     def merge_all(sequence_list):
-        merged = ClusterSequence()
-        for sequence in sequence_list:
-            merged = merged.merge(sequence)
-        return merged
+        sequence_list = list(sequence_list)
+        non_empty = [sequence for sequence in sequence_list if sequence]
+
+        # Pairwise merging returns one of the inputs unchanged in these cases
+        if len(non_empty) < 2:
+            merged = ClusterSequence()
+            for sequence in sequence_list:
+                merged = merged.merge(sequence)
+            return merged
+
+        # k-way merge; on equal keys earlier sequences come first
+        heap = [(sequence._keys[0], order, 0) for order, sequence in enumerate(non_empty)]
+        heapq.heapify(heap)
+        clusters = []
+        keys = []
+        while heap:
+            key, order, index = heapq.heappop(heap)
+            sequence = non_empty[order]
+            clusters.append(sequence._clusters[index])
+            keys.append(key)
+            if index + 1 < len(sequence._keys):
+                heapq.heappush(heap, (sequence._keys[index+1], order, index+1))
+
+        return ClusterSequence._from_sorted(ClusterSequence._combine_equal_keys(clusters, keys, True))
 
     def shift(self, offset):
         self._keys = [key+offset for key in self._keys]
+        self._horizon = [departure+offset for departure in self._horizon]
         for cluster in self._clusters:
             cluster.arrival += offset
             cluster.departure += offset
@@ -344,22 +461,12 @@ class ClusterSequence(object):
         if start >= self._clusters[-1].departure or end <= self._clusters[0].arrival:
             return result
 
-        # TODO: Use bisect
-        for index in range(len(self._keys)):
-            if start < self._clusters[index].departure:
-                start_index = index
-                break
-
-        for index in range(len(self._keys)-1, -1, -1):
-            if end > self._clusters[index].arrival:
-                end_index = index
-                break
+        start_index, end_index = self._window(start, end)
 
-        if end_index >= start_index:
-            for index in range(start_index, end_index + 1):
-                sliced = self._clusters[index].slice(start, end, min_cluster_size)
-                if sliced:
-                    result.append(sliced)
+        for index in range(start_index, end_index + 1):
+            sliced = self._clusters[index].slice(start, end, min_cluster_size)
+            if sliced:
+                result.append(sliced)
 
         return result
 
@@ -369,15 +476,7 @@ class ClusterSequence(object):
         if start >= self._clusters[-1].departure or end <= self._clusters[0].arrival:
             return removed_indices
 
-        for index in range(len(self._keys)):
-            if start < self._clusters[index].departure:
-                start_index = index
-                break
-
-        for index in range(len(self._keys)-1, -1, -1):
-            if end > self._clusters[index].arrival:
-                end_index = index
-                break
+        start_index, end_index = self._window(start, end)
 
         head, tail = self._clusters[start_index].split(start, min_cluster_size)
         if head is None:
@@ -397,18 +496,19 @@ class ClusterSequence(object):
             for index in range(start_index+1, end_index):
                 removed_indices.append(index)
 
-        self._keys = [key for index, key in enumerate(self._keys)
-                      if index not in removed_indices]
-        self._clusters = [cluster for index, cluster in enumerate(self._clusters)
-                          if index not in removed_indices]
+        # The removed indices are always contiguous
+        if removed_indices:
+            first = min(removed_indices)
+            last = max(removed_indices)
+            del self._keys[first:last+1]
+            del self._clusters[first:last+1]
+            del self._horizon[first:last+1]
+        self._update_horizon(min(start_index, end_index))
 
         return removed_indices
 
     def copy(self):
-        sequence = ClusterSequence()
-        for cluster in self:
-            sequence.append(cluster.copy())
-        return sequence
+        return ClusterSequence._from_sorted([cluster.copy() for cluster in self])
 
 
 class InsertionError(Exception):
@@ -3,6 +3,9 @@ from __future__ import division
 
 import logging
 
+import numpy as np
+import traci.constants as tc
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,12 +25,119 @@ class SensorData(object):
                                                                                                         self.queued_vehicle_positions,
                                                                                                         self.arriving_vehicle_positions)
 
+    def with_arrivals(self, vehicle_ids, vehicle_positions):
+        return SensorData(self.queue_length,
+                          self.queued_vehicle_positions,
+                          self.queued_vehicle_ids,
+                          self.arriving_vehicle_positions + list(vehicle_positions),
+                          self.arriving_vehicle_ids + list(vehicle_ids))
+
+
+class ColumnarSensorData(object):
+    # Queued vehicles are stored ahead of arriving vehicles, so the per-class
+    # views below are slices of the same buffers. Buffers are read-only and
+    # shared between copies; with_arrivals allocates new ones.
+    # vehicle_index points into vehicle_ids, which is shared by all edges of a
+    # request and is therefore pickled once per request. with_arrivals
+    # appends the new IDs to it, which leaves the existing indices valid.
+
+    def __init__(self, distances, queued, vehicle_index, vehicle_ids):
+        self.distances = distances
+        self.queued = queued
+        self.vehicle_index = vehicle_index
+        self.vehicle_ids = vehicle_ids
+        self.queue_length = int(np.count_nonzero(queued))
+        self._freeze()
+
+    @classmethod
+    def from_lists(cls, queued_vehicle_positions, queued_vehicle_ids,
+                   arriving_vehicle_positions, arriving_vehicle_ids, vehicle_ids=None):
+        if vehicle_ids is None:
+            vehicle_ids = []
+        offset = len(vehicle_ids)
+        vehicle_ids.extend(queued_vehicle_ids)
+        vehicle_ids.extend(arriving_vehicle_ids)
+
+        queue_length = len(queued_vehicle_ids)
+        vehicle_count = queue_length + len(arriving_vehicle_ids)
+
+        distances = np.empty(vehicle_count, dtype=np.float32)
+        distances[:queue_length] = queued_vehicle_positions
+        distances[queue_length:] = arriving_vehicle_positions
+        queued = np.zeros(vehicle_count, dtype=np.bool_)
+        queued[:queue_length] = True
+        vehicle_index = np.arange(offset, offset + vehicle_count, dtype=np.int32)
+
+        return cls(distances, queued, vehicle_index, vehicle_ids)
+
+    def __repr__(self):
+        return '{}(queue_length={}, queued_vehicle_positions={}, arriving_vehicle_positions={})'.format(self.__class__.__name__,
+                                                                                                        self.queue_length,
+                                                                                                        self.queued_vehicle_positions,
+                                                                                                        self.arriving_vehicle_positions)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._freeze()
+
+    def _freeze(self):
+        for array in (self.distances, self.queued, self.vehicle_index):
+            array.flags.writeable = False
+
+    @property
+    def queued_distances(self):
+        return self.distances[:self.queue_length]
+
+    @property
+    def arriving_distances(self):
+        return self.distances[self.queue_length:]
+
+    @property
+    def queued_vehicle_positions(self):
+        return self.queued_distances.tolist()
+
+    @property
+    def arriving_vehicle_positions(self):
+        return self.arriving_distances.tolist()
+
+    @property
+    def queued_vehicle_ids(self):
+        return [self.vehicle_ids[index] for index in self.vehicle_index[:self.queue_length].tolist()]
+
+    @property
+    def arriving_vehicle_ids(self):
+        return [self.vehicle_ids[index] for index in self.vehicle_index[self.queue_length:].tolist()]
+
+    def with_arrivals(self, vehicle_ids, vehicle_positions):
+        vehicle_ids = list(vehicle_ids)
+        if not vehicle_ids:
+            return self
+
+        offset = len(self.vehicle_ids)
+        extension = len(vehicle_ids)
+
+        distances = np.concatenate((self.distances,
+                                    np.asarray(vehicle_positions, dtype=np.float32)))
+        queued = np.concatenate((self.queued,
+                                 np.zeros(extension, dtype=np.bool_)))
+        vehicle_index = np.concatenate((self.vehicle_index,
+                                        np.arange(offset, offset + extension, dtype=np.int32)))
+
+        self.vehicle_ids.extend(vehicle_ids)
+
+        return ColumnarSensorData(distances, queued, vehicle_index, self.vehicle_ids)
+
+
 class ExactDetector(object):
 
-    def __init__(self, connection, observation_horizon=float('inf')):
+    def __init__(self, connection, observation_horizon=float('inf'), columnar=False):
         assert connection is not None
         self.connection = connection
         self.observation_horizon = observation_horizon
+        self.columnar = columnar
+
+    def subscribe(self, edges):
+        pass
 
     def get_vehicle_positions(self, laneID):
         queued_vehicle_positions = []
@@ -59,6 +169,7 @@ class ExactDetector(object):
 
     def get_sensor_data(self, edges):
         data = {}
+        vehicle_ids = []
 
         for edge, lanes in edges.items():
 
@@ -77,11 +188,73 @@ class ExactDetector(object):
                 edge_arriving_vehicle_positions.extend(lane_arriving_positions)
                 edge_arriving_vehicle_ids.extend(lane_arriving_vehicle_ids)
 
-            data[edge] = SensorData(edge_queue_length,
-                                    edge_queued_vehicle_positions,
-                                    edge_queued_vehicle_ids,
-                                    edge_arriving_vehicle_positions,
-                                    edge_arriving_vehicle_ids)
+            if self.columnar:
+                data[edge] = ColumnarSensorData.from_lists(edge_queued_vehicle_positions,
+                                                           edge_queued_vehicle_ids,
+                                                           edge_arriving_vehicle_positions,
+                                                           edge_arriving_vehicle_ids,
+                                                           vehicle_ids)
+            else:
+                data[edge] = SensorData(edge_queue_length,
+                                        edge_queued_vehicle_positions,
+                                        edge_queued_vehicle_ids,
+                                        edge_arriving_vehicle_positions,
+                                        edge_arriving_vehicle_ids)
 
         return data
-        
\ No newline at end of file
+
+
+class SubscriptionDetector(ExactDetector):
+    # Reads vehicle positions and speeds from lane context subscriptions,
+    # so that every monitored lane is reported in the simulationStep response
+    # instead of through per-vehicle round trips
+
+    def __init__(self, connection, observation_horizon=float('inf'), columnar=False):
+        super(SubscriptionDetector, self).__init__(connection, observation_horizon, columnar)
+        self.lane_lengths = {}
+
+    def subscribe(self, edges):
+        for lanes in edges.values():
+            for laneID in lanes:
+                if laneID in self.lane_lengths:
+                    continue
+                self.lane_lengths[laneID] = self.connection.lane.getLength(laneID)
+                self.connection.lane.subscribeContext(laneID,
+                                                      tc.CMD_GET_VEHICLE_VARIABLE,
+                                                      0,
+                                                      [tc.VAR_LANE_ID,
+                                                       tc.VAR_LANEPOSITION,
+                                                       tc.VAR_SPEED])
+
+    def get_vehicle_positions(self, laneID):
+        queued_vehicle_positions = []
+        queued_vehicle_ids = []
+        arriving_vehicle_positions = []
+        arriving_vehicle_ids = []
+
+        lane_length = self.lane_lengths[laneID]
+        vehicles = self.connection.lane.getContextSubscriptionResults(laneID)
+
+        if not vehicles:
+            return (queued_vehicle_positions, queued_vehicle_ids,
+                    arriving_vehicle_positions, arriving_vehicle_ids)
+
+        for vehID, variables in vehicles.items():
+            # Context subscriptions may report vehicles on neighbouring lanes
+            if variables[tc.VAR_LANE_ID] != laneID:
+                continue
+
+            distance_to_junction = lane_length - variables[tc.VAR_LANEPOSITION]
+
+            if distance_to_junction > self.observation_horizon:
+                continue
+
+            if variables[tc.VAR_SPEED] >= 0.1:
+                arriving_vehicle_positions.append(distance_to_junction)
+                arriving_vehicle_ids.append(vehID)
+            else:
+                queued_vehicle_positions.append(distance_to_junction)
+                queued_vehicle_ids.append(vehID)
+
+        return (queued_vehicle_positions, queued_vehicle_ids,
+                arriving_vehicle_positions, arriving_vehicle_ids)
@@ -1,22 +1,32 @@
 import multiprocessing
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 
 import traci
 
 import adasco.detector
 import adasco.messaging
 
+DETECTORS = {'exact': adasco.detector.ExactDetector,
+             'subscription': adasco.detector.SubscriptionDetector}
+
+
 class Master(multiprocessing.Process):
-    def __init__(self, port, registry):
+    def __init__(self, port, registry, detector='exact', columnar=False):
         super(Master, self).__init__()
         self.connection = traci.connect(port=port)
         self.registry = registry
-        self.detector = adasco.detector.ExactDetector(self.connection)
-        
+        self.response_queue = registry.response_queue
+        self.detector = DETECTORS[detector](self.connection, columnar=columnar)
+
     def expects_more_vehicles(self):
         return self.connection.simulation.getMinExpectedNumber() > 0
 
     def update_all_phase_durations(self):
-        map(self.update_phase_duration, self.registry)
+        for entry in self.registry:
+            self.update_phase_duration(entry)
 
     def update_phase_duration(self, entry):
         curr_phase = self.connection.trafficlights.getPhase(entry.agent.id)
@@ -29,9 +39,25 @@ class Master(multiprocessing.Process):
     def extend_current_phase(self, traffic_light_id, extension):
         self.connection.trafficlights.setPhaseDuration(traffic_light_id, extension)
 
+    def collect_responses(self, pending, block=True):
+        while pending:
+            try:
+                response = self.response_queue.get(block=block)
+            except Queue.Empty:
+                break
+            agent = pending.pop(response.ID)
+            agent.decision_point = response.decision_point
+            self.extend_current_phase(agent.agent.id, response.extension)
+
+    def subscribe_all_incoming_edges(self):
+        for entry in self.registry:
+            self.detector.subscribe(entry.agent.incoming_edges)
+
     def run(self):
         step = 0
 
+        self.subscribe_all_incoming_edges()
+
         while self.expects_more_vehicles():
             self.connection.simulationStep()
             step += 1
@@ -40,6 +66,8 @@ class Master(multiprocessing.Process):
 
             agents_at_decision_point = self.registry.get_agents_at_decision_point(step)
 
+            pending = {}
+
             for agent in agents_at_decision_point:
 
                 sensor_data = self.detector.get_sensor_data(agent.agent.incoming_edges)
@@ -50,12 +78,12 @@ class Master(multiprocessing.Process):
                                                    curr_time=step)
 
                 agent.request_queue.put(request)
+                pending[agent.agent.id] = agent
 
-            for agent in agents_at_decision_point:
-                agent.request_queue.join()
-                response = agent.response_queue.get()
-                agent.decision_point = response.decision_point
-                self.extend_current_phase(agent.agent.id, response.extension)
+                # Apply plans that are already available while reading data for the remaining agents
+                self.collect_responses(pending, block=False)
+
+            self.collect_responses(pending)
 
         self.connection.close()
 
@@ -9,10 +9,11 @@ class Message(object):
 
 
 class Response(Message):
-    def __init__(self, extension, decision_point):
+    def __init__(self, extension, decision_point, ID=None):
         super(Response, self).__init__(RESP)
         self.extension = extension
         self.decision_point = decision_point
+        self.ID = ID
 
 
 class Request(Message):
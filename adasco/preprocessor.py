@@ -5,6 +5,7 @@ from collections import namedtuple
 from operator import attrgetter
 from copy import deepcopy
 import logging
+import math
 
 import numpy as np
 
@@ -13,6 +14,24 @@ from adasco.cluster import Cluster, ClusterSequence
 logger = logging.getLogger(__name__)
 
 
+def round_half_away(value):
+    # round of Python 2, which rounds halves away from zero, on either
+    # Python (round of Python 3 rounds them to even)
+    magnitude = abs(value)
+    rounded = math.floor(magnitude)
+    if magnitude - rounded >= 0.5:
+        rounded += 1
+    return math.copysign(rounded, value)
+
+
+def round_half_away_array(values):
+    # round_half_away of every value, with the same floating-point steps
+    magnitudes = np.abs(values)
+    rounded = np.floor(magnitudes)
+    rounded += (magnitudes - rounded) >= 0.5
+    return np.copysign(rounded, values)
+
+
 class ExactPreprocessor(object):
     def __init__(self,
                  saturation_flow_rate,
@@ -20,13 +39,15 @@ class ExactPreprocessor(object):
                  time_resolution,
                  sampling_interval,
                  min_cluster_size,
-                 merging_threshold):
+                 merging_threshold,
+                 vectorised=False):
         self.saturation_flow_rate = saturation_flow_rate
         self.free_flow_speed = free_flow_speed
         self.time_resolution = time_resolution
         self.sampling_interval = sampling_interval
         self.min_cluster_size = min_cluster_size
         self.merging_threshold = merging_threshold
+        self.vectorised = vectorised
 
     def get_queue_cluster(self, queue_length):
         if queue_length == 0:
@@ -46,10 +67,10 @@ class ExactPreprocessor(object):
         return estimated_arrival_time
 
     def get_arrival_times(self, distances_to_junction):
-        return map(self.position_to_estimated_arrival_time, distances_to_junction)
+        return [self.position_to_estimated_arrival_time(distance) for distance in distances_to_junction]
 
     def round_to_delta(self, time):
-        return round(time / self.time_resolution) * self.time_resolution
+        return round_half_away(time / self.time_resolution) * self.time_resolution
 
     def get_arriving_clusters(self, arrivals):
         tally = {}
@@ -66,36 +87,78 @@ class ExactPreprocessor(object):
                                              departure=(bucket+1)*self.sampling_interval))
         return arriving_clusters
 
+    def get_arrival_time_array(self, distances_to_junction):
+        # Same as get_arrival_times for all vehicles at once. Distances are
+        # cast to float64 first so that float32 sensor data is rounded like
+        # the Python floats of the scalar path.
+        distances = np.asarray(distances_to_junction, dtype=np.float64)
+        travel_times = distances / self.free_flow_speed
+        return round_half_away_array(travel_times / self.time_resolution) * self.time_resolution
+
+    def get_arriving_clusters_from_array(self, arrivals):
+        # Same clusters as get_arriving_clusters, bucketed with one
+        # floor_divide and counted with one bincount
+        if len(arrivals) == 0:
+            return ClusterSequence()
+
+        buckets = np.floor_divide(arrivals, self.sampling_interval)
+        first_bucket = buckets.min()
+        tally = np.bincount((buckets - first_bucket).astype(np.intp))
+        occupied = np.flatnonzero(tally)
+
+        clusters = []
+        for offset, count in zip(occupied.tolist(), tally[occupied].tolist()):
+            bucket = float(first_bucket + offset)
+            clusters.append(Cluster(count=count,
+                                    arrival=bucket*self.sampling_interval,
+                                    departure=(bucket+1)*self.sampling_interval))
+        return ClusterSequence._from_sorted(clusters)
+
     def cluster_sensor_data(self, queue_length, vehicle_positions):
         queue_cluster = self.get_queue_cluster(queue_length)
-        arrival_times = self.get_arrival_times(vehicle_positions)
-        arriving_clusters = self.get_arriving_clusters(arrival_times)
+        if self.vectorised:
+            arrival_times = self.get_arrival_time_array(vehicle_positions)
+            arriving_clusters = self.get_arriving_clusters_from_array(arrival_times)
+        else:
+            arrival_times = self.get_arrival_times(vehicle_positions)
+            arriving_clusters = self.get_arriving_clusters(arrival_times)
         return queue_cluster, arriving_clusters
 
+    def _get_arriving_vehicle_positions(self, data):
+        # Columnar sensor data already holds the distances as an array
+        if self.vectorised and hasattr(data, 'arriving_distances'):
+            return data.arriving_distances
+        return data.arriving_vehicle_positions
+
     def get_roadflow(self, sensor_data):
         roadflow = {}
 
         for edge, data in sensor_data.items():
             queue_cluster, arriving_clusters = self.cluster_sensor_data(data.queue_length,
-                                                    data.arriving_vehicle_positions)
+                                                    self._get_arriving_vehicle_positions(data))
             # TODO(srishtid): Keep queue cluster for anticipated queue cluster
             if queue_cluster:
                 arriving_clusters.insort(queue_cluster, merge=True)
             roadflow[edge] = arriving_clusters
         return roadflow
 
-    def get_inflow_from_roadflow(self, roadflow, phases, turn_proportions):
+    def get_inflow_from_roadflow(self, roadflow, phases, turn_index):
         # Warning: road_to_phase doesn't return edge_inflow for every phase
         #          Only for phases relevant to the edge
-        inflow = {phase: ClusterSequence() for phase in phases}
+        phase_flows = {phase: [] for phase in phases}
         road_count = {}
         for edge, edge_roadflow in roadflow.items():
             if edge_roadflow:
-                edge_inflow = self.road_to_phase(edge,
-                                                 edge_roadflow,
-                                                 turn_proportions)
+                if self.vectorised:
+                    edge_inflow = self.road_to_phase_from_matrix(edge,
+                                                                 edge_roadflow,
+                                                                 turn_index)
+                else:
+                    edge_inflow = self.road_to_phase(edge,
+                                                     edge_roadflow,
+                                                     turn_index)
                 for phase, clusters in edge_inflow.items():
-                    inflow[phase] = inflow[phase].merge(clusters)
+                    phase_flows[phase].append(clusters)
                     if phase not in road_count:
                         road_count[phase] = {}
                     for cluster in clusters:
@@ -106,22 +169,14 @@ class ExactPreprocessor(object):
                         except KeyError:
                             road_count[phase][cluster.arrival][edge] = cluster.count
 
+        inflow = {phase: ClusterSequence.merge_all(flows) for phase, flows in phase_flows.items()}
+
         return inflow, road_count
 
-    def road_to_phase(self, edgeID, roadflow, turn_proportions):
+    def road_to_phase(self, edgeID, roadflow, turn_index):
 
-        inflow = {}
-        turns_by_phase = {}
-        turns_from_edge = [turn for turn in turn_proportions
-                           if turn['incoming_edge'] == edgeID]
-
-        for turn in turns_from_edge:
-            phase = turn['phase']
-            try:
-                turns_by_phase[phase] = min(turns_by_phase[phase] + turn['probability'], 1)
-            except KeyError:
-                turns_by_phase[phase] = min(turn['probability'], 1)
-                inflow[phase] = ClusterSequence()
+        turns_by_phase = turn_index.phase_ratios(edgeID)
+        inflow = {phase: ClusterSequence() for phase in turns_by_phase}
 
         for cluster in roadflow:
             for phase, ratio in turns_by_phase.items():
@@ -131,6 +186,40 @@ class ExactPreprocessor(object):
 
         return inflow
 
+    def road_to_phase_from_matrix(self, edgeID, roadflow, turn_index):
+        # Same result as road_to_phase, with the turn ratios of all phases
+        # applied to all clusters of the edge at once
+        turn_matrix = turn_index.ratio_matrix
+
+        inflow = {}
+        if edgeID not in turn_matrix.edges:
+            return inflow
+
+        row = turn_matrix.edges[edgeID]
+        columns = np.flatnonzero(turn_matrix.present[row])
+
+        clusters = list(roadflow)
+        counts = np.array([cluster.count for cluster in clusters], dtype=np.float64)
+        arrivals = [cluster.arrival for cluster in clusters]
+        distinct_arrivals = len(set(arrivals)) == len(arrivals)
+        split_counts = counts[:, np.newaxis] * turn_matrix.ratios[row, columns]
+        kept = split_counts >= self.min_cluster_size
+
+        for column_index, column in enumerate(columns.tolist()):
+            phase_clusters = []
+            phase_keys = []
+            for index in np.flatnonzero(kept[:, column_index]).tolist():
+                cluster = clusters[index]
+                phase_clusters.append(Cluster(count=float(split_counts[index, column_index]),
+                                              arrival=cluster.arrival,
+                                              departure=cluster.departure))
+                phase_keys.append(arrivals[index])
+            if not distinct_arrivals:
+                phase_clusters = ClusterSequence._combine_equal_keys(phase_clusters, phase_keys, True)
+            inflow[turn_matrix.phases[column]] = ClusterSequence._from_sorted(phase_clusters)
+
+        return inflow
+
     # TODO: Create vehicle objects before this function is called
     def get_queued_clusters_from_positions(self, vehicle_positions, outgoing_edges, IDs):
 
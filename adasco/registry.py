@@ -17,8 +17,10 @@ class Entry(object):
 
 
 class Registry(object):
-    def __init__(self):
+    def __init__(self, response_queue=None):
         self.registry = []
+        # Shared by all agents so that responses can be collected as they complete
+        self.response_queue = response_queue
 
     def __iter__(self):
         return iter(self.registry)
@@ -0,0 +1,113 @@
+'''
+Solver backends of the interval scheduling model built by the CP scheduler
+'''
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Modules of the backends, by --scheduler value
+BACKENDS = {'cp': 'adasco.schedulers.cpo',
+            'cpsat': 'adasco.schedulers.cpsat'}
+
+# Value of a present interval in a solution
+IntervalValue = namedtuple('IntervalValue', ['start', 'end', 'size'])
+
+
+def get_model_class(backend):
+    # Backends are imported when they are selected, so a solver only needs to
+    # be installed where it is used
+    if backend not in BACKENDS:
+        raise ValueError('Unknown scheduler backend {}, expected one of {}'.format(backend, sorted(BACKENDS)))
+    return importlib.import_module(BACKENDS[backend]).Model
+
+
+class Model(object):
+    # Interval scheduling model of one solve of the CP scheduler.
+    #
+    # Domains are those of CP.get_phase_domains and CP.get_cluster_domains:
+    # the start, end and size of an interval are each an integer or an
+    # inclusive (min, max) range, and an interval without a size domain has
+    # any size. Optional intervals may be absent from a solution. A
+    # constraint on an absent interval holds, and an absent interval has
+    # size 0.
+    #
+    # Intervals, constraints and the objective are opaque handles. Models
+    # with REUSABLE set can change the domains of their intervals and remove
+    # constraints and objectives, and may be kept in the model cache of CP.
+
+    REUSABLE = False
+    # Extension of exported model files
+    EXTENSION = ''
+
+    def __init__(self, log_verbosity, threads, timelimit):
+        # log_verbosity is a CP Optimizer log verbosity and timelimit is in
+        # CPU seconds over all threads
+        self.log_verbosity = log_verbosity
+        self.threads = threads
+        self.timelimit = timelimit
+
+    def interval(self, name, start, end, size=None, optional=False):
+        raise NotImplementedError
+
+    def set_domain(self, interval, domain):
+        raise NotImplementedError
+
+    def end_at_start(self, first, second, delay):
+        # second starts delay after first ends
+        raise NotImplementedError
+
+    def end_before_start(self, first, second):
+        raise NotImplementedError
+
+    def within(self, interval, container):
+        # interval starts after container starts and ends before it ends
+        raise NotImplementedError
+
+    def exclude(self, first, second):
+        # first and second are not both present
+        raise NotImplementedError
+
+    def size_sum(self, intervals, size):
+        # Returns the constraint that the sizes of intervals sum to size
+        raise NotImplementedError
+
+    def minimize_delay(self, slices):
+        # Returns the objective of minimizing the total delay of the given
+        # cluster slices (interval, arrival, count, duration, weight): a slice
+        # of size s starting at t delays count * s / duration vehicles of a
+        # cluster of the given duration by t - arrival, counted weight times
+        raise NotImplementedError
+
+    def remove(self, expression):
+        raise NotImplementedError
+
+    def set_starting_point(self, values):
+        # values: interval -> (start, end), or None to clear the starting point
+        raise NotImplementedError
+
+    def solve(self):
+        # Returns a Solution, or None if no solution was found
+        raise NotImplementedError
+
+    def export(self, filename):
+        raise NotImplementedError
+
+
+class Solution(object):
+    # status:    solver status name
+    # objective: total delay
+    # gap:       relative gap between the objective and its best bound
+
+    def __init__(self, status, objective, gap):
+        self.status = status
+        self.objective = objective
+        self.gap = gap
+
+    def get_interval(self, interval):
+        # Returns the IntervalValue of the interval, or None if it is absent
+        raise NotImplementedError
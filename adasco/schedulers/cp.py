@@ -2,24 +2,24 @@ from __future__ import print_function
 from __future__ import division
 
 from collections import namedtuple
+from collections import OrderedDict
 from math import ceil
+import multiprocessing
 import logging
+import timeit
 import json
 
-from docplex.cp.solver.solver_local import LocalSolverException
-from docplex.cp.parameters import CpoParameters
-import docplex.cp.model
-
 from adasco.cluster import Cluster
+from adasco.schedulers.backend import get_model_class
+from adasco.schedulers.evaluator import PlanEvaluator, SliceDeparture
 
 logger = logging.getLogger(__name__)
 
-SliceDeparture = namedtuple('SliceDeparture', ['departure', 'ratio'])
-
 
 class CP(object):
     
-    def __init__(self, phases, Gmin, Gmax, Y, sult, timelimit, cycle_count):
+    def __init__(self, phases, Gmin, Gmax, Y, sult, timelimit, cycle_count, model_cache_size=0, threads=1, workers=1,
+                 adaptive_cycles=False, backend='cp'):
         self.phases = phases
         self.Gmin = Gmin
         self.Gmax = Gmax
@@ -29,134 +29,106 @@ class CP(object):
 
         self.phase_count = len(phases)
         self.cycle_count = cycle_count
+
+        # With adaptive cycles, the models of a decision have as few cycles
+        # as its inflows need, up to max_cycle_count, and no cluster intervals
+        # that cannot end before their phase interval, see adapt_cycle_count.
+        # latest_phase_ends: (phase, cycle) -> latest end of the phase
+        # interval, None when nothing is pruned
+        self.max_cycle_count = cycle_count
+        self.adaptive_cycles = adaptive_cycles
+        self.latest_phase_ends = None
         
-        self.threads = 1
+        # CP Optimizer workers per solve, and worker processes evaluating
+        # plans in schedule_by_decomposition
+        self.threads = threads
         self.timelimit = timelimit * self.threads
+        self.workers = workers
+        self.pool = None
 
         self.phase_intervals = {}
         self.cluster_intervals = {}
 
+        # Solver of the models, see adasco.schedulers.backend
+        self.backend = backend
+        self.model_class = get_model_class(backend)
         self.model = None
 
-    def schedule_over_all_samples(self, inflows, weights, curr_phase, curr_phase_duration, output_file=None, status_file=None):
-
-        self.phase_intervals = {}
-        self.cluster_intervals = {}
-
-        self.model = docplex.cp.model.CpoModel()
+        self.evaluator = PlanEvaluator(phases)
 
-        self.model.parameters = CpoParameters(LogVerbosity='Terse', Workers=self.threads,
-                                         TimeLimit=self.timelimit, WarningLevel=0,
-                                         TimeMode='CPUTime')
+        # Models of the last model_cache_size structures, see build_model
+        self.model_cache_size = model_cache_size if self.model_class.REUSABLE else 0
+        self.model_cache = OrderedDict()
+        # Time spent building (or updating) and solving the last model
+        self.build_time = 0
+        self.solve_time = 0
+        # Phase plan of the last solution of schedule_over_all_samples, see
+        # get_phase_plan
+        self.last_plan = None
 
-        self.create_phase_intervals(curr_phase, curr_phase_duration)
+    def schedule_over_all_samples(self, inflows, weights, curr_phase, curr_phase_duration, output_file=None, status_file=None,
+                                  starting_plan=None, cycle_count=None):
 
-        for inflow_id, inflow in enumerate(inflows):
-            self.create_cluster_intervals(inflow, inflow_id)
-
-        self.constrain_phase_order()
-        self.constrain_cycle_order()
+        self.adapt_cycle_count(inflows, curr_phase, curr_phase_duration, cycle_count)
 
-        for inflow_id, inflow in enumerate(inflows):
-            self.constrain_cluster_departure(inflow, inflow_id)
-            self.constrain_cluster_precedence(inflow, inflow_id)
+        self.build_model('Terse',
+                         inflows,
+                         weights,
+                         self.get_phase_domains(curr_phase, curr_phase_duration),
+                         starting_plan)
 
-        self.add_objective(inflows, weights)
-
-        if output_file is not None:
-            self.model.export_model(output_file)
-
-        try:
-            solution = self.model.solve()
-        except LocalSolverException:
-            solution = None
-            self.model.export_model('localsolverexception.cpo')
-            print('LocalSolverException raised!')
+        solution = self.solve_model(output_file)
 
         if solution:
-            # TODO(srishti): Simplify it
-            departures = []
-            (delay,) = solution.get_objective_values()
-            (gap,) = solution.get_objective_gaps()
+            delay = solution.objective
+            gap = solution.gap
             
-            for inflow_id, inflow in enumerate(inflows):
-                sample_departures = {}
-                
-                for phase, sequence in inflow.items():
-                    if phase not in sample_departures:
-                        sample_departures[phase] = []
-                    
-                    for cluster_id, cluster in enumerate(sequence):
-                        cluster_departures = []
-                        
-                        for cycle in range(self.cycle_count):
-                            var_sol = solution.get_var_solution(self.cluster_intervals[(inflow_id, phase, cluster_id, cycle)])
-                            if var_sol.get_start() is not None and var_sol.get_size() > 0:
-                                departure = SliceDeparture(departure=var_sol.get_start(),
-                                                           ratio=var_sol.get_size()/cluster.duration)
-                                cluster_departures.append(departure)
-                        
-                        sample_departures[phase].append(cluster_departures)
-
-                departures.append(sample_departures)
+            departures = [self.get_departures(solution, inflow, inflow_id) for inflow_id, inflow in enumerate(inflows)]
 
             if status_file:
                 with open(status_file, 'w') as fp:
-                    json.dump({'status': solution.solve_status,
+                    json.dump({'status': solution.status,
+                               'backend': self.backend,
                                'delay': delay,
-                               'gap': gap}, fp, indent=4)
+                               'gap': gap,
+                               'build_time': self.build_time,
+                               'solve_time': self.solve_time,
+                               'warm_start': starting_plan is not None,
+                               'cycle_count': self.cycle_count}, fp, indent=4)
+
+            self.last_plan = self.get_phase_plan(solution)
             
-            curr_phase_solution = solution.get_var_solution(self.phase_intervals[(curr_phase, 0)])
-            curr_phase_end = curr_phase_solution.get_end()
+            curr_phase_solution = solution.get_interval(self.phase_intervals[(curr_phase, 0)])
+            curr_phase_end = curr_phase_solution.end
             extension = curr_phase_end
 
         else:
-            self.model.export_model('nosolution.cpo')
+            self.model.export('nosolution' + self.model.EXTENSION)
             print('No solution')
             extension = None
             departures = None
+            self.last_plan = None
 
         return extension, departures
 
     def schedule_in_hindsight(self, inflow, curr_phase, curr_phase_duration, action, output_file=None, status_file=None):
 
         inflow_id = 0
-        self.phase_intervals = {}
-        self.cluster_intervals = {}
-
-        self.model = docplex.cp.model.CpoModel()
-
-        self.model.parameters = CpoParameters(LogVerbosity='Quiet', Workers=self.threads,
-                                         TimeLimit=self.timelimit, WarningLevel=0,
-                                         TimeMode='CPUTime')
-
-        self.create_phase_intervals(curr_phase, curr_phase_duration, curr_phase_end=action)
-
-        self.create_cluster_intervals(inflow)
 
-        self.constrain_phase_order()
-        self.constrain_cycle_order()
+        self.adapt_cycle_count([inflow], curr_phase, curr_phase_duration)
 
-        self.constrain_cluster_departure(inflow)
-        self.constrain_cluster_precedence(inflow)
+        self.build_model('Quiet',
+                         [inflow],
+                         [1],
+                         self.get_phase_domains(curr_phase, curr_phase_duration, curr_phase_end=action))
 
-        self.add_objective([inflow], [1])
-
-        if output_file is not None:
-            self.model.export_model(output_file)
-
-        try:
-            solution = self.model.solve()
-        except LocalSolverException:
-            solution = None
-            self.model.export_model('localsolverexception.cpo')
-            print('LocalSolverException raised!')
+        solution = self.solve_model(output_file)
 
         if solution:
         
             departures = {}
-            (delay,) = solution.get_objective_values()
-            (gap,) = solution.get_objective_gaps()
+            delay = solution.objective
+            gap = solution.gap
             
             for phase, sequence in inflow.items():
                 if phase not in departures:
@@ -164,141 +136,459 @@ class CP(object):
                 for cluster_id, cluster in enumerate(sequence):
                     cluster_departures = []
                     for cycle in range(self.cycle_count):
-                        var_sol = solution.get_var_solution(self.cluster_intervals[(inflow_id, phase, cluster_id, cycle)])
-                        if var_sol.get_start() is not None and var_sol.get_size() > 0:
-                            departure = SliceDeparture(departure=var_sol.get_start(),
-                                                       ratio=var_sol.get_size()/cluster.duration)
+                        if (inflow_id, phase, cluster_id, cycle) not in self.cluster_intervals:
+                            continue
+                        var_sol = solution.get_interval(self.cluster_intervals[(inflow_id, phase, cluster_id, cycle)])
+                        if var_sol is not None and var_sol.size > 0:
+                            departure = SliceDeparture(departure=var_sol.start,
+                                                       ratio=var_sol.size/cluster.duration)
                             cluster_departures.append(departure)
                     departures[phase].append(cluster_departures)
            
             if status_file:
                 with open(status_file, 'w') as fp:
-                    json.dump({'status': solution.solve_status,
-                               'gap': gap}, fp, indent=4)
-
-            curr_phase_solution = solution.get_var_solution(self.phase_intervals[(curr_phase, 0)])
-            curr_phase_end = curr_phase_solution.get_end()
+                    json.dump({'status': solution.status,
+                               'backend': self.backend,
+                               'gap': gap,
+                               'build_time': self.build_time,
+                               'solve_time': self.solve_time}, fp, indent=4)
+
+            curr_phase_solution = solution.get_interval(self.phase_intervals[(curr_phase, 0)])
+            curr_phase_end = curr_phase_solution.end
             extension = curr_phase_end
 
         else:
-            self.model.export_model('nosolution.cpo')
+            self.model.export('nosolution' + self.model.EXTENSION)
             print('No solution')
+            extension = None
             delay = None
             departures = None
 
-        return extension, delay, cluster_departures
+        return extension, delay, departures
 
-    def get_plan_for_sample(self, inflow, curr_phase, curr_phase_duration, output_file=None):
+    def get_plan_for_sample(self, inflow, curr_phase, curr_phase_duration, output_file=None, cycle_count=None):
 
-        inflow_id = 0
-        self.phase_intervals = {}
-        self.cluster_intervals = {}
+        plan, _ = self.get_plan_for_samples([inflow], [1], curr_phase, curr_phase_duration, output_file,
+                                            cycle_count=cycle_count)
 
-        self.model = docplex.cp.model.CpoModel()
+        return plan
 
-        self.model.parameters = CpoParameters(LogVerbosity='Quiet', Workers=self.threads,
-                                         TimeLimit=self.timelimit, WarningLevel=0,
-                                         TimeMode='CPUTime')
+    def get_plan_for_samples(self, inflows, weights, curr_phase, curr_phase_duration, output_file=None,
+                             starting_plan=None, cycle_count=None):
+        # Phase plan of the model over the inflows, as in
+        # schedule_over_all_samples, and the status of its solve (both None
+        # if there is no solution)
 
-        self.create_phase_intervals(curr_phase, curr_phase_duration)
+        self.adapt_cycle_count(inflows, curr_phase, curr_phase_duration, cycle_count)
 
-        self.create_cluster_intervals(inflow)
+        self.build_model('Quiet',
+                         inflows,
+                         weights,
+                         self.get_phase_domains(curr_phase, curr_phase_duration),
+                         starting_plan)
 
-        self.constrain_phase_order()
-        self.constrain_cycle_order()
+        solution = self.solve_model(output_file)
 
-        self.constrain_cluster_departure(inflow)
-        self.constrain_cluster_precedence(inflow)
+        if solution:
+            plan = self.get_phase_plan(solution)
+            status = {'status': solution.status,
+                      'gap': solution.gap,
+                      'build_time': self.build_time,
+                      'solve_time': self.solve_time,
+                      'cycle_count': self.cycle_count}
 
-        self.add_objective([inflow], [1])
+        else:
+            self.model.export('nosolution' + self.model.EXTENSION)
+            print('No solution')
+            plan = None
+            status = None
 
-        if output_file is not None:
-            self.model.export_model(output_file)
+        return plan, status
 
-        try:
-            solution = self.model.solve()
-        except LocalSolverException:
-            solution = None
-            self.model.export_model('localsolverexception.cpo')
-            print('LocalSolverException raised!')
+    def schedule_inflow_according_to_plan(self, inflow, plan):
+        # Same delay as schedule_inflow_according_to_plan_with_cp, computed
+        # by the plan evaluator
+        [delay] = self.evaluator.evaluate([inflow], plan).tolist()
+        return delay
 
-        if solution:
-            plan = {}
+    def schedule_inflows_according_to_plan(self, inflows, plan):
+        return self.evaluator.evaluate(inflows, plan).tolist()
 
-            for cycle in range(self.cycle_count):
-                for phase in self.phases:
-                    var_sol = solution.get_var_solution(self.phase_intervals[(phase, cycle)])
-                    plan[(cycle, phase)] = (var_sol.get_start(), var_sol.get_end())
+    def evaluate_plan(self, inflow, plan):
+        # Delay of the inflow under the plan and its cluster departures, as
+        # in schedule_over_all_samples (None if there is no schedule)
+        delays, departures = self.evaluator.evaluate([inflow], plan, with_departures=True)
+        return float(delays[0]), departures[0]
+
+    def schedule_inflow_according_to_plan_with_cp(self, inflow, plan, output_file=None):
+
+        delay, _ = self.evaluate_plan_with_cp(inflow, plan, output_file)
+
+        return delay
+
+    def evaluate_plan_with_cp(self, inflow, plan, output_file=None):
+        # evaluate_plan with a CP solve
+
+        if self.adaptive_cycles:
+            self.set_cycle_count(plan)
+
+        self.build_model('Quiet',
+                         [inflow],
+                         [1],
+                         self.get_planned_phase_domains(plan))
 
+        solution = self.solve_model(output_file)
+
+        if solution:
+            delay = solution.objective
+            departures = self.get_departures(solution, inflow)
         else:
-            self.model.export_model('nosolution.cpo')
+            self.model.export('nosolution' + self.model.EXTENSION)
             print('No solution')
-            plan = None
+            delay = float('inf')
+            departures = None
 
-        return plan    
+        return delay, departures
+
+    def schedule_by_decomposition(self, inflows, weights, curr_phase, curr_phase_duration, representative_count,
+                                  status_file=None, starting_plan=None):
+        # Decomposed alternative to schedule_over_all_samples: candidate
+        # phase plans are computed for the representative_count most frequent
+        # inflows only, jointly and one at a time, all at once by the worker
+        # processes, then every candidate is evaluated on every inflow by
+        # the plan evaluator and the plan with the least weighted delay is
+        # kept. If no candidate serves every inflow, all the inflows are
+        # scheduled together instead. Returns the same as
+        # schedule_over_all_samples.
+        #
+        # With adaptive cycles, the candidates have as many cycles as all
+        # the inflows need, not only the representatives.
+        representatives = sorted(range(len(inflows)), key=lambda index: -weights[index])[:representative_count]
+        if self.adaptive_cycles:
+            cycle_count = self.get_clearing_cycle_count(inflows, curr_phase, curr_phase_duration)
+        else:
+            cycle_count = None
+
+        # The joint solve first, then one solve per representative
+        tasks = [([inflows[index] for index in representatives],
+                  [weights[index] for index in representatives],
+                  curr_phase,
+                  curr_phase_duration,
+                  starting_plan,
+                  cycle_count)]
+        if len(representatives) > 1:
+            tasks.extend(([inflows[index]], [1], curr_phase, curr_phase_duration, None, cycle_count)
+                         for index in representatives)
+
+        start_solve = timeit.default_timer()
+        if self.workers > 1:
+            self.start_pool()
+            results = self.pool.map(_get_plan_for_samples, tasks)
+        else:
+            results = [_get_plan(self, task) for task in tasks]
+        solve_time = timeit.default_timer() - start_solve
+
+        candidates = [plan for plan, _ in results if plan is not None]
+        _, joint_status = results[0]
+
+        best_delay = float('inf')
+        best_candidate = None
+        best_departures = None
+        for candidate, plan in enumerate(candidates):
+            delays, departures = self.evaluator.evaluate(inflows, plan, with_departures=True)
+            delay = sum(weight * delay for weight, delay in zip(weights, delays))
+            logger.debug('Candidate plan {}: weighted delay = {}'.format(candidate, delay))
+            if delay < best_delay:
+                best_delay = delay
+                best_candidate = candidate
+                best_departures = departures
+
+        if best_candidate is None:
+            logger.debug('No candidate plan serves all samples')
+            return self.schedule_over_all_samples(inflows,
+                                                  weights,
+                                                  curr_phase,
+                                                  curr_phase_duration,
+                                                  status_file=status_file,
+                                                  starting_plan=starting_plan,
+                                                  cycle_count=cycle_count)
+
+        if status_file:
+            # The status, gap and build time are those of the joint solve,
+            # the solve time that of all the candidate solves
+            with open(status_file, 'w') as fp:
+                json.dump({'status': joint_status['status'] if joint_status else None,
+                           'backend': self.backend,
+                           'delay': best_delay,
+                           'gap': joint_status['gap'] if joint_status else None,
+                           'build_time': joint_status['build_time'] if joint_status else None,
+                           'solve_time': solve_time,
+                           'warm_start': starting_plan is not None,
+                           'cycle_count': len(candidates[best_candidate]) // self.phase_count,
+                           'candidates': len(candidates),
+                           'best_candidate': best_candidate}, fp, indent=4)
+
+        self.last_plan = candidates[best_candidate]
+        (_, extension) = self.last_plan[(0, curr_phase)]
+
+        return extension, best_departures
+
+    def start_pool(self):
+        if self.pool is None:
+            # Plans are computed with one CP Optimizer worker each
+            args = (self.phases, self.Gmin, self.Gmax, self.Y, self.sult, self.timelimit // self.threads, self.max_cycle_count)
+            kwargs = {'model_cache_size': self.model_cache_size,
+                      'adaptive_cycles': self.adaptive_cycles,
+                      'backend': self.backend}
+            self.pool = multiprocessing.Pool(self.workers,
+                                             initializer=_initialize_worker,
+                                             initargs=(args, kwargs))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.pool = None
+
+    def get_departures(self, solution, inflow, inflow_id=0):
+        # TODO(srishti): Simplify it
+        departures = {}
 
-    def schedule_inflow_according_to_plan(self, inflow, plan, output_file=None):
+        for phase, sequence in inflow.items():
+            if phase not in departures:
+                departures[phase] = []
 
-        inflow_id = 0
-        self.phase_intervals = {}
-        self.cluster_intervals = {}
+            for cluster_id, cluster in enumerate(sequence):
+                cluster_departures = []
 
-        self.model = docplex.cp.model.CpoModel()
+                for cycle in range(self.cycle_count):
+                    if (inflow_id, phase, cluster_id, cycle) not in self.cluster_intervals:
+                        continue
+                    var_sol = solution.get_interval(self.cluster_intervals[(inflow_id, phase, cluster_id, cycle)])
+                    if var_sol is not None and var_sol.size > 0:
+                        departure = SliceDeparture(departure=var_sol.start,
+                                                   ratio=var_sol.size/cluster.duration)
+                        cluster_departures.append(departure)
+
+                departures[phase].append(cluster_departures)
+
+        return departures
+
+    def adapt_cycle_count(self, inflows, curr_phase, curr_phase_duration, cycle_count=None):
+        # In adaptive mode, sets the cycles of the next model to cycle_count,
+        # or if it is not given to those of get_clearing_cycle_count, and
+        # prunes the cluster intervals that cannot end before the latest
+        # end of their phase interval
+        if not self.adaptive_cycles:
+            return
+        if cycle_count is None:
+            cycle_count = self.get_clearing_cycle_count(inflows, curr_phase, curr_phase_duration)
+        self.set_cycle_count(self.get_green_plan(curr_phase, curr_phase_duration, cycle_count, self.Gmax))
+
+    def set_cycle_count(self, plan):
+        # Models get the cycles of the plan, and only cluster intervals that
+        # can end before the end of their phase interval in the plan
+        self.cycle_count = len(plan) // self.phase_count
+        self.latest_phase_ends = {(phase, cycle): end for (cycle, phase), (_, end) in plan.items()}
+
+    def get_clearing_cycle_count(self, inflows, curr_phase, curr_phase_duration):
+        # Fewest cycles, up to max_cycle_count, such that
+        # - when every phase runs to Gmin, each phase still starts after the
+        #   last cluster of the inflows arrives on it, so a plan can switch
+        #   phases as often as the clusters need, and
+        # - when every phase runs to Gmax, all the clusters are served
+        latest_arrivals = {}
+        for inflow in inflows:
+            for phase, sequence in inflow.items():
+                for cluster in sequence:
+                    latest_arrivals[phase] = max(latest_arrivals.get(phase, 0), int(cluster.arrival))
 
-        self.model.parameters = CpoParameters(LogVerbosity='Quiet', Workers=self.threads,
-                                         TimeLimit=self.timelimit, WarningLevel=0,
-                                         TimeMode='CPUTime')
+        for cycle_count in range(1, self.max_cycle_count):
+            plan = self.get_green_plan(curr_phase, curr_phase_duration, cycle_count, self.Gmin)
+            last_cycle = cycle_count - 1
+            if any(plan[(last_cycle, phase)][0] < arrival for phase, arrival in latest_arrivals.items()):
+                continue
+            plan = self.get_green_plan(curr_phase, curr_phase_duration, cycle_count, self.Gmax)
+            if all(delay < float('inf') for delay in self.evaluator.evaluate(inflows, plan)):
+                return cycle_count
+
+        return self.max_cycle_count
+
+    def get_green_plan(self, curr_phase, curr_phase_duration, cycle_count, greens):
+        # Phase plan, as in get_phase_plan, in which the current phase and all
+        # the following ones have the given greens (Gmin or Gmax). With Gmax,
+        # no phase interval of a model ends later than in this plan. The
+        # phases before the current phase in cycle 0 end before it starts.
+        curr_index = self.phases.index(curr_phase)
+        plan = {}
+
+        start = -curr_phase_duration
+        for phase in reversed(self.phases[:curr_index]):
+            end = start - self.Y[phase]
+            start = end - greens[phase]
+            plan[(0, phase)] = (start, end)
+
+        start = -curr_phase_duration
+        for cycle in range(cycle_count):
+            for index, phase in enumerate(self.phases):
+                if cycle == 0 and index < curr_index:
+                    continue
+                end = start + greens[phase]
+                if cycle == 0 and index == curr_index:
+                    # The current phase ends now at the earliest
+                    end = max(end, 0)
+                plan[(cycle, phase)] = (start, end)
+                start = end + self.Y[phase]
+
+        return plan
+
+    def build_model(self, log_verbosity, inflows, weights, phase_domains, starting_plan=None):
+        # Builds the model over the given inflows and phase interval domains.
+        #
+        # The variables and constraints of a model only depend on the number
+        # of clusters of each phase in each inflow, on whether the phase
+        # intervals have sizes and on the cycles and cluster intervals
+        # pruned in adaptive mode, so with a model cache the models of the last
+        # model_cache_size such structures are kept. A cached model is reused
+        # by setting the domains of its intervals and replacing its
+        # objective and cluster size constraints, which depend on the
+        # clusters. Only backends with REUSABLE models have a model cache.
+        #
+        # The solver starts from starting_plan, a phase plan like those of
+        # get_phase_plan, if one is given.
+        start_build = timeit.default_timer()
+
+        cluster_domains = [self.get_cluster_domains(inflow) for inflow in inflows]
+
+        structure = (log_verbosity,
+               all('size' in domain for domain in phase_domains.values()),
+               tuple(tuple(sorted((phase, len(sequence)) for phase, sequence in inflow.items())) for inflow in inflows),
+               self.cycle_count,
+               tuple(tuple(sorted(domains)) for domains in cluster_domains) if self.latest_phase_ends is not None else None)
+        template = self.model_cache.pop(structure, None)
+
+        if template is None:
+            self.phase_intervals = {}
+            self.cluster_intervals = {}
+
+            self.model = self.model_class(log_verbosity, self.threads, self.timelimit)
+
+            for (phase, cycle), domain in phase_domains.items():
+                self.phase_intervals[(phase, cycle)] = self.model.interval(name='P{}-{}'.format(phase, cycle), **domain)
 
-        self.initialize_phase_schedule(plan)
+            for inflow_id, inflow in enumerate(inflows):
+                self.create_cluster_intervals(inflow, inflow_id)
 
-        self.create_cluster_intervals(inflow)
+            self.constrain_phase_order()
+            self.constrain_cycle_order()
 
-        self.constrain_phase_order()
-        self.constrain_cycle_order()
+            for inflow_id, inflow in enumerate(inflows):
+                self.constrain_cluster_departure(inflow, inflow_id)
+                self.constrain_cluster_precedence(inflow, inflow_id)
 
-        self.constrain_cluster_departure(inflow)
-        self.constrain_cluster_precedence(inflow)
+            template = ModelTemplate(self.model, self.phase_intervals, self.cluster_intervals)
+        else:
+            self.model = template.model
+            self.phase_intervals = template.phase_intervals
+            self.cluster_intervals = template.cluster_intervals
 
-        self.add_objective([inflow], [1])
+            for key, domain in phase_domains.items():
+                self.model.set_domain(self.phase_intervals[key], domain)
 
-        if output_file is not None:
-            self.model.export_model(output_file)
+            for inflow_id, domains in enumerate(cluster_domains):
+                for (phase, index, cycle), domain in domains.items():
+                    self.model.set_domain(self.cluster_intervals[(inflow_id, phase, index, cycle)], domain)
 
-        try:
-            solution = self.model.solve()
-        except LocalSolverException:
-            solution = None
-            self.model.export_model('localsolverexception.cpo')
-            print('LocalSolverException raised!')
+            for expression in template.size_constraints + [template.objective]:
+                self.model.remove(expression)
 
-        if solution:
-            (delay,) = solution.get_objective_values()
+        template.size_constraints = []
+        for inflow_id, inflow in enumerate(inflows):
+            template.size_constraints.extend(self.constrain_cluster_size(inflow, inflow_id))
+        template.objective = self.add_objective(inflows, weights)
+
+        self.set_starting_plan(starting_plan)
+
+        if self.model_cache_size > 0:
+            self.model_cache[structure] = template
+            while len(self.model_cache) > self.model_cache_size:
+                self.model_cache.popitem(last=False)
+
+        self.build_time = timeit.default_timer() - start_build
+
+    def set_starting_plan(self, plan):
+        if plan is None:
+            self.model.set_starting_point(None)
+            return
+
+        starting_point = {}
+        for (cycle, phase), (start, end) in plan.items():
+            if (phase, cycle) in self.phase_intervals:
+                starting_point[self.phase_intervals[(phase, cycle)]] = (int(round(start)), int(round(end)))
+        self.model.set_starting_point(starting_point)
+
+    def get_phase_plan(self, solution):
+        plan = {}
+        for cycle in range(self.cycle_count):
+            for phase in self.phases:
+                var_sol = solution.get_interval(self.phase_intervals[(phase, cycle)])
+                plan[(cycle, phase)] = (var_sol.start, var_sol.end)
+        return plan
+
+    def shift_plan(self, plan, elapsed_time, previous_phase, curr_phase):
+        # The phase plan of a decision as seen elapsed_time later, when the
+        # current phase is curr_phase. Cycle 0 is the cycle of the current
+        # phase, so if the signal has moved on to an earlier phase of the
+        # next cycle the cycles are renumbered and the old cycle 0 is
+        # dropped. The last cycle is then left out of the plan.
+        if self.phases.index(curr_phase) < self.phases.index(previous_phase):
+            cycle_offset = 1
         else:
-            self.model.export_model('nosolution.cpo')
-            print('No solution')
-            delay = float('inf')
+            cycle_offset = 0
 
-        return delay
+        shifted_plan = {}
+        for (cycle, phase), (start, end) in plan.items():
+            if cycle >= cycle_offset:
+                shifted_plan[(cycle - cycle_offset, phase)] = (start - elapsed_time, end - elapsed_time)
+        return shifted_plan
+
+    def solve_model(self, output_file=None):
+
+        if output_file is not None:
+            self.model.export(output_file)
+
+        start_solve = timeit.default_timer()
+
+        solution = self.model.solve()
+
+        self.solve_time = timeit.default_timer() - start_solve
+        logger.debug('Time for building model = {}, solving = {}, gap = {}'.format(self.build_time,
+                                                                            self.solve_time,
+                                                                            solution.gap if solution else None))
+
+        return solution
 
     def add_objective(self, inflows, weights):
 
-        delays = []
+        slices = []
 
         for (inflow_id, phase, index, cycle), interval in self.cluster_intervals.items():
             cluster = inflows[inflow_id][phase][index]
-            delay = self.model.start_of(interval, int(round(cluster.arrival))) - int(round(cluster.arrival))
-            vehicle_count = cluster.count * self.model.size_of(interval, 0) / int(round(cluster.duration))
-            sample_count = weights[inflow_id]
-            delays.append(delay * vehicle_count * sample_count)
+            slices.append((interval,
+                           int(round(cluster.arrival)),
+                           cluster.count,
+                           int(round(cluster.duration)),
+                           weights[inflow_id]))
 
-        self.model.add(self.model.minimize(self.model.sum(delays)))
+        return self.model.minimize_delay(slices)
 
-    def create_phase_intervals(self, curr_phase, curr_phase_duration, curr_phase_end=None):
+    def get_phase_domains(self, curr_phase, curr_phase_duration, curr_phase_end=None):
 
         max_cycle_length = sum([g for g in self.Gmax.values()]) + sum([y for y in self.Y.values()])
         max_plan_end_time = max_cycle_length * self.cycle_count
         plan_time_range = (-max_cycle_length, max_plan_end_time)
 
+        domains = {}
         for phase in self.phases:
             for cycle in range(self.cycle_count):
                 start = -curr_phase_duration if (phase == curr_phase and cycle == 0) else plan_time_range
@@ -308,33 +598,52 @@ class CP(object):
                         end = 0
                     else:
                         end = (curr_phase_end, max_plan_end_time)
-                self.phase_intervals[(phase, cycle)] = self.model.interval_var(start=start,
-                                                                          end=end,
-                                                                          size=(self.Gmin[phase], self.Gmax[phase]),
-                                                                          name='P{}-{}'.format(phase, cycle))
+                domains[(phase, cycle)] = {'start': start,
+                                           'end': end,
+                                           'size': (self.Gmin[phase], self.Gmax[phase])}
+        return domains
 
-    def create_cluster_intervals(self, inflow, inflow_id=0):
+    def get_planned_phase_domains(self, plan):
+
+        domains = {}
+        for phase in self.phases:
+            for cycle in range(self.cycle_count):
+                start, end = plan[(cycle, phase)]
+                domains[(phase, cycle)] = {'start': start, 'end': end}
+        return domains
+
+    def get_cluster_domains(self, inflow):
 
         max_cycle_length = sum([g for g in self.Gmax.values()]) + sum([y for y in self.Y.values()])
         max_plan_end_time = max_cycle_length * self.cycle_count
- 
+
+        domains = {}
         for phase, sequence in inflow.items():
             for index, cluster in enumerate(sequence):
                 for cycle in range(self.cycle_count):
-                    self.cluster_intervals[(inflow_id, phase, index, cycle)] = self.model.interval_var(start=(int(cluster.arrival), max_plan_end_time),
-                                                                                                  end=(int(cluster.arrival), max_plan_end_time),
-                                                                                                  size=(1, int(round(cluster.duration))),
-                                                                                                  optional=True,
-                                                                                                  name='C{}-{}-{}-{}'.format(inflow_id, phase, index, cycle))
+                    if (self.latest_phase_ends is not None) and (int(cluster.arrival) + 1 > self.latest_phase_ends[(phase, cycle)]):
+                        continue
+                    domains[(phase, index, cycle)] = {'start': (int(cluster.arrival), max_plan_end_time),
+                                                      'end': (int(cluster.arrival), max_plan_end_time),
+                                                      'size': (1, int(round(cluster.duration)))}
+        return domains
+
+    def create_phase_intervals(self, curr_phase, curr_phase_duration, curr_phase_end=None):
+
+        for (phase, cycle), domain in self.get_phase_domains(curr_phase, curr_phase_duration, curr_phase_end).items():
+            self.phase_intervals[(phase, cycle)] = self.model.interval(name='P{}-{}'.format(phase, cycle), **domain)
+
+    def create_cluster_intervals(self, inflow, inflow_id=0):
+
+        for (phase, index, cycle), domain in self.get_cluster_domains(inflow).items():
+            self.cluster_intervals[(inflow_id, phase, index, cycle)] = self.model.interval(optional=True,
+                                                                                       name='C{}-{}-{}-{}'.format(inflow_id, phase, index, cycle),
+                                                                                       **domain)
 
     def initialize_phase_schedule(self, plan):
 
-        for phase in self.phases:
-            for cycle in range(self.cycle_count):
-                start, end = plan[(cycle, phase)]
-                self.phase_intervals[(phase, cycle)] = self.model.interval_var(start=start,
-                                                                          end=end,
-                                                                          name='P{}-{}'.format(phase, cycle))
+        for (phase, cycle), domain in self.get_planned_phase_domains(plan).items():
+            self.phase_intervals[(phase, cycle)] = self.model.interval(name='P{}-{}'.format(phase, cycle), **domain)
 
 
     def constrain_phase_order(self):
@@ -343,17 +652,17 @@ class CP(object):
                 continue
             prev_phase = self.phases[index-1]
             for cycle in range(self.cycle_count):
-                self.model.add(self.model.end_at_start(self.phase_intervals[(prev_phase, cycle)],
-                                                     self.phase_intervals[(phase, cycle)],
-                                                     delay=self.Y[prev_phase]))
+                self.model.end_at_start(self.phase_intervals[(prev_phase, cycle)],
+                                        self.phase_intervals[(phase, cycle)],
+                                        self.Y[prev_phase])
 
     def constrain_cycle_order(self):
         first_phase = self.phases[0]
         last_phase = self.phases[-1]
         for cycle in range(1, self.cycle_count):
-            self.model.add(self.model.end_at_start(self.phase_intervals[(last_phase, cycle-1)],
-                                                 self.phase_intervals[(first_phase, cycle)],
-                                                 delay=self.Y[last_phase]))
+            self.model.end_at_start(self.phase_intervals[(last_phase, cycle-1)],
+                                    self.phase_intervals[(first_phase, cycle)],
+                                    self.Y[last_phase])
 
     def constrain_cluster_precedence(self, inflow, inflow_id=0):
 
@@ -363,20 +672,64 @@ class CP(object):
                 if index == 0:
                     continue
                 for cycle in range(self.cycle_count):
-                    self.model.add(self.model.end_before_start(self.cluster_intervals[(inflow_id, phase, index-1, cycle)],
-                                                               self.cluster_intervals[(inflow_id, phase, index, cycle)]))
+                    if (inflow_id, phase, index, cycle) not in self.cluster_intervals:
+                        continue
+                    if (inflow_id, phase, index-1, cycle) in self.cluster_intervals:
+                        self.model.end_before_start(self.cluster_intervals[(inflow_id, phase, index-1, cycle)],
+                                                    self.cluster_intervals[(inflow_id, phase, index, cycle)])
 
                     for future_cycle in range(cycle+1, self.cycle_count):
-                        self.model.add(self.model.if_then(self.model.presence_of(self.cluster_intervals[(inflow_id, phase, index, cycle)]),
-                                                          self.model.logical_not(self.model.presence_of(self.cluster_intervals[(inflow_id, phase, index-1, future_cycle)]))))
+                        if (inflow_id, phase, index-1, future_cycle) not in self.cluster_intervals:
+                            continue
+                        self.model.exclude(self.cluster_intervals[(inflow_id, phase, index, cycle)],
+                                           self.cluster_intervals[(inflow_id, phase, index-1, future_cycle)])
 
     def constrain_cluster_departure(self, inflow, inflow_id=0):
         for phase, sequence in inflow.items():
             for index, cluster in enumerate(sequence):
                 for cycle in range(self.cycle_count):
-                    self.model.add(self.model.start_before_start(self.phase_intervals[(phase, cycle)],
-                                                       self.cluster_intervals[(inflow_id, phase, index, cycle)]))
-                    self.model.add(self.model.end_before_end(self.cluster_intervals[(inflow_id, phase, index, cycle)],
-                                                   self.phase_intervals[(phase, cycle)]))
+                    if (inflow_id, phase, index, cycle) not in self.cluster_intervals:
+                        continue
+                    self.model.within(self.cluster_intervals[(inflow_id, phase, index, cycle)],
+                                      self.phase_intervals[(phase, cycle)])
+
+    def constrain_cluster_size(self, inflow, inflow_id=0):
+        constraints = []
+        for phase, sequence in inflow.items():
+            for index, cluster in enumerate(sequence):
+                constraint = self.model.size_sum([self.cluster_intervals[(inflow_id, phase, index, cycle)]
+                                                  for cycle in range(self.cycle_count)
+                                                  if (inflow_id, phase, index, cycle) in self.cluster_intervals],
+                                                 int(round(cluster.duration)))
+                constraints.append(constraint)
+        return constraints
+
+
+# CP scheduler of a planning worker process
+_worker = {}
+
+
+def _initialize_worker(args, kwargs):
+    _worker['scheduler'] = CP(*args, **kwargs)
+
+
+def _get_plan(scheduler, task):
+    inflows, weights, curr_phase, curr_phase_duration, starting_plan, cycle_count = task
+    return scheduler.get_plan_for_samples(inflows, weights, curr_phase, curr_phase_duration,
+                                          starting_plan=starting_plan, cycle_count=cycle_count)
+
+
+def _get_plan_for_samples(task):
+    return _get_plan(_worker['scheduler'], task)
+
+
+class ModelTemplate(object):
+    # Model of a cached structure with its intervals, and its current
+    # objective and cluster size constraints
 
-                self.model.add(self.model.sum([self.model.size_of(self.cluster_intervals[(inflow_id, phase, index, cycle)]) for cycle in range(self.cycle_count)]) == int(round(cluster.duration)))
\ No newline at end of file
+    def __init__(self, model, phase_intervals, cluster_intervals):
+        self.model = model
+        self.phase_intervals = phase_intervals
+        self.cluster_intervals = cluster_intervals
+        self.size_constraints = []
+        self.objective = None
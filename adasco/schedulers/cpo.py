@@ -0,0 +1,117 @@
+'''
+CP Optimizer (docplex) backend of the CP scheduler
+'''
+from __future__ import print_function
+from __future__ import division
+
+import logging
+
+from docplex.cp.solver.solver_local import LocalSolverException
+from docplex.cp.parameters import CpoParameters
+from docplex.cp.solution import CpoModelSolution
+import docplex.cp.model
+
+import adasco.schedulers.backend
+from adasco.schedulers.backend import IntervalValue
+
+logger = logging.getLogger(__name__)
+
+
+class Model(adasco.schedulers.backend.Model):
+
+    REUSABLE = True
+    EXTENSION = '.cpo'
+
+    def __init__(self, log_verbosity, threads, timelimit):
+        super(Model, self).__init__(log_verbosity, threads, timelimit)
+        self.model = docplex.cp.model.CpoModel()
+        self.model.parameters = CpoParameters(LogVerbosity=log_verbosity, Workers=threads,
+                                              TimeLimit=timelimit, WarningLevel=0,
+                                              TimeMode='CPUTime')
+
+    def interval(self, name, start, end, size=None, optional=False):
+        domain = {'start': start, 'end': end}
+        if size is not None:
+            domain['size'] = size
+        if optional:
+            return self.model.interval_var(optional=True, name=name, **domain)
+        return self.model.interval_var(name=name, **domain)
+
+    def set_domain(self, interval, domain):
+        interval.set_start(domain['start'])
+        interval.set_end(domain['end'])
+        if 'size' in domain:
+            interval.set_size(domain['size'])
+
+    def end_at_start(self, first, second, delay):
+        self.model.add(self.model.end_at_start(first, second, delay=delay))
+
+    def end_before_start(self, first, second):
+        self.model.add(self.model.end_before_start(first, second))
+
+    def within(self, interval, container):
+        self.model.add(self.model.start_before_start(container, interval))
+        self.model.add(self.model.end_before_end(interval, container))
+
+    def exclude(self, first, second):
+        self.model.add(self.model.if_then(self.model.presence_of(first),
+                                          self.model.logical_not(self.model.presence_of(second))))
+
+    def size_sum(self, intervals, size):
+        constraint = self.model.sum([self.model.size_of(interval) for interval in intervals]) == size
+        self.model.add(constraint)
+        return constraint
+
+    def minimize_delay(self, slices):
+        delays = []
+        for interval, arrival, count, duration, weight in slices:
+            delay = self.model.start_of(interval, arrival) - arrival
+            vehicle_count = count * self.model.size_of(interval, 0) / duration
+            delays.append(delay * vehicle_count * weight)
+
+        objective = self.model.minimize(self.model.sum(delays))
+        self.model.add(objective)
+        return objective
+
+    def remove(self, expression):
+        self.model.remove(expression)
+
+    def set_starting_point(self, values):
+        if values is None:
+            self.model.set_starting_point(None)
+            return
+
+        starting_point = CpoModelSolution()
+        for interval, (start, end) in values.items():
+            starting_point.add_interval_var_solution(interval, presence=True, start=start, end=end)
+        self.model.set_starting_point(starting_point)
+
+    def solve(self):
+        try:
+            result = self.model.solve()
+        except LocalSolverException:
+            self.export('localsolverexception' + self.EXTENSION)
+            print('LocalSolverException raised!')
+            return None
+
+        if not result:
+            return None
+        return Solution(result)
+
+    def export(self, filename):
+        self.model.export_model(filename)
+
+
+class Solution(adasco.schedulers.backend.Solution):
+
+    def __init__(self, result):
+        (objective,) = result.get_objective_values()
+        (gap,) = result.get_objective_gaps()
+        super(Solution, self).__init__(result.solve_status, objective, gap)
+        self.result = result
+
+    def get_interval(self, interval):
+        var_sol = self.result.get_var_solution(interval)
+        if var_sol.get_start() is None:
+            return None
+        return IntervalValue(start=var_sol.get_start(), end=var_sol.get_end(), size=var_sol.get_size())
@@ -0,0 +1,144 @@
+'''
+OR-Tools CP-SAT backend of the CP scheduler
+'''
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import logging
+
+from ortools.sat.python import cp_model
+
+import adasco.schedulers.backend
+from adasco.schedulers.backend import IntervalValue
+
+logger = logging.getLogger(__name__)
+
+# Variables of an interval. presence is None for intervals that are not
+# optional, and product is the variable start * size of the objective.
+Interval = namedtuple('Interval', ['start', 'end', 'size', 'presence', 'product'])
+
+
+def get_bounds(domain):
+    if isinstance(domain, tuple):
+        return int(domain[0]), int(domain[1])
+    return int(domain), int(domain)
+
+
+class Model(adasco.schedulers.backend.Model):
+    # CP-SAT has no optional interval sizes or default values, so the size
+    # of an optional interval is a variable that is 0 if and only if the
+    # interval is absent, and constraints are enforced by the presence of
+    # their intervals. The delay of a slice is quadratic, so optional
+    # intervals have a variable start * size in which the objective is
+    # linear.
+    #
+    # Models are not reused: CP-SAT cannot change domains or remove
+    # constraints after they are added. The time limit is divided over the
+    # threads because CP-SAT limits wall time, not CPU time.
+
+    REUSABLE = False
+    EXTENSION = '.pb.txt'
+
+    def __init__(self, log_verbosity, threads, timelimit):
+        super(Model, self).__init__(log_verbosity, threads, timelimit)
+        self.model = cp_model.CpModel()
+
+    def interval(self, name, start, end, size=None, optional=False):
+        start_min, start_max = get_bounds(start)
+        end_min, end_max = get_bounds(end)
+        if size is None:
+            size_min, size_max = 0, end_max - start_min
+        else:
+            size_min, size_max = get_bounds(size)
+
+        start_var = self.model.NewIntVar(start_min, start_max, '{}-start'.format(name))
+        end_var = self.model.NewIntVar(end_min, end_max, '{}-end'.format(name))
+
+        if not optional:
+            size_var = self.model.NewIntVar(size_min, size_max, '{}-size'.format(name))
+            self.model.NewIntervalVar(start_var, size_var, end_var, name)
+            return Interval(start_var, end_var, size_var, None, None)
+
+        size_domain = cp_model.Domain.FromIntervals([[0, 0], [size_min, size_max]])
+        size_var = self.model.NewIntVarFromDomain(size_domain, '{}-size'.format(name))
+        presence = self.model.NewBoolVar('{}-presence'.format(name))
+        self.model.NewOptionalIntervalVar(start_var, size_var, end_var, presence, name)
+        self.model.Add(size_var == 0).OnlyEnforceIf(presence.Not())
+        self.model.Add(size_var >= max(size_min, 1)).OnlyEnforceIf(presence)
+
+        products = [start_min * size_min, start_min * size_max, start_max * size_min, start_max * size_max, 0]
+        product = self.model.NewIntVar(min(products), max(products), '{}-product'.format(name))
+        self.model.AddMultiplicationEquality(product, [start_var, size_var])
+
+        return Interval(start_var, end_var, size_var, presence, product)
+
+    def get_presences(self, *intervals):
+        return [interval.presence for interval in intervals if interval.presence is not None]
+
+    def end_at_start(self, first, second, delay):
+        self.model.Add(second.start == first.end + delay).OnlyEnforceIf(self.get_presences(first, second))
+
+    def end_before_start(self, first, second):
+        self.model.Add(first.end <= second.start).OnlyEnforceIf(self.get_presences(first, second))
+
+    def within(self, interval, container):
+        presences = self.get_presences(interval, container)
+        self.model.Add(container.start <= interval.start).OnlyEnforceIf(presences)
+        self.model.Add(interval.end <= container.end).OnlyEnforceIf(presences)
+
+    def exclude(self, first, second):
+        self.model.AddBoolOr([presence.Not() for presence in self.get_presences(first, second)])
+
+    def size_sum(self, intervals, size):
+        return self.model.Add(sum(interval.size for interval in intervals) == size)
+
+    def minimize_delay(self, slices):
+        # (start - arrival) * size = product - arrival * size, and both are
+        # 0 for absent slices
+        delays = []
+        for interval, arrival, count, duration, weight in slices:
+            delays.append((count * weight / duration) * (interval.product - arrival * interval.size))
+
+        objective = sum(delays)
+        self.model.Minimize(objective)
+        return objective
+
+    def set_starting_point(self, values):
+        self.model.ClearHints()
+        if values is None:
+            return
+
+        for interval, (start, end) in values.items():
+            self.model.AddHint(interval.start, start)
+            self.model.AddHint(interval.end, end)
+
+    def solve(self):
+        solver = cp_model.CpSolver()
+        solver.parameters.num_workers = self.threads
+        solver.parameters.max_time_in_seconds = self.timelimit / self.threads
+        solver.parameters.log_search_progress = self.log_verbosity not in ('Quiet', 'Terse')
+
+        status = solver.Solve(self.model)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return None
+        return Solution(solver, status)
+
+    def export(self, filename):
+        self.model.ExportToFile(filename)
+
+
+class Solution(adasco.schedulers.backend.Solution):
+
+    def __init__(self, solver, status):
+        objective = solver.ObjectiveValue()
+        gap = abs(objective - solver.BestObjectiveBound()) / max(abs(objective), 1e-10)
+        super(Solution, self).__init__(solver.StatusName(status), objective, gap)
+        self.solver = solver
+
+    def get_interval(self, interval):
+        if interval.presence is not None and not self.solver.BooleanValue(interval.presence):
+            return None
+        return IntervalValue(start=self.solver.Value(interval.start),
+                             end=self.solver.Value(interval.end),
+                             size=self.solver.Value(interval.size))
@@ -0,0 +1,109 @@
+'''
+Delay of inflows under a fixed phase plan, without a solver
+'''
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SliceDeparture = namedtuple('SliceDeparture', ['departure', 'ratio'])
+
+
+class PlanEvaluator(object):
+    # Computes what CP.schedule_inflow_according_to_plan_with_cp computes for
+    # a phase plan (cycle, phase) -> (start, end) of integer times, with any
+    # number of cycles, for many inflows at once.
+    #
+    # With the phase intervals fixed, the phases of the CP model are
+    # independent, and on each phase the clusters are served in order. Each
+    # cluster is split into at most one slice per cycle and every slice
+    # starts as early as the green window, the cluster's (truncated) arrival
+    # and the previous slice allow, which is optimal: serving a slice earlier
+    # never delays another one. Times and slice sizes are integers, and the
+    # delay of a slice is measured from the rounded arrival, as in the CP
+    # model. If a cluster does not fit in the windows of the plan the inflow
+    # has no schedule and an infinite delay.
+    #
+    # Inflows are processed together: each step serves the next cluster of
+    # one phase in all inflows, with the clusters in arrays of one row per
+    # inflow.
+
+    def __init__(self, phases):
+        self.phases = phases
+
+    def evaluate(self, inflows, plan, with_departures=False):
+        # Returns the delay of each inflow and, if with_departures is set,
+        # its departures in the format of CP.schedule_over_all_samples (None
+        # for inflows with an infinite delay)
+        cycle_count = len(plan) // len(self.phases)
+        inflow_count = len(inflows)
+        delays = np.zeros(inflow_count)
+        departures = [{} for _ in inflows]
+
+        for phase in self.phases:
+            window_starts = np.array([plan[(cycle, phase)][0] for cycle in range(cycle_count)], dtype=np.float64)
+            window_ends = np.array([plan[(cycle, phase)][1] for cycle in range(cycle_count)], dtype=np.float64)
+
+            sequences = [inflow.get(phase, []) for inflow in inflows]
+            cluster_count = max([len(sequence) for sequence in sequences] + [0])
+            if cluster_count == 0:
+                continue
+
+            # Rounded as in the CP model, missing clusters have duration 0
+            counts = np.zeros((inflow_count, cluster_count))
+            earliest_starts = np.zeros((inflow_count, cluster_count))
+            reference_arrivals = np.zeros((inflow_count, cluster_count))
+            durations = np.zeros((inflow_count, cluster_count))
+            exact_durations = np.ones((inflow_count, cluster_count))
+            for row, sequence in enumerate(sequences):
+                for column, cluster in enumerate(sequence):
+                    counts[row, column] = cluster.count
+                    earliest_starts[row, column] = int(cluster.arrival)
+                    reference_arrivals[row, column] = int(round(cluster.arrival))
+                    durations[row, column] = int(round(cluster.duration))
+                    exact_durations[row, column] = cluster.duration
+
+            # Slice start and size of each cluster in each cycle (size 0 if
+            # the cluster has no slice in the cycle)
+            starts = np.zeros((inflow_count, cluster_count, cycle_count))
+            sizes = np.zeros((inflow_count, cluster_count, cycle_count))
+
+            # Earliest time the phase is free in each inflow
+            free = np.full(inflow_count, -np.inf)
+            for column in range(cluster_count):
+                remaining = durations[:, column].copy()
+                for cycle in range(cycle_count):
+                    start = np.maximum(np.maximum(free, window_starts[cycle]), earliest_starts[:, column])
+                    size = np.minimum(remaining, np.maximum(window_ends[cycle] - start, 0))
+                    served = size >= 1
+                    starts[served, column, cycle] = start[served]
+                    sizes[served, column, cycle] = size[served]
+                    free = np.where(served, start + size, free)
+                    remaining = np.where(served, remaining - size, remaining)
+
+                unserved = remaining > 0
+                delays[unserved] = np.inf
+
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    slice_delays = ((starts[:, column, :] - reference_arrivals[:, column, np.newaxis])
+                                    * counts[:, column, np.newaxis]
+                                    * sizes[:, column, :] / durations[:, column, np.newaxis])
+                delays += np.where(sizes[:, column, :] > 0, slice_delays, 0).sum(axis=1)
+
+            if with_departures:
+                for row, sequence in enumerate(sequences):
+                    departures[row][phase] = [[SliceDeparture(departure=int(starts[row, column, cycle]),
+                                                              ratio=float(sizes[row, column, cycle] / exact_durations[row, column]))
+                                               for cycle in range(cycle_count) if sizes[row, column, cycle] > 0]
+                                              for column in range(len(sequence))]
+
+        if not with_departures:
+            return delays
+
+        departures = [departure if delay != np.inf else None for delay, departure in zip(delays, departures)]
+        return delays, departures
@@ -0,0 +1,94 @@
+'''
+Scalar kernels for the dense SchIC engine, compiled with numba when it is installed
+'''
+from __future__ import print_function
+from __future__ import division
+
+import logging
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+logger = logging.getLogger(__name__)
+
+COMPILED = numba is not None
+
+
+def relax_layer_python(statuses, digits, strides,
+                       arrivals, durations, counts,
+                       phase_duration, finish_time, start_time, delay, previous_phase, present,
+                       Gmin, min_switch, switch_back, startup_lost_time, optimization_horizon):
+    # Relaxes the states of the given statuses, which must all be in the same
+    # layer, from the states of the previous layer. Same transition as
+    # SchIC.update_state, in the same order and with the same tie-breaking,
+    # but no state is allocated for a candidate that is rejected.
+    #
+    # arrivals, durations and counts: phase -> cluster index -> value, padded
+    # Gmin, switch_back: phase index -> value
+    # min_switch: previous phase index -> phase index -> value
+    phase_count = digits.shape[1]
+
+    for status in statuses:
+        for k in range(phase_count):
+            cluster_index = digits[status, k] - 1
+            if cluster_index < 0:
+                continue
+            previous_status = status - strides[k]
+            arrival = arrivals[k, cluster_index]
+            duration = durations[k, cluster_index]
+            count = counts[k, cluster_index]
+
+            best_delay = np.inf
+            best_phase = -1
+            best_duration = 0.0
+            best_time = 0.0
+            best_start_time = 0.0
+
+            for j in range(phase_count):
+                if not present[previous_status, j]:
+                    continue
+                previous_duration = phase_duration[previous_status, j]
+                time = finish_time[previous_status, j]
+
+                if j != k and previous_duration < Gmin[j]:
+                    time += Gmin[j] - previous_duration
+
+                permitted_start_time = time + min_switch[j, k]
+                actual_start_time = max(arrival, permitted_start_time)
+
+                if j != k and permitted_start_time > arrival:
+                    actual_start_time += startup_lost_time
+
+                time = actual_start_time + duration
+
+                if j != k or arrival - permitted_start_time > switch_back[k]:
+                    new_duration = time - permitted_start_time
+                else:
+                    new_duration = previous_duration + (time - permitted_start_time)
+
+                new_delay = delay[previous_status, j] + count * (actual_start_time - arrival)
+
+                if time < optimization_horizon and new_delay < best_delay:
+                    best_delay = new_delay
+                    best_phase = j
+                    best_duration = new_duration
+                    best_time = time
+                    best_start_time = actual_start_time
+
+            if best_phase >= 0:
+                phase_duration[status, k] = best_duration
+                finish_time[status, k] = best_time
+                start_time[status, k] = best_start_time
+                delay[status, k] = best_delay
+                previous_phase[status, k] = best_phase
+                present[status, k] = True
+
+
+if COMPILED:
+    relax_layer = numba.njit(cache=True)(relax_layer_python)
+else:
+    relax_layer = relax_layer_python
@@ -0,0 +1,320 @@
+'''
+Time-indexed MILP formulation of the phase plan problem of the SAA agent, solved by HiGHS through scipy
+'''
+from __future__ import print_function
+from __future__ import division
+
+import json
+import logging
+import timeit
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import coo_matrix
+
+from adasco.schedulers.evaluator import PlanEvaluator
+
+logger = logging.getLogger(__name__)
+
+
+class MILP(object):
+    # Same problem as CP.schedule_over_all_samples, with time divided into
+    # steps of one second from now to the end of the CP plan horizon
+    # (cycle_count cycles of Gmax), and for each phase and step binaries
+    #
+    # x: the phase is green during the step
+    # u: the phase turns green at the start of the step
+    # v: the phase turns yellow at the start of the step
+    #
+    # A phase turns green Y after the previous phase turns yellow, greens
+    # last from Gmin to Gmax, and at most one phase is green or yellow at a
+    # time. Each phase has at most the greens of cycle_count cycles, and
+    # after the last green of the plan no phase turns green again, as after
+    # the last cycle of a CP plan. Clusters are served one unit of their (rounded) duration per
+    # green step, from their truncated arrival, and a unit served at step t
+    # waits t - arrival - (its position in the cluster), so a cluster served
+    # without interruption has the delay of the CP model.
+    #
+    # Unlike in the CP model, the clusters of a phase may be served out of
+    # order, so the MILP delay is only a bound. The delay and departures
+    # reported are those of the MILP phase plan under the CP model, from the
+    # plan evaluator.
+
+    def __init__(self, phases, Gmin, Gmax, Y, sult, timelimit, cycle_count):
+        self.phases = phases
+        self.Gmin = Gmin
+        self.Gmax = Gmax
+        self.Y = Y
+
+        self.sult = sult
+
+        self.phase_count = len(phases)
+        self.cycle_count = cycle_count
+        self.timelimit = timelimit
+
+        max_cycle_length = sum([g for g in self.Gmax.values()]) + sum([y for y in self.Y.values()])
+        self.horizon = max_cycle_length * self.cycle_count
+
+        self.evaluator = PlanEvaluator(phases)
+
+        self.program = None
+        self.x = None
+        self.build_time = 0
+        self.solve_time = 0
+        self.last_plan = None
+
+    def schedule_over_all_samples(self, inflows, weights, curr_phase, curr_phase_duration, status_file=None,
+                                  starting_plan=None):
+        # Same as CP.schedule_over_all_samples, except that the extension is
+        # that of the best plan found for the relaxation (see MILP). The MILP
+        # solves have no starting point, so there is no starting_plan.
+        if starting_plan is not None:
+            raise ValueError('The MILP scheduler has no warm start')
+
+        self.build_model(inflows, weights, curr_phase, curr_phase_duration)
+
+        start_solve = timeit.default_timer()
+        result = self.program.solve(self.timelimit)
+        self.solve_time = timeit.default_timer() - start_solve
+        logger.debug('Time for building model = {}, solving = {}'.format(self.build_time, self.solve_time))
+
+        if result.x is None:
+            print('No solution: {}'.format(result.message))
+            self.last_plan = None
+            return None, None
+
+        green = result.x[self.x] > 0.5
+        extension, self.last_plan = self.get_phase_plan(green, curr_phase, curr_phase_duration)
+
+        if not self.is_valid_plan(self.last_plan, curr_phase):
+            print('No solution: the phase plan violates Gmin or Gmax')
+            self.last_plan = None
+            return None, None
+
+        delays, departures = self.evaluator.evaluate(inflows, self.last_plan, with_departures=True)
+        delay = sum(weight * delay for weight, delay in zip(weights, delays))
+
+        if status_file:
+            with open(status_file, 'w') as fp:
+                json.dump({'status': result.message,
+                           'backend': 'milp',
+                           'delay': delay,
+                           'milp_delay': result.fun + self.program.constant,
+                           'gap': getattr(result, 'mip_gap', None),
+                           'build_time': self.build_time,
+                           'solve_time': self.solve_time}, fp, indent=4)
+
+        return extension, departures
+
+    def close(self):
+        pass
+
+    def build_model(self, inflows, weights, curr_phase, curr_phase_duration):
+        start_build = timeit.default_timer()
+
+        horizon = self.horizon
+        self.program = LinearProgram()
+        self.x = self.program.add_variables((self.phase_count, horizon), integral=True)
+        u = self.program.add_variables((self.phase_count, horizon), integral=True)
+        v = self.program.add_variables((self.phase_count, horizon), integral=True)
+
+        self.constrain_transitions(u, v, curr_phase)
+        self.constrain_green_times(u, curr_phase, curr_phase_duration)
+        self.constrain_cycles(u, curr_phase)
+        self.constrain_exclusion(v)
+        for inflow, weight in zip(inflows, weights):
+            self.add_service(inflow, weight)
+
+        self.build_time = timeit.default_timer() - start_build
+
+    def constrain_transitions(self, u, v, curr_phase):
+        x = self.x
+        for p, phase in enumerate(self.phases):
+            previous = (p - 1) % self.phase_count
+            previous_yellow = self.Y[self.phases[previous]]
+            was_green = 1 if phase == curr_phase else 0
+
+            for t in range(self.horizon):
+                # Green continues unless the phase turns yellow
+                if t == 0:
+                    self.program.add_constraint([x[p, t], u[p, t], v[p, t]], [1, -1, 1], was_green, was_green)
+                else:
+                    self.program.add_constraint([x[p, t], x[p, t-1], u[p, t], v[p, t]], [1, -1, -1, 1], 0, 0)
+
+                # The phase turns green when the previous phase's yellow ends,
+                # unless the plan has ended
+                if t >= previous_yellow:
+                    self.program.add_constraint([u[p, t], v[previous, t-previous_yellow]], [1, -1], -np.inf, 0)
+                else:
+                    self.program.add_constraint([u[p, t]], [1], 0, 0)
+
+    def constrain_green_times(self, u, curr_phase, curr_phase_duration):
+        x = self.x
+        horizon = self.horizon
+        for p, phase in enumerate(self.phases):
+            Gmin = self.Gmin[phase]
+            Gmax = self.Gmax[phase]
+
+            for t in range(horizon):
+                length = min(Gmin, horizon - t)
+                indices = [x[p, t+k] for k in range(length)] + [u[p, t]]
+                self.program.add_constraint(indices, [1] * length + [-length], 0, np.inf)
+
+            for t in range(horizon - Gmax):
+                self.program.add_constraint([x[p, t+k] for k in range(Gmax + 1)], [1] * (Gmax + 1), -np.inf, Gmax)
+
+            if phase == curr_phase:
+                for t in range(min(Gmin - curr_phase_duration, horizon)):
+                    self.program.lower[x[p, t]] = 1
+                remaining = max(Gmax - curr_phase_duration, 0)
+                if remaining < horizon:
+                    self.program.add_constraint([x[p, t] for t in range(remaining + 1)], [1] * (remaining + 1), -np.inf, remaining)
+
+    def constrain_cycles(self, u, curr_phase):
+        # As many greens of each phase as in cycle_count cycles of the CP
+        # model, in which the phases up to the current one already had
+        # their green of cycle 0
+        curr_index = self.phases.index(curr_phase)
+        for p in range(self.phase_count):
+            greens = self.cycle_count - 1 if p <= curr_index else self.cycle_count
+            self.program.add_constraint(u[p], [1] * self.horizon, -np.inf, greens)
+
+    def constrain_exclusion(self, v):
+        x = self.x
+        for t in range(self.horizon):
+            indices = [x[p, t] for p in range(self.phase_count)]
+            for p, phase in enumerate(self.phases):
+                indices.extend(v[p, t-k] for k in range(self.Y[phase]) if t - k >= 0)
+            self.program.add_constraint(indices, [1] * len(indices), -np.inf, 1)
+
+    def add_service(self, inflow, weight):
+        x = self.x
+        horizon = self.horizon
+        for p, phase in enumerate(self.phases):
+            # Service variables of the phase's clusters at each step
+            served = {}
+            for cluster in inflow.get(phase, []):
+                duration = int(round(cluster.duration))
+                earliest_start = int(cluster.arrival)
+                if duration == 0 or earliest_start >= horizon:
+                    continue
+                arrival = int(round(cluster.arrival))
+                steps = np.arange(earliest_start, horizon)
+                vehicle_rate = weight * cluster.count / duration
+
+                z = self.program.add_variables(len(steps), upper=1, cost=vehicle_rate * steps)
+                self.program.constant -= vehicle_rate * (duration * arrival + duration * (duration - 1) / 2)
+                self.program.add_constraint(z, [1] * len(z), duration, duration)
+                for step, index in zip(steps, z):
+                    served.setdefault(step, []).append(index)
+
+            for t, indices in served.items():
+                self.program.add_constraint(indices + [x[p, t]], [1] * len(indices) + [-1], -np.inf, 0)
+
+    def get_phase_plan(self, green, curr_phase, curr_phase_duration):
+        # Phase plan of the green steps, as in CP.get_phase_plan, with empty
+        # intervals for the phases before the current phase in cycle 0 and
+        # for the phases after the last green of the horizon. Returns the
+        # extension of the current phase and the plan.
+        curr_index = self.phases.index(curr_phase)
+
+        runs = []
+        for p, phase in enumerate(self.phases):
+            t = 0
+            while t < self.horizon:
+                if green[p, t]:
+                    start = t
+                    while t < self.horizon and green[p, t]:
+                        t += 1
+                    runs.append((start, t, p))
+                else:
+                    t += 1
+        runs.sort()
+
+        plan = {}
+        for p in range(curr_index):
+            plan[(0, self.phases[p])] = (-curr_phase_duration, -curr_phase_duration)
+
+        if runs and runs[0][0] == 0 and runs[0][2] == curr_index:
+            extension = runs.pop(0)[1]
+        else:
+            extension = 0
+        plan[(0, curr_phase)] = (-curr_phase_duration, extension)
+
+        cycle, p = 0, curr_index
+        for start, end, run_phase in runs:
+            while True:
+                p += 1
+                if p == self.phase_count:
+                    cycle, p = cycle + 1, 0
+                if p == run_phase:
+                    break
+                plan[(cycle, self.phases[p])] = (start, start)
+            plan[(cycle, self.phases[p])] = (start, end)
+
+        for p in range(p + 1, self.phase_count):
+            plan[(cycle, self.phases[p])] = (self.horizon, self.horizon)
+
+        return extension, plan
+
+    def is_valid_plan(self, plan, curr_phase):
+        # Whether every green of the plan lasts from Gmin to Gmax. Empty
+        # greens are skipped phases, and the last green may be cut short by
+        # the horizon.
+        for (cycle, phase), (start, end) in plan.items():
+            if start == end and not (cycle == 0 and phase == curr_phase):
+                continue
+            length = end - start
+            if length > self.Gmax[phase]:
+                logger.error('Green of phase {} in cycle {} lasts {} > Gmax'.format(phase, cycle, length))
+                return False
+            if length < self.Gmin[phase] and end < self.horizon:
+                logger.error('Green of phase {} in cycle {} lasts {} < Gmin'.format(phase, cycle, length))
+                return False
+        return True
+
+
+class LinearProgram(object):
+    # Thin wrapper collecting a sparse MILP for scipy.optimize.milp, which
+    # solves it with HiGHS. Variables are bounded and constraints are ranges
+    # lower <= coefficients . variables <= upper.
+
+    def __init__(self):
+        self.costs = []
+        self.lower = []
+        self.upper = []
+        self.integrality = []
+        self.rows = []
+        self.columns = []
+        self.values = []
+        self.row_lower = []
+        self.row_upper = []
+        # Added to the objective of the solver
+        self.constant = 0
+
+    def add_variables(self, shape, lower=0, upper=1, integral=False, cost=0):
+        # Returns an array of the indices of the new variables
+        count = int(np.prod(shape))
+        first = len(self.costs)
+        self.costs.extend(np.broadcast_to(cost, (count,)).tolist())
+        self.lower.extend([lower] * count)
+        self.upper.extend([upper] * count)
+        self.integrality.extend([1 if integral else 0] * count)
+        return np.arange(first, first + count).reshape(shape)
+
+    def add_constraint(self, indices, coefficients, lower, upper):
+        row = len(self.row_lower)
+        self.rows.extend([row] * len(indices))
+        self.columns.extend(indices)
+        self.values.extend(coefficients)
+        self.row_lower.append(lower)
+        self.row_upper.append(upper)
+
+    def solve(self, timelimit):
+        matrix = coo_matrix((self.values, (self.rows, self.columns)),
+                            shape=(len(self.row_lower), len(self.costs))).tocsr()
+        return milp(np.array(self.costs),
+                    integrality=np.array(self.integrality),
+                    bounds=Bounds(self.lower, self.upper),
+                    constraints=LinearConstraint(matrix, self.row_lower, self.row_upper),
+                    options={'time_limit': timelimit, 'disp': False})
@@ -2,9 +2,16 @@ from __future__ import print_function
 from __future__ import division
 
 from collections import namedtuple
+import multiprocessing
+import ctypes
 import logging
+import timeit
+
+import numpy as np
 
 from adasco.cluster import Cluster, ClusterSequence
+from adasco.timing import PhaseTiming
+import adasco.schedulers.kernels
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +20,30 @@ State = namedtuple('State', ['phase_duration',
                              'delay',
                              'previous_phase'])
 
+# A state of the dynamic program with Gmax splits: the rests of the clusters
+# that were split (phase -> (number of splits, inflow cluster)), the state it
+# was computed from and the segments scheduled by that transition
+SplitState = namedtuple('SplitState', ['phase_duration',
+                                       'finish_time',
+                                       'delay',
+                                       'remainders',
+                                       'previous',
+                                       'segments'])
+
+# A scheduled (part of a) cluster: the outflow cluster, its phase and phase
+# duration, the inflow cluster it serves and the arrival of the original
+# inflow cluster that was split to obtain it
+Segment = namedtuple('Segment', ['cluster',
+                                 'phase',
+                                 'duration',
+                                 'inflow_cluster',
+                                 'source'])
+
 
 class SchIC(object):
 
-    def __init__(self, phases, Gmin, Gmax, Y, startup_lost_time, optimization_horizon=float('inf')):
+    def __init__(self, phases, Gmin, Gmax, Y, startup_lost_time, optimization_horizon=float('inf'),
+                 beam_width=None, prune_dominated=False, timing=None):
         self.phases = phases
         self.phase_count = len(phases)
         self.Gmin = Gmin
@@ -24,37 +51,76 @@ class SchIC(object):
         self.Y = Y
         self.startup_lost_time = startup_lost_time
         self.optimization_horizon = optimization_horizon
-        
-        self._min_switch = self._initialize_min_switch()
+        # Statuses kept per layer (None keeps all, which is exact) and
+        # whether dominated states are dropped from each state group
+        self.beam_width = beam_width
+        self.prune_dominated = prune_dominated
+        # Precomputed timing tables, which may be shared with the agent
+        if timing is None:
+            timing = PhaseTiming.build(phases, Gmin, Gmax, Y)
+        self.timing = timing
 
         self.state_groups = {}
         self.start_times = {}
-
-    def _initialize_min_switch(self):
-        min_switch = {phase: {} for phase in self.phases}
-        for base_phase in self.phases:
-            min_switch[base_phase][base_phase] = 0
-            curr_phase = base_phase
-            switch_time = 0
-
-            for index in range(self.phase_count - 1):
-                next_phase = self._get_next_phase(curr_phase)
-                
-                switch_time += self.Y[curr_phase]
-                if curr_phase != base_phase:
-                    switch_time += self.Gmin[curr_phase]
-                
-                min_switch[base_phase][next_phase] = switch_time
-                curr_phase = next_phase
-
-        return min_switch
+        # Number of schedules computed by the last schedule_within_gmax
+        self.solve_count = 0
 
     def _get_next_phase(self, curr_phase):
-        curr_phase_index = self.phases.index(curr_phase)
-        next_phase_index = (curr_phase_index + 1) % len(self.phases)
-        return self.phases[next_phase_index]
+        return self.timing.next_phase(curr_phase)
+
+    def schedule_anytime(self, inflow, curr_phase, curr_phase_duration, curr_time=0,
+                         deadline=None, cluster_cap=None, initial_cluster_count=4):
+        # Schedules the earliest clusters first: starting with the
+        # initial_cluster_count earliest clusters (over all phases), the
+        # number of scheduled clusters is doubled until all clusters (or
+        # cluster_cap clusters) are scheduled or the deadline (a
+        # timeit.default_timer() value) passes. Returns the plan for the
+        # largest prefix that was scheduled completely and whether that plan
+        # leaves clusters out. The first prefix is always scheduled, even
+        # after the deadline.
+        def solve(prefix, deadline):
+            return self.schedule(prefix, curr_phase, curr_phase_duration, curr_time, deadline=deadline)
+
+        plan, truncated = self._schedule_prefixes(solve, inflow, deadline, cluster_cap, initial_cluster_count)
+        outflow, phase_sequence, phase_duration = plan
+        return outflow, phase_sequence, phase_duration, truncated
+
+    def _schedule_prefixes(self, solve, inflow, deadline, cluster_cap, initial_cluster_count=4):
+        # Prefix loop of schedule_anytime, with solve(prefix, deadline)
+        # computing the plan of a prefix. Returns the last plan and whether
+        # it leaves clusters out.
+        arrivals = sorted((cluster.arrival, phase_index, phase)
+                          for phase_index, phase in enumerate(self.phases)
+                          for cluster in inflow[phase])
+        total_count = len(arrivals)
+        if cluster_cap is not None:
+            total_count = min(total_count, cluster_cap)
+
+        plan = None
+        cluster_count = min(initial_cluster_count, total_count)
+        while True:
+            prefix_counts = {phase: 0 for phase in self.phases}
+            for _, _, phase in arrivals[:cluster_count]:
+                prefix_counts[phase] += 1
+            prefix = {phase: ClusterSequence(inflow[phase][:prefix_counts[phase]]) for phase in self.phases}
+
+            try:
+                plan = solve(prefix, deadline if plan is not None else None)
+            except DeadlineExceeded:
+                break
+            scheduled_count = cluster_count
+
+            if cluster_count == total_count:
+                break
+            cluster_count = min(2 * cluster_count, total_count)
 
-    def schedule(self, inflow, curr_phase, curr_phase_duration, curr_time=0):
+        truncated = scheduled_count < len(arrivals)
+        if truncated:
+            logger.debug('Scheduled {} of {} clusters'.format(scheduled_count, len(arrivals)))
+
+        return plan, truncated
+
+    def schedule(self, inflow, curr_phase, curr_phase_duration, curr_time=0, deadline=None):
 
         Xempty = ScheduleStatus({phase: 0 for phase in self.phases})
         Xfull = ScheduleStatus({phase: len(sequence) for phase, sequence in inflow.items()})
@@ -69,6 +135,9 @@ class SchIC(object):
         cluster_count = Xfull.sum()
 
         for scheduled_count in range(cluster_count):
+
+            if deadline is not None and timeit.default_timer() > deadline:
+                raise DeadlineExceeded(scheduled_count, cluster_count)
             
             Xcount = len(X)
             for x in range(Xcount):
@@ -84,6 +153,11 @@ class SchIC(object):
                         self.calculate_state_group(status,
                                                    phase,
                                                    inflow)
+                if self.prune_dominated and status in self.state_groups:
+                    self.remove_dominated_states(status)
+
+            if self.beam_width is not None and len(X) > self.beam_width:
+                X = self.select_beam(X, inflow)
 
         # logger.debug('state_groups = {}'.format(self.state_groups))
 
@@ -97,17 +171,348 @@ class SchIC(object):
 
         return outflow, phase_sequence, phase_duration
 
+    def schedule_within_gmax(self, inflow, curr_phase, curr_phase_duration, curr_time=0,
+                             min_cluster_size=-float('inf'), mode='split', deadline=None, cluster_cap=None):
+        # Schedules inflow without keeping any phase green for longer than
+        # Gmax. A cluster that would exceed Gmax is split at the violation,
+        # the phase switches and the rest of the cluster is served later:
+        #   split:   Gmax is a constraint of the dynamic program, whose
+        #            transitions split clusters (see schedule_split)
+        #   resolve: the remaining clusters are scheduled again from the switch
+        # split solves once per call, resolve once per violation. The plans
+        # differ where schedule_split says. Returns the scheduled segments
+        # and whether clusters were left out because of the deadline or
+        # cluster cap.
+        if mode == 'split':
+            return self._split_within_gmax(inflow, curr_phase, curr_phase_duration, curr_time,
+                                           min_cluster_size, deadline, cluster_cap)
+        elif mode == 'resolve':
+            return self._resolve_within_gmax(inflow, curr_phase, curr_phase_duration, curr_time,
+                                             min_cluster_size, deadline, cluster_cap)
+        raise ValueError('Unknown Gmax mode {}'.format(mode))
+
+    def _schedule_once(self, inflow, curr_phase, curr_phase_duration, curr_time, deadline, cluster_cap):
+        self.solve_count += 1
+        if deadline is None and cluster_cap is None:
+            outflow, phase_sequence, phase_duration = self.schedule(inflow,
+                                                                    curr_phase,
+                                                                    curr_phase_duration,
+                                                                    curr_time)
+            return outflow, phase_sequence, phase_duration, False
+        return self.schedule_anytime(inflow,
+                                     curr_phase,
+                                     curr_phase_duration,
+                                     curr_time,
+                                     deadline=deadline,
+                                     cluster_cap=cluster_cap)
+
+    def _split_at_gmax(self, cluster, inflow_cluster, phase, duration, previous_departure, min_cluster_size):
+        violation_time = cluster.departure - (duration - self.Gmax[phase])
+        if violation_time < cluster.arrival:
+            violation_time = previous_departure
+
+        unviolated_outflow, violated_outflow = cluster.split(violation_time, min_cluster_size)
+        if violated_outflow is None:
+            # The rest is smaller than the minimum cluster size
+            unviolated_ratio = 1
+        else:
+            unviolated_ratio = 1 - (violated_outflow.count / cluster.count)
+        unviolated_inflow, violated_inflow = inflow_cluster.split_by_ratio(unviolated_ratio, min_cluster_size)
+
+        return violation_time, unviolated_outflow, unviolated_inflow, violated_inflow
+
+    def _resolve_within_gmax(self, inflow, curr_phase, curr_phase_duration, curr_time,
+                             min_cluster_size, deadline, cluster_cap):
+        self.solve_count = 0
+        segments = []
+        truncated = False
+
+        tmp_inflow = {phase: sequence.copy() for phase, sequence in inflow.items()}
+        sources = {phase: [cluster.arrival for cluster in sequence] for phase, sequence in inflow.items()}
+
+        violation_time = None
+        while violation_time != float('inf'):
+
+            violation_time = float('inf')
+            outflow, phase_sequence, phase_duration, truncated = self._schedule_once(tmp_inflow,
+                                                                                     curr_phase,
+                                                                                     curr_phase_duration,
+                                                                                     curr_time,
+                                                                                     deadline,
+                                                                                     cluster_cap)
+
+            for index, (cluster, phase, duration) in enumerate(zip(outflow, phase_sequence, phase_duration)):
+                inflow_cluster = tmp_inflow[phase][0]
+                source = sources[phase][0]
+
+                if duration > self.Gmax[phase]:
+                    previous_departure = curr_time if index == 0 else outflow[index-1].departure
+                    (violation_time,
+                     unviolated_outflow,
+                     unviolated_inflow,
+                     violated_inflow) = self._split_at_gmax(cluster, inflow_cluster, phase, duration,
+                                                            previous_departure, min_cluster_size)
+
+                    tmp_inflow[phase].set(0, violated_inflow)
+
+                    if unviolated_outflow:
+                        segments.append(Segment(unviolated_outflow, phase, self.Gmax[phase], unviolated_inflow, source))
+
+                    curr_time = violation_time + self.Y[phase]
+                    curr_phase = self._get_next_phase(phase)
+                    curr_phase_duration = 0
+
+                    break
+                else:
+                    segments.append(Segment(cluster, phase, duration, inflow_cluster, source))
+                    tmp_inflow[phase].pop(0)
+                    sources[phase].pop(0)
+
+        return segments, truncated
+
+    def _split_within_gmax(self, inflow, curr_phase, curr_phase_duration, curr_time,
+                           min_cluster_size, deadline, cluster_cap):
+        self.solve_count = 1
+
+        def solve(prefix, deadline):
+            return self.schedule_split(prefix, curr_phase, curr_phase_duration, curr_time,
+                                       min_cluster_size, deadline)
+
+        if deadline is None and cluster_cap is None:
+            return solve(inflow, None), False
+        return self._schedule_prefixes(solve, inflow, deadline, cluster_cap)
+
+    def schedule_split(self, inflow, curr_phase, curr_phase_duration, curr_time=0,
+                       min_cluster_size=-float('inf'), deadline=None):
+        # Dynamic program of schedule with Gmax enforced in the transition. A
+        # cluster that would keep its phase green for longer than Gmax is
+        # split at the violation as in _resolve_within_gmax: the phase
+        # switches to the next one and the rest of the cluster stays at the
+        # head of its phase. A status counts the clusters served completely
+        # and its states carry the rests of the clusters they split, so a
+        # split is a transition within a status, after which the status is
+        # relaxed again. The states of a status are kept by phase and by the
+        # number of splits of each rest (see split_key), so a split never
+        # replaces the state it comes from. States are pushed to the next
+        # statuses in the order in which schedule pulls them. prune_dominated
+        # does not apply. Returns the scheduled segments.
+        #
+        # The plan is not always that of _resolve_within_gmax:
+        #   - Without violations in the plan of schedule, the plan is the
+        #     same unless splitting a cluster at Gmax lowers the delay.
+        #   - The loop keeps each split it finds and solves the rest again,
+        #     while here splits are chosen by the dynamic program.
+        #   - When the violation falls before the cluster arrives, the loop
+        #     ends the green at the previous departure, even before Gmin.
+        #     Here the phase keeps Gmin and the cluster waits for the next
+        #     green (see split_transition).
+        #   - The loop solves again with the next phase green from the end
+        #     of the yellow, so it skips the startup lost time of the switch.
+        #     Here the switch costs it as any other.
+        #   - Like schedule, a status keeps one state per key, which is not
+        #     exact: the state with the least cost may have the longer green,
+        #     and so reach Gmax sooner, and give a plan worse than the loop's.
+        # In the third and fourth case the plan of the loop breaks Gmin or
+        # understates its delay. utils/benchmarks/gmax_regression.py counts
+        # the differences and checks both plans.
+        Xempty = ScheduleStatus({phase: 0 for phase in self.phases})
+        Xfull = ScheduleStatus({phase: len(sequence) for phase, sequence in inflow.items()})
+        X = [Xempty]
+
+        self.state_groups = {Xempty: {(curr_phase, ()): SplitState(phase_duration=curr_phase_duration,
+                                                                   finish_time=curr_time,
+                                                                   delay=0,
+                                                                   remainders={},
+                                                                   previous=None,
+                                                                   segments=())}}
+        self.start_times = {}
+
+        cluster_count = Xfull.sum()
+
+        for scheduled_count in range(cluster_count):
+
+            if deadline is not None and timeit.default_timer() > deadline:
+                raise DeadlineExceeded(scheduled_count, cluster_count)
+
+            next_X = []
+            for status in X:
+                # Phase -> state group of the status with one more cluster of
+                # the phase
+                updated_groups = {}
+                for served_phase, key, new_state in self.relax_split_group(status, inflow, min_cluster_size):
+                    group = updated_groups.get(served_phase)
+                    if group is None:
+                        updated_status = status.schedule(served_phase)
+                        if updated_status not in self.state_groups:
+                            self.state_groups[updated_status] = {}
+                            next_X.append(updated_status)
+                        group = updated_groups[served_phase] = self.state_groups[updated_status]
+                    if key not in group or self.split_cost(new_state) < self.split_cost(group[key]):
+                        group[key] = new_state
+            X = next_X
+
+            if self.beam_width is not None and len(X) > self.beam_width:
+                X = self.select_beam(X, inflow)
+
+        # Leaf with minimum delay, first in phase order on ties. Leaves have
+        # no rests.
+        group = self.state_groups[Xfull]
+        best_leaf_state = None
+        for phase in self.phases:
+            state = group.get((phase, ()))
+            if state is not None and (best_leaf_state is None or state.delay < best_leaf_state.delay):
+                best_leaf_state = state
+        if best_leaf_state is None:
+            raise KeyError('No feasible schedule for {}'.format(Xfull))
+
+        segments = []
+        state = best_leaf_state
+        while state is not None:
+            segments.extend(reversed(state.segments))
+            state = state.previous
+        segments.reverse()
+
+        return segments
+
+    def relax_split_group(self, status, inflow, min_cluster_size):
+        # Applies the splits within status until none improves a state, and
+        # returns the transitions of its states that serve a cluster
+        # completely, as (served phase, key, state) in the order of
+        # split_key_order and then by served phase
+        group = self.state_groups[status]
+        phases = [phase for phase in self.phases if status[phase] < len(inflow[phase])]
+        served = {}
+        pending = sorted(group, key=self.split_key_order)
+        while pending:
+            key = pending.pop(0)
+            previous_phase, _ = key
+            state = group[key]
+            served[key] = []
+            for phase in phases:
+                completed, next_phase, new_state = self.split_transition(status, state, previous_phase, phase,
+                                                                         inflow, min_cluster_size)
+                if new_state.finish_time >= self.optimization_horizon:
+                    continue
+                new_key = self.split_key(next_phase, new_state)
+                if completed:
+                    served[key].append((phase, new_key, new_state))
+                elif new_key not in group or self.split_cost(new_state) < self.split_cost(group[new_key]):
+                    group[new_key] = new_state
+                    if new_key not in pending:
+                        pending.append(new_key)
+
+        return [transition for key in sorted(served, key=self.split_key_order) for transition in served[key]]
+
+    def split_key(self, phase, state):
+        # Key of a state in the state group of its status: its phase and the
+        # number of splits of each rest, by phase
+        if not state.remainders:
+            return phase, ()
+        return phase, tuple((rest_phase, state.remainders[rest_phase][0])
+                            for rest_phase in self.phases if rest_phase in state.remainders)
+
+    def split_cost(self, state):
+        # Delay of the state plus the delay its rests have accrued, which
+        # they incur whenever they are served
+        cost = state.delay
+        for _, rest in state.remainders.values():
+            if state.finish_time > rest.arrival:
+                cost += rest.count * (state.finish_time - rest.arrival)
+        return cost
+
+    def split_key_order(self, key):
+        # States without rests first, then by rests and by phase order
+        phase, rests = key
+        indices = self.timing.indices
+        return tuple((indices[rest_phase], split_count) for rest_phase, split_count in rests), indices[phase]
+
+    def split_transition(self, status, previous_state, previous_phase, curr_phase, inflow, min_cluster_size):
+        # Serves the head of curr_phase after previous_state: the rest of a
+        # split cluster or the next cluster of the phase. Returns whether the
+        # cluster is served completely, the phase of the new state and the new
+        # state.
+        original_cluster = inflow[curr_phase][status[curr_phase]]
+        split_count, inflow_cluster = previous_state.remainders.get(curr_phase, (0, original_cluster))
+        source = original_cluster.arrival
+
+        new_state, start_time = self.update_state(previous_state, previous_phase, curr_phase, inflow_cluster)
+        cluster = Cluster(count=inflow_cluster.count,
+                          arrival=start_time,
+                          departure=start_time+inflow_cluster.duration)
+        remainders = previous_state.remainders
+        if curr_phase in remainders:
+            remainders = dict(remainders)
+            del remainders[curr_phase]
+
+        phase_duration = new_state.phase_duration
+        if curr_phase != previous_phase and phase_duration > self.Gmax[curr_phase]:
+            # After a switch, the phase does not have to turn green before the
+            # cluster arrives
+            phase_duration = min(phase_duration, new_state.finish_time - inflow_cluster.arrival)
+
+        if phase_duration <= self.Gmax[curr_phase]:
+            return True, curr_phase, SplitState(phase_duration=phase_duration,
+                                                finish_time=new_state.finish_time,
+                                                delay=new_state.delay,
+                                                remainders=remainders,
+                                                previous=previous_state,
+                                                segments=(Segment(cluster, curr_phase, phase_duration,
+                                                                  inflow_cluster, source),))
+
+        if (curr_phase == previous_phase
+            and self.phase_count > 1
+            and cluster.departure - (phase_duration - self.Gmax[curr_phase]) < cluster.arrival):
+            # The phase would reach Gmax before the cluster starts, so it ends
+            # after its minimum green and the cluster is served in its next
+            # green, after the other phases
+            switch_time = previous_state.finish_time + max(0, self.Gmin[curr_phase] - previous_state.phase_duration)
+            switch_state = SplitState(phase_duration=0,
+                                      finish_time=switch_time + self.Y[curr_phase],
+                                      delay=previous_state.delay,
+                                      remainders=previous_state.remainders,
+                                      previous=previous_state,
+                                      segments=())
+            return self.split_transition(status, switch_state, self._get_next_phase(curr_phase), curr_phase,
+                                         inflow, min_cluster_size)
+
+        (violation_time,
+         unviolated_outflow,
+         unviolated_inflow,
+         violated_inflow) = self._split_at_gmax(cluster, inflow_cluster, curr_phase, phase_duration,
+                                                previous_state.finish_time, min_cluster_size)
+
+        delay = previous_state.delay
+        segments = ()
+        if unviolated_outflow:
+            delay += unviolated_inflow.count * (unviolated_outflow.arrival - unviolated_inflow.arrival)
+            segments = (Segment(unviolated_outflow, curr_phase, self.Gmax[curr_phase], unviolated_inflow, source),)
+        if violated_inflow is inflow_cluster:
+            # Nothing was served, the phase only switches
+            remainders = previous_state.remainders
+        elif violated_inflow is not None:
+            remainders = dict(remainders)
+            remainders[curr_phase] = (split_count + 1, violated_inflow)
+
+        return violated_inflow is None, self._get_next_phase(curr_phase), SplitState(phase_duration=0,
+                                                                                   finish_time=violation_time + self.Y[curr_phase],
+                                                                                   delay=delay,
+                                                                                   remainders=remainders,
+                                                                                   previous=previous_state,
+                                                                                   segments=segments)
+
     def calculate_state_group(self, curr_status, curr_phase, inflow):
         next_cluster = inflow[curr_phase][curr_status[curr_phase]-1]
         previous_status = curr_status.unschedule(curr_phase)
+        curr_index = self.timing.indices[curr_phase]
         min_delay = float('inf')
-        for previous_phase in self.phases:
+        for previous_index, previous_phase in enumerate(self.phases):
             try:
                 previous_state = self.state_groups[previous_status][previous_phase]
-                new_state, cluster_start_time = self.update_state(previous_state,
-                                                                  previous_phase,
-                                                                  curr_phase,
-                                                                  next_cluster)
+                new_state, cluster_start_time = self._update_state(previous_state,
+                                                                   previous_phase,
+                                                                   previous_index,
+                                                                   curr_index,
+                                                                   next_cluster)
                 if new_state.finish_time < self.optimization_horizon and new_state.delay < min_delay:
                     if curr_status not in self.state_groups:
                         self.state_groups[curr_status] = {}
@@ -118,23 +523,106 @@ class SchIC(object):
             except KeyError:
                 pass
 
+    def earliest_starts(self, state, phase):
+        # Earliest time a cluster of each phase could be served after state,
+        # with phase the phase of the state's last cluster. Startup lost time
+        # is included when switching, since it applies whenever the switch
+        # delays the cluster.
+        curr_time = state.finish_time
+        starts = []
+        for next_phase in self.phases:
+            if next_phase != phase and state.phase_duration < self.Gmin[phase]:
+                permitted_start_time = curr_time + self.Gmin[phase] - state.phase_duration + self.min_switch(phase, next_phase)
+            else:
+                permitted_start_time = curr_time + self.min_switch(phase, next_phase)
+            startup_lost_time = self.startup_lost_time if next_phase != phase else 0
+            starts.append((permitted_start_time, permitted_start_time + startup_lost_time))
+        return starts
+
+    def remove_dominated_states(self, status):
+        # A state is dominated if another state of the same status has no
+        # more delay and could serve every phase no later, both with and
+        # without startup lost time. Of two equivalent states the one for the
+        # earlier phase is kept.
+        group = self.state_groups[status]
+        phases = [phase for phase in self.phases if phase in group]
+        starts = {phase: self.earliest_starts(group[phase], phase) for phase in phases}
+
+        for phase in phases:
+            state = group[phase]
+            for other_phase in phases:
+                if other_phase == phase or other_phase not in group:
+                    continue
+                other = group[other_phase]
+                if other.delay > state.delay:
+                    continue
+                dominated = all(other_start[0] <= start[0] and other_start[1] <= start[1]
+                                for other_start, start in zip(starts[other_phase], starts[phase]))
+                equivalent = (dominated
+                              and other.delay == state.delay
+                              and starts[other_phase] == starts[phase])
+                if dominated and (not equivalent or self.phases.index(other_phase) < self.phases.index(phase)):
+                    group.pop(phase)
+                    self.start_times[status].pop(phase)
+                    break
+
+    def lower_bound(self, status, inflow):
+        # Delay of the status's best state plus a lower bound on the delay of
+        # its unscheduled clusters, none of which can start before that state
+        # finishes
+        best_bound = float('inf')
+        for state in self.state_groups.get(status, {}).values():
+            bound = state.delay
+            for phase in self.phases:
+                for cluster in inflow[phase][status[phase]:]:
+                    if cluster.arrival < state.finish_time:
+                        bound += cluster.count * (state.finish_time - cluster.arrival)
+            best_bound = min(best_bound, bound)
+        return best_bound
+
+    def select_beam(self, X, inflow):
+        # Keep the beam_width statuses with the lowest lower bound, in their
+        # original order, and drop the states of the others
+        bounds = [self.lower_bound(status, inflow) for status in X]
+        ranked = sorted(range(len(X)), key=lambda index: bounds[index])
+        kept = set(ranked[:self.beam_width])
+        beam = []
+        for index, status in enumerate(X):
+            if index in kept:
+                beam.append(status)
+            else:
+                self.state_groups.pop(status, None)
+                self.start_times.pop(status, None)
+        return beam
+
     def update_state(self, previous_state, previous_phase, curr_phase, next_cluster):
+        indices = self.timing.indices
+        return self._update_state(previous_state,
+                                  previous_phase,
+                                  indices[previous_phase],
+                                  indices[curr_phase],
+                                  next_cluster)
+
+    def _update_state(self, previous_state, previous_phase, j, k, next_cluster):
+        # update_state with the previous and current phases given by their
+        # positions j and k in phases
+        timing = self.timing
         phase_duration = previous_state.phase_duration
         curr_time = previous_state.finish_time
         delay = previous_state.delay
 
-        if curr_phase != previous_phase and phase_duration < self.Gmin[previous_phase]:
-            curr_time += self.Gmin[previous_phase] - phase_duration
+        if k != j and phase_duration < timing.Gmin[j]:
+            curr_time += timing.Gmin[j] - phase_duration
 
-        permitted_start_time = curr_time + self.min_switch(previous_phase, curr_phase)
+        permitted_start_time = curr_time + timing.min_switches[j][k]
         actual_start_time = max(next_cluster.arrival, permitted_start_time)
 
-        if curr_phase != previous_phase and permitted_start_time > next_cluster.arrival:
+        if k != j and permitted_start_time > next_cluster.arrival:
             actual_start_time += self.startup_lost_time
 
         curr_time = actual_start_time + next_cluster.duration
 
-        if curr_phase != previous_phase or (next_cluster.arrival - permitted_start_time > self.switch_back(curr_phase)):
+        if k != j or (next_cluster.arrival - permitted_start_time > timing.switch_backs[k]):
             phase_duration = curr_time - permitted_start_time
         else:
             phase_duration += curr_time - permitted_start_time
@@ -148,11 +636,10 @@ class SchIC(object):
                 actual_start_time)
 
     def min_switch(self, previous_phase, curr_phase):
-        return self._min_switch[previous_phase][curr_phase]
+        return self.timing.min_switch(previous_phase, curr_phase)
 
     def switch_back(self, phase):
-        min_cycle = sum(self.Gmin.values()) + sum(self.Y.values())
-        return min_cycle - self.Gmin[phase]
+        return self.timing.switch_back(phase)
 
     def get_minimum_delay_state(self, Xfull):
         min_delay = float('inf')
@@ -193,6 +680,507 @@ class SchIC(object):
         return outflow
 
 
+class DenseSchIC(SchIC):
+    # Same dynamic program as SchIC, with the states kept in NumPy arrays.
+    #
+    # A schedule status (clusters scheduled per phase) is stored as a
+    # mixed-radix integer: with n_k clusters on phase k, the status s maps to
+    # sum(s_k * stride_k) where stride_0 = 1 and stride_k+1 = stride_k * (n_k + 1).
+    # Each array has one row per status and one column per phase (the phase
+    # of the last scheduled cluster). Statuses are processed layer by layer
+    # (by number of scheduled clusters) and in index order within a layer,
+    # and every state of a layer is relaxed from all previous phases at once.
+    # Ties are broken as in SchIC, so plans are identical.
+    #
+    # kernel selects how a layer is relaxed: 'numpy' (vectorised over the
+    # statuses of the layer), 'jit' (scalar kernel compiled with numba) or
+    # 'python' (the same kernel, interpreted). By default the compiled kernel
+    # is used when numba is installed and numpy otherwise.
+
+    KERNELS = ('numpy', 'jit', 'python')
+
+    def __init__(self, *args, **kwargs):
+        kernel = kwargs.pop('kernel', None)
+        super(DenseSchIC, self).__init__(*args, **kwargs)
+        if kernel is None:
+            kernel = 'jit' if adasco.schedulers.kernels.COMPILED else 'numpy'
+        if kernel not in self.KERNELS:
+            raise ValueError('Unknown kernel {}, expected one of {}'.format(kernel, self.KERNELS))
+        if kernel == 'jit' and not adasco.schedulers.kernels.COMPILED:
+            logger.warning('numba is not installed, the jit kernel runs interpreted')
+        self.kernel = kernel
+        # Timing tables as arrays for the scalar kernels
+        self.timing_arrays = (np.array(self.timing.Gmin, dtype=np.float64),
+                              np.array(self.timing.min_switches, dtype=np.float64).reshape(self.phase_count, self.phase_count),
+                              np.array(self.timing.switch_backs, dtype=np.float64))
+
+    def schedule(self, inflow, curr_phase, curr_phase_duration, curr_time=0, deadline=None):
+
+        if not self.supports(inflow, curr_phase):
+            return super(DenseSchIC, self).schedule(inflow, curr_phase, curr_phase_duration, curr_time, deadline)
+
+        table = DenseTable(self.phases, inflow, curr_phase, curr_phase_duration, curr_time)
+        self.relax(table, deadline)
+        return self.extract_plan(table, inflow)
+
+    def supports(self, inflow, curr_phase):
+        # Pruned schedules are only available in SchIC
+        pruned = self.beam_width is not None or self.prune_dominated
+        return not pruned and curr_phase in self.phases and set(inflow) == set(self.phases)
+
+    def relax(self, table, deadline=None):
+        # Computes the states of all statuses of the table that are not
+        # computed yet
+        for layer in range(1, table.cluster_count + 1):
+            if deadline is not None and timeit.default_timer() > deadline:
+                raise DeadlineExceeded(layer - 1, table.cluster_count)
+            statuses = table.order[table.layer_bounds[layer]:table.layer_bounds[layer+1]]
+            statuses = statuses[~table.computed[statuses]]
+            self.relax_statuses(table, statuses)
+            table.computed[statuses] = True
+
+    def relax_statuses(self, table, statuses):
+        # Computes the states of the given statuses, which must all be in the
+        # same layer, from the states of the previous layer
+        if self.kernel == 'numpy':
+            self.relax_vectorised(table, statuses)
+            return
+
+        if self.kernel == 'jit':
+            relax_layer = adasco.schedulers.kernels.relax_layer
+        else:
+            relax_layer = adasco.schedulers.kernels.relax_layer_python
+
+        arrivals, durations, counts = table.padded_clusters()
+        Gmin, min_switch, switch_back = self.timing_arrays
+        relax_layer(statuses, table.digits, np.array(table.strides, dtype=np.int64),
+                    arrivals, durations, counts,
+                    table.phase_duration, table.finish_time, table.start_time, table.delay,
+                    table.previous_phase, table.present,
+                    Gmin, min_switch, switch_back,
+                    float(self.startup_lost_time), float(self.optimization_horizon))
+
+    def relax_vectorised(self, table, statuses):
+        phase_count = self.phase_count
+        digits = table.digits
+        clusters = table.clusters
+
+        Gmin = self.timing.Gmin
+        min_switch = self.timing.min_switches
+        switch_back = self.timing.switch_backs
+
+        for k in range(phase_count):
+            status = statuses[digits[statuses, k] > 0]
+            if len(status) == 0:
+                continue
+            previous_status = status - table.strides[k]
+            cluster_index = digits[status, k] - 1
+            arrival = clusters[k][0][cluster_index]
+            duration = clusters[k][1][cluster_index]
+            count = clusters[k][2][cluster_index]
+
+            best_delay = np.full(len(status), np.inf)
+            best = (np.zeros(len(status)), np.zeros(len(status)), np.zeros(len(status)),
+                    np.full(len(status), -1, dtype=np.int64))
+
+            for j in range(phase_count):
+                valid = table.present[previous_status, j]
+                if not valid.any():
+                    continue
+                previous_duration = table.phase_duration[previous_status, j]
+                time = table.finish_time[previous_status, j]
+
+                if j != k:
+                    time = np.where(previous_duration < Gmin[j], time + (Gmin[j] - previous_duration), time)
+
+                permitted_start_time = time + min_switch[j][k]
+                actual_start_time = np.maximum(arrival, permitted_start_time)
+
+                if j != k:
+                    actual_start_time = np.where(permitted_start_time > arrival,
+                                                 actual_start_time + self.startup_lost_time,
+                                                 actual_start_time)
+
+                time = actual_start_time + duration
+
+                if j != k:
+                    new_duration = time - permitted_start_time
+                else:
+                    new_duration = np.where(arrival - permitted_start_time > switch_back[k],
+                                            time - permitted_start_time,
+                                            previous_duration + (time - permitted_start_time))
+
+                new_delay = table.delay[previous_status, j] + count * (actual_start_time - arrival)
+
+                better = valid & (time < self.optimization_horizon) & (new_delay < best_delay)
+                best_delay = np.where(better, new_delay, best_delay)
+                best[0][better] = new_duration[better]
+                best[1][better] = time[better]
+                best[2][better] = actual_start_time[better]
+                best[3][better] = j
+
+            found = best[3] >= 0
+            status = status[found]
+            table.phase_duration[status, k] = best[0][found]
+            table.finish_time[status, k] = best[1][found]
+            table.start_time[status, k] = best[2][found]
+            table.delay[status, k] = best_delay[found]
+            table.previous_phase[status, k] = best[3][found]
+            table.present[status, k] = True
+
+    def extract_plan(self, table, inflow):
+        # Leaf with minimum delay, first in phase order on ties
+        full = table.state_count - 1
+        last = None
+        min_delay = float('inf')
+        for k in range(self.phase_count):
+            if table.present[full, k] and table.delay[full, k] < min_delay:
+                min_delay = table.delay[full, k]
+                last = k
+        if last is None:
+            raise KeyError('No feasible schedule for {}'.format(table.cluster_counts))
+
+        phase_sequence = []
+        phase_durations = []
+        start_times = []
+        index = full
+        k = last
+        while table.previous_phase[index, k] >= 0:
+            phase_sequence.insert(0, self.phases[k])
+            phase_durations.insert(0, float(table.phase_duration[index, k]))
+            start_times.insert(0, float(table.start_time[index, k]))
+            j = int(table.previous_phase[index, k])
+            index -= table.strides[k]
+            k = j
+
+        outflow = self.construct_outflow(inflow, phase_sequence, start_times)
+
+        return outflow, phase_sequence, phase_durations
+
+
+class IncrementalSchIC(DenseSchIC):
+    # DenseSchIC that keeps the table of its last schedule and reuses it.
+    #
+    # The states of a status only depend on the initial state and on the
+    # clusters the status has scheduled. If the initial phase and phase
+    # duration are the same as last time, and on each phase the first m_k
+    # clusters are the same (relative to the current time), then every
+    # status with at most m_k clusters on each phase k has the same states
+    # as before, shifted by the elapsed time. Only the other statuses are
+    # computed. If fewer than min_reuse of the statuses can be reused, the
+    # whole table is computed. With a finite optimization horizon only an
+    # elapsed time of 0 allows reuse, since the horizon is absolute.
+    #
+    # Between decision points of a running simulation the current time and
+    # usually the current phase duration change, so most reuse comes from
+    # repeated schedules at the same decision point, such as the growing
+    # prefixes of schedule_anytime. Only schedule reuses states, so with
+    # schedule_within_gmax reuse needs mode='resolve': schedule_split has
+    # its own states. utils/benchmarks/incremental_equivalence.py checks
+    # that the plans equal those of a fresh SchIC.schedule.
+
+    def __init__(self, *args, **kwargs):
+        self.min_reuse = kwargs.pop('min_reuse', 0.25)
+        super(IncrementalSchIC, self).__init__(*args, **kwargs)
+        self.previous_table = None
+        self.reuse_counts = {'schedules': 0,
+                             'incremental': 0,
+                             'full': 0,
+                             'states': 0,
+                             'reused_states': 0}
+
+    @property
+    def reuse_rate(self):
+        if self.reuse_counts['states'] == 0:
+            return 0
+        return self.reuse_counts['reused_states'] / self.reuse_counts['states']
+
+    def schedule(self, inflow, curr_phase, curr_phase_duration, curr_time=0, deadline=None):
+
+        if not self.supports(inflow, curr_phase):
+            return super(IncrementalSchIC, self).schedule(inflow, curr_phase, curr_phase_duration, curr_time, deadline)
+
+        table = DenseTable(self.phases, inflow, curr_phase, curr_phase_duration, curr_time)
+        reused_count = self.reuse(table)
+
+        self.reuse_counts['schedules'] += 1
+        self.reuse_counts['states'] += table.state_count
+        self.reuse_counts['reused_states'] += reused_count
+        if reused_count > 0:
+            self.reuse_counts['incremental'] += 1
+        else:
+            self.reuse_counts['full'] += 1
+
+        self.relax(table, deadline)
+        self.previous_table = table
+        return self.extract_plan(table, inflow)
+
+    def reuse(self, table):
+        # Copies the reusable states of the previous table into table and
+        # returns the number of statuses copied
+        previous = self.previous_table
+        if (previous is None
+            or previous.curr_phase != table.curr_phase
+            or previous.curr_phase_duration != table.curr_phase_duration):
+            return 0
+
+        elapsed_time = table.curr_time - previous.curr_time
+        if elapsed_time != 0 and self.optimization_horizon != float('inf'):
+            return 0
+
+        shared_counts = []
+        for k in range(self.phase_count):
+            length = min(table.cluster_counts[k], previous.cluster_counts[k])
+            same = np.ones(length, dtype=np.bool_)
+            for current, old in zip(table.clusters[k][1:], previous.clusters[k][1:]):
+                same &= current[:length] == old[:length]
+            # Arrivals relative to the current time
+            same &= (table.clusters[k][0][:length] - table.curr_time) == (previous.clusters[k][0][:length] - previous.curr_time)
+            mismatches = np.flatnonzero(~same)
+            shared_counts.append(int(mismatches[0]) if len(mismatches) else length)
+
+        reusable_count = 1
+        for count in shared_counts:
+            reusable_count *= count + 1
+        if reusable_count < self.min_reuse * table.state_count:
+            return 0
+
+        reusable = np.ones(table.state_count, dtype=np.bool_)
+        for k in range(self.phase_count):
+            reusable &= table.digits[:, k] <= shared_counts[k]
+        indices = np.flatnonzero(reusable)
+        previous_indices = np.zeros(len(indices), dtype=np.int64)
+        for k in range(self.phase_count):
+            previous_indices += table.digits[indices, k] * previous.strides[k]
+
+        table.phase_duration[indices] = previous.phase_duration[previous_indices]
+        table.finish_time[indices] = previous.finish_time[previous_indices] + elapsed_time
+        table.start_time[indices] = previous.start_time[previous_indices] + elapsed_time
+        table.delay[indices] = previous.delay[previous_indices]
+        table.previous_phase[indices] = previous.previous_phase[previous_indices]
+        table.present[indices] = previous.present[previous_indices]
+        table.computed[indices] = True
+
+        return len(indices)
+
+
+class ParallelSchIC(DenseSchIC):
+    # DenseSchIC that splits the statuses of each layer across a pool of
+    # worker processes. The tables of large schedules are kept in a shared
+    # TableArena, which the workers inherit when the pool is started; each
+    # worker writes the states of its own statuses and only reads states of
+    # the previous layer, so no locking is needed. Schedules with fewer than
+    # parallel_threshold statuses are computed in the calling process, as in
+    # DenseSchIC, since starting the layer tasks costs more than it saves.
+    #
+    # The pool is started with the first large schedule and restarted with
+    # a larger arena when a schedule does not fit. Call close() to stop it.
+    # Every agent has its own pool, so there is a single worker (no pool)
+    # unless more workers are asked for.
+
+    def __init__(self, *args, **kwargs):
+        self.workers = kwargs.pop('workers', None) or 1
+        self.parallel_threshold = kwargs.pop('parallel_threshold', 100000)
+        super(ParallelSchIC, self).__init__(*args, **kwargs)
+        self.arena = None
+        self.pool = None
+
+    def schedule(self, inflow, curr_phase, curr_phase_duration, curr_time=0, deadline=None):
+
+        if not self.supports(inflow, curr_phase) or self.workers < 2:
+            return super(ParallelSchIC, self).schedule(inflow, curr_phase, curr_phase_duration, curr_time, deadline)
+
+        state_count = 1
+        for phase in self.phases:
+            state_count *= len(inflow[phase]) + 1
+        if state_count < self.parallel_threshold:
+            return super(ParallelSchIC, self).schedule(inflow, curr_phase, curr_phase_duration, curr_time, deadline)
+
+        self.start_pool(state_count)
+        table = DenseTable(self.phases, inflow, curr_phase, curr_phase_duration, curr_time,
+                           arrays=self.arena.arrays(state_count))
+        self.relax_parallel(table, deadline)
+        return self.extract_plan(table, inflow)
+
+    def start_pool(self, state_count):
+        if self.arena is not None and self.arena.capacity >= state_count:
+            return
+        self.close()
+        # Room to grow, so that the pool is not restarted at every new size
+        self.arena = TableArena(2 * state_count, self.phase_count)
+        self.pool = multiprocessing.Pool(self.workers,
+                                         initializer=_initialize_worker,
+                                         initargs=(self.get_worker_scheduler_args(), self.arena))
+        logger.debug('Started {} SchIC workers for up to {} statuses'.format(self.workers, self.arena.capacity))
+
+    def get_worker_scheduler_args(self):
+        return ((self.phases, self.Gmin, self.Gmax, self.Y, self.startup_lost_time, self.optimization_horizon),
+                {'timing': self.timing, 'kernel': self.kernel})
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.pool = None
+        self.arena = None
+
+    def relax_parallel(self, table, deadline=None):
+        layout = table.layout()
+        for layer in range(1, table.cluster_count + 1):
+            if deadline is not None and timeit.default_timer() > deadline:
+                raise DeadlineExceeded(layer - 1, table.cluster_count)
+            statuses = table.order[table.layer_bounds[layer]:table.layer_bounds[layer+1]]
+            statuses = statuses[~table.computed[statuses]]
+            if len(statuses) < 2 * self.workers:
+                self.relax_statuses(table, statuses)
+            else:
+                chunks = np.array_split(statuses, self.workers)
+                self.pool.map(_relax_chunk, [(layout, table.state_count, chunk) for chunk in chunks])
+            table.computed[statuses] = True
+
+
+# Scheduler and arena of a ParallelSchIC worker process
+_worker = {}
+
+
+def _initialize_worker(scheduler_args, arena):
+    args, kwargs = scheduler_args
+    _worker['scheduler'] = DenseSchIC(*args, **kwargs)
+    _worker['arena'] = arena
+
+
+def _relax_chunk(task):
+    layout, state_count, statuses = task
+    table = DenseTable.attach(layout, _worker['arena'].arrays(state_count))
+    _worker['scheduler'].relax_statuses(table, statuses)
+
+
+class DenseTable(object):
+    # States of DenseSchIC for one schedule, indexed by mixed-radix status
+    # index and phase index. The status-by-phase arrays are allocated unless
+    # given, as they are by ParallelSchIC to place them in shared memory.
+
+    FIELDS = (('digits', np.int64),
+              ('phase_duration', np.float64),
+              ('finish_time', np.float64),
+              ('delay', np.float64),
+              ('start_time', np.float64),
+              ('previous_phase', np.int64),
+              ('present', np.bool_))
+
+    def __init__(self, phases, inflow, curr_phase, curr_phase_duration, curr_time, arrays=None):
+        phase_count = len(phases)
+        self.curr_phase = curr_phase
+        self.curr_phase_duration = curr_phase_duration
+        self.curr_time = curr_time
+        self.cluster_counts = [len(inflow[phase]) for phase in phases]
+        self.cluster_count = sum(self.cluster_counts)
+
+        self.strides = [1]
+        for count in self.cluster_counts[:-1]:
+            self.strides.append(self.strides[-1] * (count + 1))
+        self.state_count = self.strides[-1] * (self.cluster_counts[-1] + 1)
+
+        if arrays is None:
+            arrays = {name: np.empty((self.state_count, phase_count), dtype=dtype) for name, dtype in self.FIELDS}
+        for name, _ in self.FIELDS:
+            setattr(self, name, arrays[name])
+
+        # Status digits and layer of every index
+        indices = np.arange(self.state_count)
+        for k in range(phase_count):
+            self.digits[:, k] = (indices // self.strides[k]) % (self.cluster_counts[k] + 1)
+        layers = self.digits.sum(axis=1)
+        self.order = np.argsort(layers, kind='mergesort')
+        self.layer_bounds = np.concatenate(([0], np.cumsum(np.bincount(layers, minlength=self.cluster_count + 1))))
+
+        self.clusters = [(np.array([cluster.arrival for cluster in inflow[phase]], dtype=np.float64),
+                          np.array([cluster.duration for cluster in inflow[phase]], dtype=np.float64),
+                          np.array([cluster.count for cluster in inflow[phase]], dtype=np.float64))
+                         for phase in phases]
+
+        self.phase_duration.fill(0)
+        self.finish_time.fill(0)
+        self.delay.fill(0)
+        self.start_time.fill(0)
+        self.previous_phase.fill(-1)
+        self.present.fill(False)
+        self.computed = np.zeros(self.state_count, dtype=np.bool_)
+
+        self._padded_clusters = None
+
+        root = phases.index(curr_phase)
+        self.phase_duration[0, root] = curr_phase_duration
+        self.finish_time[0, root] = curr_time
+        self.present[0, root] = True
+        self.computed[0] = True
+
+    def padded_clusters(self):
+        # Cluster arrivals, durations and counts as phase-by-cluster arrays,
+        # padded with zeros to the longest inflow
+        if self._padded_clusters is None:
+            width = max(self.cluster_counts) if self.cluster_counts else 0
+            padded = tuple(np.zeros((len(self.clusters), width)) for _ in range(3))
+            for k, columns in enumerate(self.clusters):
+                for array, column in zip(padded, columns):
+                    array[k, :len(column)] = column
+            self._padded_clusters = padded
+        return self._padded_clusters
+
+    def layout(self):
+        # What a worker process needs, besides the arrays, to relax statuses
+        return {'strides': self.strides,
+                'cluster_counts': self.cluster_counts,
+                'clusters': self.clusters,
+                'state_count': self.state_count}
+
+    @classmethod
+    def attach(cls, layout, arrays):
+        # Table over existing arrays, as built by a worker process from the
+        # layout of the table in its parent. Only statuses can be relaxed
+        # in it, it has no layers.
+        table = cls.__new__(cls)
+        for name, value in layout.items():
+            setattr(table, name, value)
+        for name, _ in cls.FIELDS:
+            setattr(table, name, arrays[name])
+        table._padded_clusters = None
+        return table
+
+
+class TableArena(object):
+    # Shared memory for the arrays of DenseTables with up to capacity
+    # statuses, inherited by the worker processes of ParallelSchIC. Tables
+    # use the first state_count rows.
+
+    CTYPES = {np.int64: ctypes.c_longlong,
+              np.float64: ctypes.c_double,
+              np.bool_: ctypes.c_bool}
+
+    def __init__(self, capacity, phase_count):
+        self.capacity = capacity
+        self.phase_count = phase_count
+        self._buffers = {name: multiprocessing.RawArray(self.CTYPES[dtype], capacity * phase_count)
+                         for name, dtype in DenseTable.FIELDS}
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def views(self):
+        # NumPy views are created lazily, in the process that uses them
+        if self._views is None:
+            self._views = {name: np.frombuffer(self._buffers[name], dtype=dtype).reshape(-1, self.phase_count)
+                           for name, dtype in DenseTable.FIELDS}
+        return self._views
+
+    def arrays(self, state_count):
+        return {name: view[:state_count] for name, view in self.views.items()}
+
+
 class ScheduleStatus(object):
     def __init__(self, status=None):
         if status is None:
@@ -256,3 +1244,12 @@ class ScheduleStatus(object):
 
     def copy(self):
         return ScheduleStatus({phase:count for phase, count in self._status.items()})
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, scheduled_count, cluster_count):
+        super(DeadlineExceeded, self).__init__()
+        self.msg = "Deadline passed with {} of {} clusters scheduled".format(scheduled_count, cluster_count)
+
+    def __str__(self):
+        return self.msg
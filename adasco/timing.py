@@ -0,0 +1,78 @@
+'''
+Phase timing tables derived from the signal timing constraints of an intersection
+'''
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTiming(namedtuple('PhaseTiming', ['phases',
+                                             'indices',
+                                             'Gmin',
+                                             'Gmax',
+                                             'Y',
+                                             'next_phase_indices',
+                                             'switch_backs',
+                                             'min_switches'])):
+    # Built once per intersection and shared by the agent and its scheduler.
+    # Everything except indices is a tuple indexed by the position of a phase
+    # in phases, so the DP transitions only index tuples:
+    #
+    # indices:            phase -> position in phases
+    # Gmin, Gmax, Y:      timing constraints of each phase
+    # next_phase_indices: position of the phase that follows each phase
+    # switch_backs:       shortest time in which the signal can return to
+    #                     each phase after leaving it (minimum cycle - Gmin)
+    # min_switches:       previous phase -> phase -> minimum time from the end
+    #                     of the previous phase's minimum green to the start
+    #                     of the phase's green
+
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, phases, Gmin, Gmax, Y):
+        phases = tuple(phases)
+        phase_count = len(phases)
+        indices = {phase: index for index, phase in enumerate(phases)}
+        next_phase_indices = tuple((index + 1) % phase_count for index in range(phase_count))
+
+        # Summed over all the phases with timing constraints, not only the
+        # ones that are planned
+        min_cycle = sum(Gmin.values()) + sum(Y.values())
+        switch_backs = tuple(min_cycle - Gmin[phase] for phase in phases)
+
+        min_switches = []
+        for base_index in range(phase_count):
+            row = [0] * phase_count
+            curr_index = base_index
+            switch_time = 0
+            for _ in range(phase_count - 1):
+                next_index = next_phase_indices[curr_index]
+                switch_time += Y[phases[curr_index]]
+                if curr_index != base_index:
+                    switch_time += Gmin[phases[curr_index]]
+                row[next_index] = switch_time
+                curr_index = next_index
+            min_switches.append(tuple(row))
+
+        return cls(phases=phases,
+                   indices=indices,
+                   Gmin=tuple(Gmin[phase] for phase in phases),
+                   Gmax=tuple(Gmax[phase] for phase in phases),
+                   Y=tuple(Y[phase] for phase in phases),
+                   next_phase_indices=next_phase_indices,
+                   switch_backs=switch_backs,
+                   min_switches=tuple(min_switches))
+
+    def next_phase(self, phase):
+        return self.phases[self.next_phase_indices[self.indices[phase]]]
+
+    def switch_back(self, phase):
+        return self.switch_backs[self.indices[phase]]
+
+    def min_switch(self, previous_phase, phase):
+        return self.min_switches[self.indices[previous_phase]][self.indices[phase]]
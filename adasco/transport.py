@@ -0,0 +1,152 @@
+'''
+Shared-memory transport for master-to-agent requests
+'''
+from __future__ import print_function
+from __future__ import division
+
+import multiprocessing
+import ctypes
+import logging
+
+import numpy as np
+
+from adasco.detector import ColumnarSensorData
+import adasco.messaging
+
+logger = logging.getLogger(__name__)
+
+NO_PHASE = -1
+
+
+class SharedMemorySlot(object):
+    # Fixed-layout request slot for a single agent, used in place of the
+    # agent's request queue (put/get/task_done). The master writes the slot
+    # and releases a semaphore; the agent acquires it and rebuilds the request
+    # from the slot. The master only writes again after the agent has
+    # responded, so a single slot per agent is enough.
+    #
+    # Layout:
+    #   header:    code, curr_phase, curr_phase_duration, curr_time, length of IDs
+    #   counts:    queued and arriving vehicle counts per incoming edge
+    #   distances: vehicle distances to the junction, queued vehicles first
+    #   IDs:       NUL-separated ASCII vehicle IDs, in the same order as distances
+
+    def __init__(self, edges, capacity=1024, id_width=32):
+        self.edges = sorted(edges)
+        self.capacity = capacity
+        self.id_width = id_width
+        self._header = multiprocessing.RawArray(ctypes.c_longlong, 5)
+        self._counts = multiprocessing.RawArray(ctypes.c_int, 2 * len(self.edges))
+        self._distances = multiprocessing.RawArray(ctypes.c_float, capacity)
+        self._ids = multiprocessing.RawArray(ctypes.c_char, capacity * id_width)
+        self._ready = multiprocessing.Semaphore(0)
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def views(self):
+        # NumPy views are created lazily, in the process that uses them
+        if self._views is None:
+            self._views = (np.frombuffer(self._header, dtype=np.int64),
+                           np.frombuffer(self._counts, dtype=np.intc),
+                           np.frombuffer(self._distances, dtype=np.float32))
+        return self._views
+
+    def put(self, message):
+        header, counts, distances = self.views
+
+        if message.code == adasco.messaging.KILL:
+            header[0] = message.code
+            self._ready.release()
+            return
+
+        vehicle_ids = []
+        offset = 0
+        for index, edge in enumerate(self.edges):
+            data = message.sensor_data[edge]
+            queue_length = data.queue_length
+            edge_vehicle_ids = data.queued_vehicle_ids + data.arriving_vehicle_ids
+            vehicle_count = len(edge_vehicle_ids)
+
+            if offset + vehicle_count > self.capacity:
+                raise SlotOverflowError(self.capacity, offset + vehicle_count)
+
+            if vehicle_count > 0:
+                vehicle_ids.extend(edge_vehicle_ids)
+                end = offset + vehicle_count
+                if isinstance(data, ColumnarSensorData):
+                    distances[offset:end] = data.distances
+                else:
+                    distances[offset:offset+queue_length] = data.queued_vehicle_positions
+                    distances[offset+queue_length:end] = data.arriving_vehicle_positions
+
+            counts[2*index] = queue_length
+            counts[2*index+1] = vehicle_count - queue_length
+            offset += vehicle_count
+
+        encoded_ids = '\0'.join(vehicle_ids).encode('ascii')
+        if len(encoded_ids) > len(self._ids):
+            raise SlotOverflowError(self.capacity, offset)
+        ctypes.memmove(self._ids, encoded_ids, len(encoded_ids))
+
+        header[0] = message.code
+        header[1] = NO_PHASE if message.curr_phase is None else message.curr_phase
+        header[2] = message.curr_phase_duration
+        header[3] = message.curr_time
+        header[4] = len(encoded_ids)
+
+        self._ready.release()
+
+    def get(self):
+        self._ready.acquire()
+
+        header, counts, distances = self.views
+
+        code = int(header[0])
+        if code == adasco.messaging.KILL:
+            return adasco.messaging.KillPill()
+
+        vehicle_count = int(counts.sum())
+        encoded_ids = ctypes.string_at(self._ids, int(header[4]))
+        if not isinstance(encoded_ids, str):
+            encoded_ids = encoded_ids.decode('ascii')
+        vehicle_ids = encoded_ids.split('\0') if vehicle_count > 0 else []
+        vehicle_distances = distances[:vehicle_count].copy()
+        vehicle_index = np.arange(vehicle_count, dtype=np.int32)
+        queued = np.zeros(vehicle_count, dtype=np.bool_)
+
+        edge_counts = counts.tolist()
+        sensor_data = {}
+        offset = 0
+        for index, edge in enumerate(self.edges):
+            queue_length = edge_counts[2*index]
+            end = offset + queue_length + edge_counts[2*index+1]
+            queued[offset:offset+queue_length] = True
+            sensor_data[edge] = ColumnarSensorData(vehicle_distances[offset:end],
+                                                   queued[offset:end],
+                                                   vehicle_index[offset:end],
+                                                   vehicle_ids)
+            offset = end
+
+        curr_phase = int(header[1])
+
+        return adasco.messaging.Request(sensor_data=sensor_data,
+                                        curr_phase=None if curr_phase == NO_PHASE else curr_phase,
+                                        curr_phase_duration=int(header[2]),
+                                        curr_time=int(header[3]))
+
+    def task_done(self):
+        pass
+
+
+class SlotOverflowError(Exception):
+    def __init__(self, capacity, vehicle_count):
+        super(SlotOverflowError, self).__init__()
+        self.msg = "{} vehicles do not fit in a slot of capacity {}".format(vehicle_count, capacity)
+
+    def __str__(self):
+        return self.msg
@@ -0,0 +1,93 @@
+'''
+Lookup tables derived from the static turn proportions of an intersection
+'''
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NormalizedTurn = namedtuple('NormalizedTurn', ['incoming_edge',
+                                               'outgoing_edge',
+                                               'phase',
+                                               'probability'])
+
+
+class TurnIndex(object):
+    # Built once from the list of turn proportions of an agent; the lists of
+    # turn dictionaries are not filtered again afterwards.
+    #
+    # phase_ratios:     incoming edge -> phase -> probability of taking the
+    #                   phase from the edge (summed over turns, at most 1)
+    # normalized_turns: (incoming edge, phase) -> turns from the edge during
+    #                   the phase, with probabilities normalized to sum to 1
+    # ratio_matrix:     phase_ratios as an edge-by-phase array
+
+    def __init__(self, turn_proportions):
+        phase_ratios = {}
+        turns_by_edge_phase = {}
+        for turn in turn_proportions:
+            edge = turn['incoming_edge']
+            phase = turn['phase']
+            if edge not in phase_ratios:
+                phase_ratios[edge] = {}
+            try:
+                phase_ratios[edge][phase] = min(phase_ratios[edge][phase] + turn['probability'], 1)
+            except KeyError:
+                phase_ratios[edge][phase] = min(turn['probability'], 1)
+            try:
+                turns_by_edge_phase[(edge, phase)].append(turn)
+            except KeyError:
+                turns_by_edge_phase[(edge, phase)] = [turn]
+
+        normalized_turns = {}
+        for key, turns in turns_by_edge_phase.items():
+            total_outflow = sum([turn['probability'] for turn in turns])
+            normalized_turns[key] = tuple(NormalizedTurn(incoming_edge=turn['incoming_edge'],
+                                                         outgoing_edge=turn['outgoing_edge'],
+                                                         phase=turn['phase'],
+                                                         probability=turn['probability'] / total_outflow)
+                                          for turn in turns)
+
+        self._phase_ratios = phase_ratios
+        self._normalized_turns = normalized_turns
+        self.ratio_matrix = self._build_ratio_matrix(turn_proportions)
+
+    def _build_ratio_matrix(self, turn_proportions):
+        edges = []
+        phases = []
+        for turn in turn_proportions:
+            if turn['incoming_edge'] not in edges:
+                edges.append(turn['incoming_edge'])
+            if turn['phase'] not in phases:
+                phases.append(turn['phase'])
+
+        ratios = np.zeros((len(edges), len(phases)))
+        present = np.zeros((len(edges), len(phases)), dtype=np.bool_)
+        for row, edge in enumerate(edges):
+            for phase, ratio in self._phase_ratios[edge].items():
+                column = phases.index(phase)
+                ratios[row, column] = ratio
+                present[row, column] = True
+
+        for array in (ratios, present):
+            array.flags.writeable = False
+
+        return RatioMatrix(edges={edge: row for row, edge in enumerate(edges)},
+                           phases=tuple(phases),
+                           ratios=ratios,
+                           present=present)
+
+    def phase_ratios(self, edge):
+        # Returns a copy, the index itself is never modified
+        return dict(self._phase_ratios.get(edge, {}))
+
+    def normalized_turns(self, edge, phase):
+        return self._normalized_turns.get((edge, phase), ())
+
+
+RatioMatrix = namedtuple('RatioMatrix', ['edges', 'phases', 'ratios', 'present'])
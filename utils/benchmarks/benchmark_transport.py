@@ -0,0 +1,101 @@
+from __future__ import print_function
+from __future__ import division
+
+import multiprocessing
+import argparse
+import random
+import timeit
+
+import numpy as np
+
+from adasco.agents.base import BaseAgent
+from adasco.detector import SensorData, ColumnarSensorData
+import adasco.messaging
+import adasco.transport
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare per-message latency of the agent request transports')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='Number of request/response round trips per transport (default=2000)')
+    parser.add_argument('--edges', type=int, default=4,
+                        help='Number of incoming edges per agent (default=4)')
+    parser.add_argument('--vehicles', type=int, default=40,
+                        help='Number of vehicles per edge (default=40)')
+    parser.add_argument('--columnar', action='store_true', default=False,
+                        help='Send columnar sensor data over the queue transport')
+    args = parser.parse_args()
+    return args
+
+
+class EchoAgent(BaseAgent):
+    def plan(self, sensor_data, curr_phase, curr_phase_duration, curr_time):
+        return 0, curr_time + 1
+
+
+def get_sensor_data(edges, vehicles, columnar):
+    data = {}
+    vehicle_ids = []
+    for edge in edges:
+        queue_length = vehicles // 2
+        positions = sorted(random.uniform(0, 300) for _ in range(vehicles))
+        IDs = ['flow{}.{}'.format(edge, index) for index in range(vehicles)]
+        if columnar:
+            data[edge] = ColumnarSensorData.from_lists(positions[:queue_length], IDs[:queue_length],
+                                                       positions[queue_length:], IDs[queue_length:],
+                                                       vehicle_ids)
+        else:
+            data[edge] = SensorData(queue_length,
+                                    positions[:queue_length], IDs[:queue_length],
+                                    positions[queue_length:], IDs[queue_length:])
+    return data
+
+
+def measure(request_queue, edges, sensor_data, messages):
+    response_queue = multiprocessing.Queue()
+    agent = EchoAgent(ID='echo',
+                      incoming_edges={edge: [] for edge in edges},
+                      request_queue=request_queue,
+                      response_queue=response_queue)
+    agent.start()
+
+    latencies = []
+    for step in range(messages):
+        request = adasco.messaging.Request(sensor_data=sensor_data,
+                                           curr_phase=0,
+                                           curr_phase_duration=step,
+                                           curr_time=step)
+        start = timeit.default_timer()
+        request_queue.put(request)
+        response_queue.get()
+        latencies.append(timeit.default_timer() - start)
+
+    request_queue.put(adasco.messaging.KillPill())
+    agent.join()
+
+    return np.array(latencies)
+
+
+def report(label, latencies):
+    print('{:<10} mean = {:8.1f} us, median = {:8.1f} us, p99 = {:8.1f} us'.format(label,
+                                                                                 1e6 * latencies.mean(),
+                                                                                 1e6 * np.median(latencies),
+                                                                                 1e6 * np.percentile(latencies, 99)))
+
+
+def main():
+    args = get_args()
+
+    edges = ['edge{}'.format(index) for index in range(args.edges)]
+    sensor_data = get_sensor_data(edges, args.vehicles, args.columnar)
+
+    print('{} round trips, {} edges x {} vehicles per request'.format(args.messages, args.edges, args.vehicles))
+
+    report('queue', measure(multiprocessing.JoinableQueue(), edges, sensor_data, args.messages))
+
+    slot = adasco.transport.SharedMemorySlot(edges, capacity=args.edges * args.vehicles)
+    report('shm', measure(slot, edges, sensor_data, args.messages))
+
+
+if __name__ == '__main__':
+    main()
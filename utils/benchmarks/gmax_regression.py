@@ -0,0 +1,172 @@
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import glob
+import os
+import pickle
+import timeit
+
+import numpy as np
+
+import adasco.schedulers.schic
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare the single-solve Gmax split with the Gmax resolve loop on recorded SURTRAC planning problems')
+    parser.add_argument('record_dir',
+                        help='Directory of planning problems recorded with run_adaptive.py --record-dir')
+    parser.add_argument('--engine', default='dict', choices=['dict', 'dense'],
+                        help='SchIC engine (default=dict)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Maximum number of recorded problems to evaluate')
+    args = parser.parse_args()
+    return args
+
+
+def load_decisions(record_dir, limit):
+    paths = sorted(glob.glob(os.path.join(record_dir, '*.pkl')))
+    if limit is not None:
+        paths = paths[:limit]
+    for path in paths:
+        with open(path, 'rb') as fp:
+            decision = pickle.load(fp)
+        # Only SURTRAC records a single inflow
+        if 'inflow' in decision:
+            yield os.path.basename(path), decision
+
+
+def segment_delay(segments):
+    return sum(segment.inflow_cluster.count * (segment.cluster.arrival - segment.inflow_cluster.arrival)
+               for segment in segments)
+
+
+def segment_key(segments):
+    return [(segment.phase,
+             segment.duration,
+             segment.cluster.count,
+             segment.cluster.arrival,
+             segment.cluster.departure,
+             segment.source) for segment in segments]
+
+
+def check_plan(scheduler, segments, decision, tolerance=1e-6):
+    # Constraints the plan breaks: a cluster served before it arrives,
+    # overlapping clusters, a green longer than Gmax, a green that starts
+    # too early after the previous one (Gmin, yellows and the other phases'
+    # Gmin) or clusters not served completely
+    broken = set()
+    phase = decision['curr_phase']
+    duration = decision['curr_phase_duration']
+    departure = decision['curr_time']
+    served = {}
+    for segment in segments:
+        cluster = segment.cluster
+        if cluster.arrival < segment.inflow_cluster.arrival - tolerance:
+            broken.add('early')
+        if cluster.arrival < departure - tolerance:
+            broken.add('overlap')
+        if segment.duration > scheduler.Gmax[segment.phase] + tolerance:
+            broken.add('Gmax')
+        # A new green, after a switch or after the signal cycled back
+        if (segment.phase != phase
+            or segment.duration < duration + cluster.departure - departure - tolerance):
+            if segment.phase != phase:
+                switch = scheduler.min_switch(phase, segment.phase)
+            else:
+                switch = scheduler.switch_back(phase)
+            earliest_start = departure + max(0, scheduler.Gmin[phase] - duration) + switch
+            if cluster.departure - segment.duration < earliest_start - tolerance:
+                broken.add('Gmin')
+        phase, duration, departure = segment.phase, segment.duration, cluster.departure
+        served[segment.phase, segment.source] = served.get((segment.phase, segment.source), 0) + segment.inflow_cluster.count
+    for phase, sequence in decision['inflow'].items():
+        for cluster in sequence:
+            if abs(served.get((phase, cluster.arrival), 0) - cluster.count) > tolerance:
+                broken.add('count')
+    return sorted(broken)
+
+
+def solve(scheduler, decision, mode):
+    start = timeit.default_timer()
+    # SURTRAC plans with a minimum cluster size of 0
+    segments, _ = scheduler.schedule_within_gmax(decision['inflow'],
+                                                 decision['curr_phase'],
+                                                 decision['curr_phase_duration'],
+                                                 decision['curr_time'],
+                                                 0,
+                                                 mode=mode)
+    elapsed = timeit.default_timer() - start
+    return segments, scheduler.solve_count, elapsed
+
+
+def main():
+    args = get_args()
+
+    scheduler_class = {'dict': adasco.schedulers.schic.SchIC,
+                       'dense': adasco.schedulers.schic.DenseSchIC}[args.engine]
+
+    identical = []
+    violating = []
+    infeasible = {'resolve': 0, 'split': 0}
+    feasible = []
+    delay_gaps = []
+    solves = {'resolve': [], 'split': []}
+    times = {'resolve': [], 'split': []}
+
+    for name, decision in load_decisions(args.record_dir, args.limit):
+        scheduler = scheduler_class(decision['phases'],
+                                    decision['Gmin'],
+                                    decision['Gmax'],
+                                    decision['Y'],
+                                    decision['startup_lost_time'])
+
+        results = {}
+        for mode in ('resolve', 'split'):
+            segments, solve_count, elapsed = solve(scheduler, decision, mode)
+            results[mode] = segments
+            solves[mode].append(solve_count)
+            times[mode].append(elapsed)
+
+        violating.append(solves['resolve'][-1] > 1)
+        identical.append(segment_key(results['resolve']) == segment_key(results['split']))
+        broken = {}
+        for mode in ('resolve', 'split'):
+            broken[mode] = check_plan(scheduler, results[mode], decision)
+            if broken[mode]:
+                infeasible[mode] += 1
+                print('{}: {} plan breaks {}'.format(name, mode, ', '.join(broken[mode])))
+        feasible.append(not broken['resolve'] and not broken['split'])
+        resolve_delay = segment_delay(results['resolve'])
+        split_delay = segment_delay(results['split'])
+        delay_gaps.append((split_delay - resolve_delay) / resolve_delay if resolve_delay > 0 else 0)
+
+        if not identical[-1]:
+            print('{}: plans differ, delay {:.1f} (resolve) vs {:.1f} (split)'.format(name, resolve_delay, split_delay))
+
+    if not identical:
+        print('No recorded SURTRAC problems in {}'.format(args.record_dir))
+        return
+
+    identical = np.array(identical)
+    violating = np.array(violating)
+    feasible = np.array(feasible)
+    delay_gaps = np.array(delay_gaps)
+    print('{} problems, {} with Gmax violations'.format(len(identical), violating.sum()))
+    print('identical plans: {:.1%} overall, {:.1%} of problems without violations, {:.1%} with'.format(
+        identical.mean(),
+        identical[~violating].mean() if (~violating).any() else 1,
+        identical[violating].mean() if violating.any() else 1))
+    print('infeasible plans: {} (resolve), {} (split)'.format(infeasible['resolve'], infeasible['split']))
+    print('split delay gap: mean = {:.3%}, min = {:.3%}, max = {:.3%}, lower in {}, higher in {}'.format(
+        delay_gaps.mean(), delay_gaps.min(), delay_gaps.max(), (delay_gaps < 0).sum(), (delay_gaps > 0).sum()))
+    if feasible.any():
+        feasible_gaps = delay_gaps[feasible]
+        print('split delay gap where both plans are feasible: mean = {:.3%}, lower in {}, higher in {}'.format(
+            feasible_gaps.mean(), (feasible_gaps < 0).sum(), (feasible_gaps > 0).sum()))
+    for mode in ('resolve', 'split'):
+        print('{:<8} mean solves = {:.2f}, mean time = {:.4f} s'.format(mode, np.mean(solves[mode]), np.mean(times[mode])))
+
+
+if __name__ == '__main__':
+    main()
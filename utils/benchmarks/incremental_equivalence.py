@@ -0,0 +1,150 @@
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import random
+
+import adasco.schedulers.schic
+from adasco.cluster import Cluster, ClusterSequence
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Check that the plans of the incremental SchIC engine equal fresh SchIC schedules on sequences of related synthetic problems')
+    parser.add_argument('--phases', type=int, default=4,
+                        help='Number of phases (default=4)')
+    parser.add_argument('--clusters', type=int, default=3,
+                        help='Number of clusters per phase (default=3)')
+    parser.add_argument('--problems', type=int, default=30,
+                        help='Number of synthetic planning problems (default=30)')
+    parser.add_argument('--min-reuse', type=float, default=0,
+                        help='Least share of the states reused by the incremental engine (default=0, reuse whatever can be reused)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default=0)')
+    args = parser.parse_args()
+    return args
+
+
+def half_seconds(rng, low, high):
+    # Times on a half-second grid, so that plans shifted by the elapsed time
+    # are exact in floating point
+    return rng.randint(int(2 * low), int(2 * high)) / 2
+
+
+def get_inflow(rng, phases, cluster_count, start=0):
+    inflow = {}
+    for phase in phases:
+        sequence = ClusterSequence()
+        time = start + half_seconds(rng, 0, 10)
+        for _ in range(cluster_count):
+            duration = half_seconds(rng, 1, 6)
+            sequence.append(Cluster(rng.randint(1, 4), time, time + duration))
+            time += duration + half_seconds(rng, 0, 15)
+        inflow[phase] = sequence
+    return inflow
+
+
+def shift_and_extend(rng, inflow, elapsed_time, cluster_count):
+    # The same clusters, elapsed_time later, and cluster_count later ones on
+    # each phase
+    extended = {}
+    for phase, sequence in inflow.items():
+        sequence = ClusterSequence._from_sorted([Cluster(cluster.count,
+                                                         cluster.arrival + elapsed_time,
+                                                         cluster.departure + elapsed_time)
+                                                 for cluster in sequence])
+        time = sequence[-1].departure if len(sequence) else 0
+        for _ in range(cluster_count):
+            time += half_seconds(rng, 0, 15)
+            duration = half_seconds(rng, 1, 6)
+            sequence.append(Cluster(rng.randint(1, 4), time, time + duration))
+            time += duration
+        extended[phase] = sequence
+    return extended
+
+
+def change_head(inflow, phase):
+    changed = {other_phase: sequence.copy() for other_phase, sequence in inflow.items()}
+    head = changed[phase][0]
+    changed[phase].set(0, Cluster(head.count + 1, head.arrival, head.departure))
+    return changed
+
+
+def prefix(inflow, cluster_count):
+    # The cluster_count earliest clusters over all phases
+    arrivals = sorted(cluster.arrival for sequence in inflow.values() for cluster in sequence)
+    if cluster_count < len(arrivals):
+        cutoff = arrivals[cluster_count - 1]
+    else:
+        cutoff = float('inf')
+    return {phase: ClusterSequence._from_sorted([cluster for cluster in sequence if cluster.arrival <= cutoff])
+            for phase, sequence in inflow.items()}
+
+
+def get_plan(scheduler, inflow, curr_phase, curr_phase_duration, curr_time):
+    outflow, phase_sequence, phase_durations = scheduler.schedule(inflow, curr_phase, curr_phase_duration, curr_time)
+    return [(cluster.count, cluster.arrival, cluster.departure) for cluster in outflow], phase_sequence, phase_durations
+
+
+def get_steps(rng, phases, cluster_count):
+    # Successive schedules of one intersection, as (name, inflow, current
+    # phase, current phase duration, current time), from which the
+    # incremental engine reuses or recomputes states
+    curr_phase = rng.choice(phases)
+    curr_phase_duration = half_seconds(rng, 0, 20)
+    inflow = get_inflow(rng, phases, cluster_count)
+    total = sum(len(sequence) for sequence in inflow.values())
+
+    steps = []
+    # Growing prefixes at the same decision point, as in schedule_anytime
+    for count in (2, 4, 8, total):
+        steps.append(('prefix', prefix(inflow, count), curr_phase, curr_phase_duration, 0))
+    # A later decision point with the same phase and phase duration, which
+    # sees the same clusters at the same times and later ones
+    elapsed_time = half_seconds(rng, 1, 10)
+    extended = shift_and_extend(rng, inflow, elapsed_time, 1)
+    steps.append(('shifted tail', extended, curr_phase, curr_phase_duration, elapsed_time))
+    # A changed first cluster, a changed phase duration and a changed phase,
+    # which must not reuse the states that depend on them
+    steps.append(('changed head', change_head(extended, rng.choice(phases)), curr_phase, curr_phase_duration, elapsed_time))
+    steps.append(('changed duration', extended, curr_phase, curr_phase_duration + 1, elapsed_time))
+    other_phases = [phase for phase in phases if phase != curr_phase]
+    steps.append(('changed phase', extended, rng.choice(other_phases), curr_phase_duration + 1, elapsed_time))
+    return steps
+
+
+def main():
+    args = get_args()
+
+    rng = random.Random(args.seed)
+    phases = list(range(args.phases))
+    Gmin = {phase: 5 for phase in phases}
+    Gmax = {phase: 60 for phase in phases}
+    Y = {phase: 4 for phase in phases}
+
+    reference = adasco.schedulers.schic.SchIC(phases, Gmin, Gmax, Y, 2)
+    incremental = adasco.schedulers.schic.IncrementalSchIC(phases, Gmin, Gmax, Y, 2,
+                                                           kernel='numpy',
+                                                           min_reuse=args.min_reuse)
+
+    mismatches = {}
+    reused = {}
+    for problem in range(args.problems):
+        for name, inflow, curr_phase, curr_phase_duration, curr_time in get_steps(rng, phases, args.clusters):
+            reused_states = incremental.reuse_counts['reused_states']
+            plan = get_plan(incremental, inflow, curr_phase, curr_phase_duration, curr_time)
+            reused.setdefault(name, []).append(incremental.reuse_counts['reused_states'] > reused_states)
+            if plan != get_plan(reference, inflow, curr_phase, curr_phase_duration, curr_time):
+                mismatches[name] = mismatches.get(name, 0) + 1
+                print('problem {}, {}: plans differ'.format(problem, name))
+
+    print('{} problems, {} phases, {} clusters per phase'.format(args.problems, args.phases, args.clusters))
+    for name in reused:
+        print('{:<16} reused in {:3d} of {} schedules, plans differing from SchIC: {}'.format(name,
+                                                                                             sum(reused[name]),
+                                                                                             len(reused[name]),
+                                                                                             mismatches.get(name, 0)))
+    print('reuse counts: {}, reuse rate = {:.3f}'.format(incremental.reuse_counts, incremental.reuse_rate))
+
+
+if __name__ == '__main__':
+    main()
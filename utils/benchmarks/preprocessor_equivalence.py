@@ -0,0 +1,165 @@
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import glob
+import os
+import pickle
+import random
+import sys
+import timeit
+
+import numpy as np
+
+import adasco.preprocessor
+import adasco.turns
+from adasco.detector import SensorData, ColumnarSensorData
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Check that the vectorised preprocessor clusters sensor data and splits it into phases exactly like the scalar one')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Number of random requests (default=500)')
+    parser.add_argument('--record-dir', default=None,
+                        help='Directory of SURTRAC planning problems recorded with run_adaptive.py --record-dir, whose sensor data is also checked')
+    parser.add_argument('--max-vehicles', type=int, default=40,
+                        help='Maximum number of arriving vehicles per edge of a random request (default=40)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default=0)')
+    args = parser.parse_args()
+    return args
+
+
+def get_random_request(rng, max_vehicles):
+    # Sensor data, phases, turn proportions and preprocessor settings of a
+    # random intersection. Some vehicles are placed exactly on the boundaries
+    # of the rounding and bucketing steps: with a free-flow speed of 12.5 or
+    # 16, the arrival times of vehicles half a time step away from a
+    # multiple of the time resolution are exact halves.
+    phases = list(range(0, 2 * rng.randint(2, 4), 2))
+    edges = ['in{}'.format(index) for index in range(rng.randint(1, 4))]
+    settings = {'saturation_flow_rate': rng.choice([0.5, 0.6]),
+                'free_flow_speed': rng.choice([13.89, 11.11, 15.0, 12.5, 16.0]),
+                'time_resolution': rng.choice([0.5, 1]),
+                'sampling_interval': rng.choice([1, 2, 5]),
+                'min_cluster_size': rng.choice([0, 0.1, 0.5]),
+                'merging_threshold': 2}
+
+    turn_proportions = []
+    for edge in edges:
+        edge_phases = rng.sample(phases, rng.randint(1, len(phases)))
+        for phase in edge_phases:
+            turn_proportions.append({'incoming_edge': edge,
+                                     'outgoing_edge': 'out{}'.format(rng.randint(0, 3)),
+                                     'phase': phase,
+                                     'probability': rng.uniform(0, 1) / len(edge_phases)})
+
+    columnar = rng.random() < 0.5
+    vehicle_ids = []
+    sensor_data = {}
+    step = settings['free_flow_speed'] * settings['sampling_interval']
+    half_step = settings['free_flow_speed'] * settings['time_resolution']
+    for edge in edges:
+        queued_ids = ['{}.q{}'.format(edge, index) for index in range(rng.randint(0, 15))]
+        arriving_ids = ['{}.a{}'.format(edge, index) for index in range(rng.randint(0, max_vehicles))]
+        queued_positions = [rng.uniform(0, 30) for _ in queued_ids]
+        arriving_positions = sorted(rng.choice([rng.uniform(0, 500),
+                                                step * rng.randint(0, 30),
+                                                half_step * (rng.randint(0, 60) + 0.5)])
+                                    for _ in arriving_ids)
+        if columnar:
+            sensor_data[edge] = ColumnarSensorData.from_lists(queued_positions, queued_ids,
+                                                              arriving_positions, arriving_ids, vehicle_ids)
+        else:
+            sensor_data[edge] = SensorData(len(queued_ids), queued_positions, queued_ids,
+                                           arriving_positions, arriving_ids)
+
+    return sensor_data, phases, turn_proportions, settings
+
+
+def check_rounding():
+    # Returns the number of values that the scalar and vectorised rounding
+    # round differently from round of Python 2, which rounds halves away
+    # from zero
+    values = [0.5, 1.5, 2.5, 3.5, 100.5, -0.5, -1.5, -2.5, 0.49999999999999994, 2.4999999999999996,
+              0.0, -0.0, 1.0, 0.25, 1e15 + 0.5]
+    expected = [1.0, 2.0, 3.0, 4.0, 101.0, -1.0, -2.0, -3.0, 0.0, 2.0,
+                0.0, -0.0, 1.0, 0.0, 1e15 + 1]
+    vectorised = adasco.preprocessor.round_half_away_array(np.array(values)).tolist()
+    mismatches = 0
+    for value, target, vector in zip(values, expected, vectorised):
+        scalar = adasco.preprocessor.round_half_away(value)
+        if scalar != target or vector != target:
+            mismatches += 1
+            print('rounding {!r}: expected {!r}, scalar {!r}, vectorised {!r}'.format(value, target, scalar, vector))
+    print('rounding: {} values, {} mismatches'.format(len(values), mismatches))
+    return mismatches
+
+
+def load_requests(record_dir):
+    for path in sorted(glob.glob(os.path.join(record_dir, '*.pkl'))):
+        with open(path, 'rb') as fp:
+            decision = pickle.load(fp)
+        # Only SURTRAC records its sensor data
+        if 'sensor_data' in decision:
+            yield decision['sensor_data'], decision['phases'], decision['turn_proportions'], decision['preprocessor']
+
+
+def preprocess(preprocessor, sensor_data, phases, turn_index):
+    roadflow = preprocessor.get_roadflow(sensor_data)
+    inflow, road_count = preprocessor.get_inflow_from_roadflow(roadflow, phases, turn_index)
+    return roadflow, inflow, road_count
+
+
+def check(name, requests):
+    # Returns the number of requests on which the two paths differ
+    count = 0
+    mismatches = 0
+    times = {False: 0, True: 0}
+    for sensor_data, phases, turn_proportions, settings in requests:
+        turn_index = adasco.turns.TurnIndex(turn_proportions or [])
+        results = {}
+        for vectorised in (False, True):
+            preprocessor = adasco.preprocessor.ExactPreprocessor(settings['saturation_flow_rate'],
+                                                                 settings['free_flow_speed'],
+                                                                 settings['time_resolution'],
+                                                                 settings['sampling_interval'],
+                                                                 settings['min_cluster_size'],
+                                                                 settings['merging_threshold'],
+                                                                 vectorised)
+            start = timeit.default_timer()
+            results[vectorised] = preprocess(preprocessor, sensor_data, phases, turn_index)
+            times[vectorised] += timeit.default_timer() - start
+
+        count += 1
+        for label, scalar, vector in zip(('roadflow', 'inflow', 'road count'), results[False], results[True]):
+            if scalar != vector:
+                mismatches += 1
+                if mismatches <= 5:
+                    print('{} request {}: {} differs\n  scalar:     {}\n  vectorised: {}'.format(name, count, label,
+                                                                                                  scalar, vector))
+                break
+
+    if count:
+        print('{}: {} requests, {} mismatches, scalar {:.3f}s, vectorised {:.3f}s'.format(name, count, mismatches,
+                                                                                         times[False], times[True]))
+    else:
+        print('{}: no requests'.format(name))
+    return mismatches
+
+
+def main():
+    args = get_args()
+
+    mismatches = check_rounding()
+    rng = random.Random(args.seed)
+    mismatches += check('random', (get_random_request(rng, args.max_vehicles) for _ in range(args.requests)))
+    if args.record_dir is not None:
+        mismatches += check('recorded', load_requests(args.record_dir))
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import glob
+import os
+import pickle
+import timeit
+
+import numpy as np
+
+import adasco.schedulers.cp
+import adasco.schedulers.milp
+import adasco.schedulers.schic
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare the solve times of SchIC, CP and MILP on recorded planning problems, by problem size')
+    parser.add_argument('record_dir',
+                        help='Directory of planning problems recorded with run_adaptive.py --record-dir')
+    parser.add_argument('--schedulers', nargs='+', default=['schic', 'cp', 'milp'], choices=['schic', 'cp', 'cpsat', 'milp'],
+                        help='Schedulers to compare (default=schic cp milp)')
+    parser.add_argument('--timelimit', type=int, default=5,
+                        help='Time limit of each CP and MILP solve (default=5)')
+    parser.add_argument('--cycle-count', type=int, default=3,
+                        help='Number of cycles planned by CP and MILP (default=3)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Maximum number of recorded problems to evaluate')
+    args = parser.parse_args()
+    return args
+
+
+def load_decisions(record_dir, limit):
+    paths = sorted(glob.glob(os.path.join(record_dir, '*.pkl')))
+    if limit is not None:
+        paths = paths[:limit]
+    for path in paths:
+        with open(path, 'rb') as fp:
+            yield os.path.basename(path), pickle.load(fp)
+
+
+def get_samples(decision):
+    # SURTRAC records one inflow, the SAA agents their distinct samples
+    if 'inflows' in decision:
+        return decision['inflows'], decision['weights']
+    return [decision['inflow']], [1]
+
+
+def solve(name, decision, args):
+    # Returns the solve time and the weighted delay of the plan under the CP
+    # model (None for SchIC, whose model differs), or None if there is no
+    # plan. SchIC only solves problems with a single inflow.
+    inflows, weights = get_samples(decision)
+    parameters = (decision['phases'],
+                  decision['Gmin'],
+                  decision['Gmax'],
+                  decision['Y'],
+                  decision['startup_lost_time'])
+
+    if name == 'schic':
+        scheduler = adasco.schedulers.schic.DenseSchIC(*parameters)
+        start = timeit.default_timer()
+        scheduler.schedule(inflows[0], decision['curr_phase'], decision['curr_phase_duration'], decision['curr_time'])
+        return timeit.default_timer() - start, None
+
+    parameters += (args.timelimit, args.cycle_count)
+    if name == 'milp':
+        scheduler = adasco.schedulers.milp.MILP(*parameters)
+    else:
+        scheduler = adasco.schedulers.cp.CP(*parameters, backend=name)
+
+    start = timeit.default_timer()
+    extension, _ = scheduler.schedule_over_all_samples(inflows, weights, decision['curr_phase'], decision['curr_phase_duration'])
+    elapsed = timeit.default_timer() - start
+    delays = None
+    if extension is not None:
+        delays = scheduler.evaluator.evaluate(inflows, scheduler.last_plan)
+    scheduler.close()
+    if delays is None:
+        return None
+    return elapsed, sum(weight * delay for weight, delay in zip(weights, delays))
+
+
+def main():
+    args = get_args()
+
+    # Cluster count of the problem -> scheduler -> results
+    results = {}
+    counts = {}
+    for name, decision in load_decisions(args.record_dir, args.limit):
+        inflows, _ = get_samples(decision)
+        size = sum(len(sequence) for inflow in inflows for sequence in inflow.values())
+        results.setdefault(size, {scheduler: [] for scheduler in args.schedulers})
+        counts[size] = counts.get(size, 0) + 1
+
+        for scheduler in args.schedulers:
+            if scheduler == 'schic' and len(inflows) > 1:
+                continue
+            result = solve(scheduler, decision, args)
+            results[size][scheduler].append(result)
+            if result is None:
+                print('{}: no plan from {}'.format(name, scheduler))
+
+    if not results:
+        print('No recorded problems in {}'.format(args.record_dir))
+        return
+
+    print('{:>8} {:>6}'.format('clusters', 'count') + ''.join(' {:>20}'.format(scheduler) for scheduler in args.schedulers))
+    for size in sorted(results):
+        line = '{:>8} {:>6}'.format(size, counts[size])
+        for scheduler in args.schedulers:
+            solved = [result for result in results[size][scheduler] if result is not None]
+            if not solved:
+                line += ' {:>20}'.format('-')
+                continue
+            times = [elapsed for elapsed, _ in solved]
+            delays = [delay for _, delay in solved if delay is not None]
+            summary = '{:.3f}s'.format(np.mean(times))
+            if delays:
+                summary += ' d={:.1f}'.format(np.mean(delays))
+            line += ' {:>20}'.format(summary)
+        print(line)
+    print('Mean solve time per problem size and, for CP and MILP, mean delay of the plans under the CP model')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import pickle
+import glob
+import os
+import timeit
+
+import numpy as np
+
+import adasco.schedulers.schic
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare pruned SchIC schedules with exact ones on recorded planning problems')
+    parser.add_argument('record_dir',
+                        help='Directory of planning problems recorded with run_adaptive.py --record-dir')
+    parser.add_argument('--beam-widths', type=int, nargs='+', default=[8, 32, 128],
+                        help='Beam widths to evaluate (default=8 32 128)')
+    parser.add_argument('--prune-dominated', action='store_true', default=False,
+                        help='Also drop dominated states')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Maximum number of recorded problems to evaluate')
+    args = parser.parse_args()
+    return args
+
+
+def load_decisions(record_dir, limit):
+    paths = sorted(glob.glob(os.path.join(record_dir, '*.pkl')))
+    if limit is not None:
+        paths = paths[:limit]
+    for path in paths:
+        with open(path, 'rb') as fp:
+            yield os.path.basename(path), pickle.load(fp)
+
+
+def plan_delay(inflow, outflow, phase_sequence):
+    curr_cluster = {phase: 0 for phase in inflow}
+    delay = 0
+    for cluster, phase in zip(outflow, phase_sequence):
+        scheduled = inflow[phase][curr_cluster[phase]]
+        delay += scheduled.count * (cluster.arrival - scheduled.arrival)
+        curr_cluster[phase] += 1
+    return delay
+
+
+def solve(scheduler, decision):
+    start = timeit.default_timer()
+    outflow, phase_sequence, _ = scheduler.schedule(decision['inflow'],
+                                                    decision['curr_phase'],
+                                                    decision['curr_phase_duration'],
+                                                    decision['curr_time'])
+    elapsed = timeit.default_timer() - start
+    return plan_delay(decision['inflow'], outflow, phase_sequence), elapsed
+
+
+def get_scheduler(decision, scheduler_class=adasco.schedulers.schic.SchIC, **kwargs):
+    return scheduler_class(decision['phases'],
+                           decision['Gmin'],
+                           decision['Gmax'],
+                           decision['Y'],
+                           decision['startup_lost_time'],
+                           **kwargs)
+
+
+def main():
+    args = get_args()
+
+    configurations = [(width, args.prune_dominated) for width in args.beam_widths]
+    if args.prune_dominated:
+        configurations.insert(0, (None, True))
+
+    gaps = {configuration: [] for configuration in configurations}
+    times = {configuration: [] for configuration in configurations}
+    exact_times = []
+
+    for name, decision in load_decisions(args.record_dir, args.limit):
+        # The dense engine computes the same schedules as exact SchIC
+        exact_delay, exact_time = solve(get_scheduler(decision, adasco.schedulers.schic.DenseSchIC), decision)
+        exact_times.append(exact_time)
+
+        for beam_width, prune_dominated in configurations:
+            scheduler = get_scheduler(decision, beam_width=beam_width, prune_dominated=prune_dominated)
+            delay, elapsed = solve(scheduler, decision)
+            gap = (delay - exact_delay) / exact_delay if exact_delay > 0 else 0
+            gaps[(beam_width, prune_dominated)].append(gap)
+            times[(beam_width, prune_dominated)].append(elapsed)
+
+    if not exact_times:
+        print('No recorded problems in {}'.format(args.record_dir))
+        return
+
+    print('{} problems, exact (dense) mean time = {:.4f} s'.format(len(exact_times), np.mean(exact_times)))
+    for beam_width, prune_dominated in configurations:
+        configuration_gaps = np.array(gaps[(beam_width, prune_dominated)])
+        print('beam width = {:>5}, prune dominated = {:<5}: mean gap = {:7.3%}, max gap = {:7.3%}, '
+              'optimal in {:6.1%}, mean time = {:.4f} s'.format(str(beam_width),
+                                                               str(prune_dominated),
+                                                               configuration_gaps.mean(),
+                                                               configuration_gaps.max(),
+                                                               np.mean(configuration_gaps <= 1e-9),
+                                                               np.mean(times[(beam_width, prune_dominated)])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import random
+import timeit
+
+import adasco.schedulers.kernels
+import adasco.schedulers.schic
+from adasco.cluster import Cluster, ClusterSequence
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Measure SchIC solves per second with each layer relaxation kernel on synthetic inflows')
+    parser.add_argument('--phases', type=int, default=4,
+                        help='Number of phases (default=4)')
+    parser.add_argument('--clusters', type=int, default=5,
+                        help='Number of clusters per phase (default=5)')
+    parser.add_argument('--problems', type=int, default=20,
+                        help='Number of synthetic planning problems (default=20)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default=0)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Also measure the parallel engine with this many workers, on every schedule')
+    args = parser.parse_args()
+    return args
+
+
+def get_inflow(rng, phases, cluster_count):
+    inflow = {}
+    for phase in phases:
+        sequence = ClusterSequence()
+        time = rng.uniform(0, 10)
+        for _ in range(cluster_count):
+            duration = rng.uniform(1, 6)
+            sequence.append(Cluster(rng.randint(1, 4), time, time + duration))
+            time += duration + rng.uniform(0, 15)
+        inflow[phase] = sequence
+    return inflow
+
+
+def get_plan(scheduler, problem):
+    inflow, curr_phase, curr_phase_duration = problem
+    outflow, phase_sequence, phase_durations = scheduler.schedule(inflow, curr_phase, curr_phase_duration)
+    return [(cluster.count, cluster.arrival, cluster.departure) for cluster in outflow], phase_sequence, phase_durations
+
+
+def main():
+    args = get_args()
+
+    rng = random.Random(args.seed)
+    phases = list(range(args.phases))
+    Gmin = {phase: 5 for phase in phases}
+    Gmax = {phase: 60 for phase in phases}
+    Y = {phase: 4 for phase in phases}
+    problems = [(get_inflow(rng, phases, args.clusters), rng.choice(phases), rng.randint(0, 20))
+                for _ in range(args.problems)]
+
+    engines = [('dict', adasco.schedulers.schic.SchIC, {}),
+               ('numpy', adasco.schedulers.schic.DenseSchIC, {'kernel': 'numpy'}),
+               ('python', adasco.schedulers.schic.DenseSchIC, {'kernel': 'python'})]
+    if adasco.schedulers.kernels.COMPILED:
+        engines.append(('jit', adasco.schedulers.schic.DenseSchIC, {'kernel': 'jit'}))
+    else:
+        print('numba is not installed, skipping the jit kernel')
+    if args.workers is not None:
+        engines.append(('parallel', adasco.schedulers.schic.ParallelSchIC, {'kernel': 'numpy',
+                                                                           'workers': args.workers,
+                                                                           'parallel_threshold': 0}))
+
+    print('{} problems, {} phases, {} clusters per phase'.format(args.problems, args.phases, args.clusters))
+    reference = None
+    for name, scheduler_class, kwargs in engines:
+        scheduler = scheduler_class(phases, Gmin, Gmax, Y, 2, **kwargs)
+        # The first solve compiles the jit kernel and starts the parallel
+        # engine's workers
+        get_plan(scheduler, problems[0])
+
+        start = timeit.default_timer()
+        plans = [get_plan(scheduler, problem) for problem in problems]
+        elapsed = timeit.default_timer() - start
+
+        if name == 'parallel':
+            scheduler.close()
+
+        if reference is None:
+            reference = plans
+        print('{:<8} {:10.2f} solves/s, plans identical to dict: {}'.format(name,
+                                                                           len(problems) / elapsed,
+                                                                           plans == reference))
+
+
+if __name__ == '__main__':
+    main()
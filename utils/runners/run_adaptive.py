@@ -16,6 +16,8 @@ import sumolib
 
 import adasco.master
 import adasco.registry
+import adasco.transport
+import adasco.board
 
 logger = logging.getLogger(__name__)
 
@@ -50,11 +52,65 @@ def get_args():
                         help='Time limit for CP scheduler')
     parser.add_argument('--samples', nargs='+', required=True,
                         help='Pickled sample sets')
-    parser.add_argument('--scheduler', required=True, choices=['schic', 'cp', 'milp'],
-                        help='Scheduler type')
+    parser.add_argument('--scheduler', required=True, choices=['schic', 'cp', 'cpsat', 'milp'],
+                        help='Scheduler type (cpsat runs the cp agents with the OR-Tools CP-SAT solver instead of CP Optimizer)')
     parser.add_argument('--agent', required=True, choices=['Exp', 'Heuristic', 'SAA', 'SAANN', 'Hindsight', 'SURTRAC'],
                         help='Adaptive agent to run')
+    parser.add_argument('--detector', default='exact', choices=['exact', 'subscription'],
+                        help='Detector used by the master to read vehicle positions (default=exact)')
+    parser.add_argument('--columnar-sensor-data', action='store_true', default=False,
+                        help='Send sensor data to agents as NumPy arrays instead of lists')
+    parser.add_argument('--transport', default='queue', choices=['queue', 'shm'],
+                        help='Transport for master-to-agent requests (default=queue)')
+    parser.add_argument('--slot-capacity', type=int, default=1024,
+                        help='Maximum number of vehicles per request with the shm transport (default=1024)')
+    parser.add_argument('--vectorised-preprocessor', action='store_true', default=False,
+                        help='Cluster sensor data and split it into phases with NumPy')
+    parser.add_argument('--schic-engine', default='dict', choices=['dict', 'dense', 'incremental', 'parallel'],
+                        help='State storage of the SchIC scheduler used by SURTRAC (default=dict). incremental reuses the states of its last schedule, which needs --gmax-mode resolve')
+    parser.add_argument('--schic-workers', type=int, default=1,
+                        help='Number of worker processes per agent with the parallel SchIC engine; every agent starts its own, so keep agents x workers within the CPU count (default=1, no workers)')
+    parser.add_argument('--parallel-threshold', type=int, default=100000,
+                        help='Minimum number of schedule statuses for the parallel SchIC engine to use its workers (default=100000)')
+    parser.add_argument('--planning-budget', type=float, default=None,
+                        help='Wall-clock budget per SURTRAC plan in seconds; plans for the earliest clusters are returned when it runs out')
+    parser.add_argument('--cluster-cap', type=int, default=None,
+                        help='Maximum number of clusters scheduled per SURTRAC plan')
+    parser.add_argument('--beam-width', type=int, default=None,
+                        help='Number of schedule statuses kept per layer by SchIC (default: all, which is exact)')
+    parser.add_argument('--prune-dominated', action='store_true', default=False,
+                        help='Drop dominated states from SchIC state groups')
+    parser.add_argument('--record-dir', default=None,
+                        help='Directory in which agents record their planning problems')
+    parser.add_argument('--gmax-mode', default='split', choices=['split', 'resolve'],
+                        help='How SURTRAC reschedules clusters that would exceed Gmax: split them within a single solve, or solve again after each violation (default=split). split always runs on the dict SchIC states, so the other engines only speed up resolve')
+    parser.add_argument('--cp-model-cache', type=int, default=0,
+                        help='Number of CP models kept per agent for reuse by structure (default=0, a new model per decision)')
+    parser.add_argument('--warm-start', action='store_true', default=False,
+                        help='Start each CP solve of the SAA agent from its previous plan, shifted to the current time')
+    parser.add_argument('--cp-threads', type=int, default=1,
+                        help='Number of solver threads per CP solve, with either backend (default=1)')
+    parser.add_argument('--decomposition', action='store_true', default=False,
+                        help='Plan for a few representative samples and evaluate the plans on all samples, instead of one model over all samples')
+    parser.add_argument('--representative-samples', type=int, default=2,
+                        help='Number of most frequent samples planned for with --decomposition (default=2)')
+    parser.add_argument('--cp-workers', type=int, default=1,
+                        help='Number of worker processes computing candidate plans with --decomposition (default=1)')
+    parser.add_argument('--adaptive-cycles', action='store_true', default=False,
+                        help='Give each CP model of the SAA agent only the cycles needed to clear its samples, and prune the cluster intervals that cannot fit')
+    parser.add_argument('--max-cycle-count', type=int, default=3,
+                        help='Number of cycles planned by the SAA agent, the maximum with --adaptive-cycles (default=3)')
+    parser.add_argument('--outflow-board', default='manager', choices=['manager', 'shm'],
+                        help='Board through which coordinated agents share their outflows (default=manager)')
+    parser.add_argument('--board-capacity', type=int, default=2048,
+                        help='Maximum number of published records per outgoing edge with the shm board (default=2048)')
     options = parser.parse_args()
+    if options.cluster_cap is not None and options.cluster_cap < 1:
+        parser.error('--cluster-cap must be at least 1')
+    if options.scheduler == 'milp':
+        for flag in ('warm_start', 'decomposition', 'adaptive_cycles'):
+            if getattr(options, flag):
+                parser.error('--{} is not supported by --scheduler milp'.format(flag.replace('_', '-')))
     return options
 
 
@@ -88,6 +144,12 @@ def main():
     log_file = os.path.join(log_dir, label + prefix + '.summary.log')
     trip_file = os.path.join(log_dir, label + prefix + '.trip.xml')
     tls_switch_file = os.path.join(log_dir, label + prefix + '.tlsSwitch.xml')
+
+    record_dir = None
+    if options.record_dir is not None:
+        record_dir = os.path.abspath(options.record_dir)
+        if not os.path.isdir(record_dir):
+            os.makedirs(record_dir)
     
     if options.save_output:
         debug_file = os.path.join(log_dir, label + prefix + '.log')
@@ -113,31 +175,49 @@ def main():
 
     sets = []
     for sample_set in options.samples:
-      with open(sample_set, 'r') as fp:
+      with open(sample_set, 'rb') as fp:
           samples = pickle.load(fp)
           sets.append(samples)
 
     processes = []
 
-    manager = multiprocessing.Manager()
-    shared_results = manager.dict()
-    shared_lock = multiprocessing.Lock()
-
-    registry = adasco.registry.Registry()
-
-    agent_module = importlib.import_module('adasco.agents.{}.{}'.format(options.scheduler, options.agent.lower()))
+    if options.outflow_board == 'shm':
+        outflow_board = adasco.board.OutflowBoard([(info[tls]['id'], edge)
+                                                   for tls in info
+                                                   for edge in info[tls]['outgoing_edges']],
+                                                  capacity=options.board_capacity)
+    else:
+        manager = multiprocessing.Manager()
+        shared_results = manager.dict()
+        shared_lock = multiprocessing.Lock()
+
+    response_queue = multiprocessing.Queue()
+    registry = adasco.registry.Registry(response_queue)
+
+    # The cp agents run with either solver backend of the CP scheduler
+    backend = None
+    agent_package = options.scheduler
+    if options.scheduler in ('cp', 'cpsat'):
+        backend = options.scheduler
+        agent_package = 'cp'
+    agent_module = importlib.import_module('adasco.agents.{}.{}'.format(agent_package, options.agent.lower()))
     agent_class = getattr(agent_module, '{}Agent'.format(options.agent))
 
     for tls in info:
 
-        shared_results[tls] = manager.dict()
+        if options.outflow_board == 'manager':
+            shared_results[tls] = manager.dict()
+            outflow_board = adasco.board.DirectoryBoard(shared_results, shared_lock, shared_results[tls])
 
         Y = {int(phase):value for phase, value in info[tls]['Y'].items()}
         Gmin = {int(phase):value for phase, value in info[tls]['Gmin'].items()}
         Gmax = {int(phase):value for phase, value in info[tls]['Gmax'].items()}
 
-        request_queue = multiprocessing.JoinableQueue()
-        response_queue = multiprocessing.JoinableQueue()
+        if options.transport == 'shm':
+            request_queue = adasco.transport.SharedMemorySlot(info[tls]['incoming_edges'],
+                                                              capacity=options.slot_capacity)
+        else:
+            request_queue = multiprocessing.JoinableQueue()
 
         process = agent_class(ID=info[tls]['id'],
                               phases=info[tls]['phases'],
@@ -159,14 +239,31 @@ def main():
                               horizon_extension=info[tls]['horizon_extension'],
                               extension_threshold=info[tls]['extension_threshold'],
                               minimum_extension=info[tls]['minimum_extension'],
-                              shared_results_directory=shared_results,
-                              shared_lock=shared_lock,
-                              publish_directory=shared_results[tls],
+                              outflow_board=outflow_board,
+                              vectorised_preprocessor=options.vectorised_preprocessor,
+                              schic_engine=options.schic_engine,
+                              schic_workers=options.schic_workers,
+                              parallel_threshold=options.parallel_threshold,
+                              planning_budget=options.planning_budget,
+                              cluster_cap=options.cluster_cap,
+                              beam_width=options.beam_width,
+                              prune_dominated=options.prune_dominated,
+                              record_directory=record_dir,
+                              gmax_mode=options.gmax_mode,
                               coordinate=options.coordinate,
                               request_queue=request_queue,
                               response_queue=response_queue,
                               sample_count=options.sample_count,
                               timelimit=options.timelimit,
+                              backend=backend,
+                              cp_model_cache=options.cp_model_cache,
+                              warm_start=options.warm_start,
+                              cp_threads=options.cp_threads,
+                              cp_workers=options.cp_workers,
+                              decomposition=options.decomposition,
+                              representative_samples=options.representative_samples,
+                              adaptive_cycles=options.adaptive_cycles,
+                              max_cycle_count=options.max_cycle_count,
                               samples=sets)
 
         processes.append(process)
@@ -180,7 +277,10 @@ def main():
                                       Gmin[first_phase])
         registry.append(entry)
 
-    master = adasco.master.Master(options.port, registry)
+    master = adasco.master.Master(options.port,
+                                  registry,
+                                  detector=options.detector,
+                                  columnar=options.columnar_sensor_data)
     processes.append(master)
 
     for process in processes:
@@ -24,7 +24,7 @@ def get_args():
                         help='Run experiments without coordination')
     parser.add_argument('--timelimit', default=5,
                         help='Timelimit for scheduler')
-    parser.add_argument('--scheduler', required=True, choices=['schic', 'cp', 'milp'],
+    parser.add_argument('--scheduler', required=True, choices=['schic', 'cp', 'cpsat', 'milp'],
                         help='Scheduler used by agent')
     parser.add_argument('--agent', required=True, choices=['Exp', 'Heuristic', 'SAA', 'SAANN', 'Hindsight', 'SURTRAC'],
                         help='Adaptive agent to run')